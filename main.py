@@ -5,11 +5,31 @@ Biomarker Analysis and Visualization System
 
 Main application entry point for processing biomarker data
 and generating insights and visualizations.
+
+Subcommands (``rebuild`` is the default when none is given):
+
+    rebuild          Rebuild dashboard data from the JSON files in extract/
+    ingest PDF...    Extract biomarkers from PDF reports
+    export           Export dashboard data for a patient from a report store
+    compact          Move old reports of a report store into compressed cold segments
+    export-columnar  Export long-format biomarker rows to Parquet/Feather/CSV
+    import-fhir      Import FHIR Observation NDJSON into a report store
+    watch INBOX      Run the continuous ingestion daemon
+    batch INPUT...   Run a checkpointed, resumable batch extraction job
+    queue ACTION     Sharded processing through a leased work queue
+                     (init, work, status, merge, or run with local workers)
+    serve            Serve the dashboard with live updates over SSE
+    load-test        Load test the API against a synthetic cohort, offline
+    startup-budget   Check package import time against the startup budget
+
+Each subcommand imports only the modules it needs. ``--profile-memory``
+reports peak RSS and top allocators per pipeline stage; the batch paths
+also take ``--memory-budget MB`` to flush or shrink batches under a limit.
 """
 
 import os
 import sys
-import json
+import argparse
 import logging
 from pathlib import Path
 from typing import List
@@ -17,95 +37,725 @@ from typing import List
 # Add src to path
 sys.path.append(os.path.join(os.path.dirname(__file__), 'src'))
 
-from src.data_processor import BiomarkerDataProcessor
-from src.models import DashboardData
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('app.log'),
-        logging.StreamHandler()
-    ]
-)
+from src.logging_setup import configure_logging
+
+# Configure logging (file + stderr, written by a background thread)
+configure_logging('app.log', level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+BASE_DIR = Path(__file__).parent
+EXTRACT_DIR = BASE_DIR / "extract"
+PUBLIC_DIR = BASE_DIR / "public"
+# Per-layout PDF backend timings, kept across runs
+PDF_STATS_FILE = EXTRACT_DIR / "pdf_backend_stats.json"
+# Cohort percentile tables fetched by the dashboard; every command writes here
+COHORT_STATS_FILE = PUBLIC_DIR / "cohort_stats.json"
+JSON_FILES = [
+    EXTRACT_DIR / "combined_patient_data.json",
+    EXTRACT_DIR / "enhanced_patient_data.json"
+]
+COMMANDS = ("rebuild", "ingest", "export", "compact", "export-columnar", "import-fhir", "watch", "batch",
+            "queue", "serve", "load-test", "startup-budget")
+
+
+def add_memory_arguments(parser, budget: bool = False) -> None:
+    """Add the memory profiling (and optionally memory budget) options"""
+    parser.add_argument("--profile-memory", nargs="?", const="-", metavar="FILE",
+                        help="Report memory use per pipeline stage (JSON to FILE if given)")
+    if budget:
+        parser.add_argument("--memory-budget", type=float, metavar="MB",
+                            help="Flush or shrink batches to keep RSS under this many MB")
+
+
+def add_pdf_stats_argument(parser) -> None:
+    """Add the option naming the PDF backend stats file"""
+    parser.add_argument("--pdf-stats", metavar="FILE", default=str(PDF_STATS_FILE),
+                        help="PDF backend timings per document layout, read and updated "
+                             "(default: extract/pdf_backend_stats.json)")
+
+
+def add_cohort_output_argument(parser) -> None:
+    """Add the option naming the exported cohort statistics file"""
+    parser.add_argument("--cohort-output", metavar="FILE", default=str(COHORT_STATS_FILE),
+                        help="Cohort statistics file read by the dashboard "
+                             "(default: public/cohort_stats.json)")
+
+
+def parse_args(argv=None):
+    """Parse command line arguments"""
+    argv = list(sys.argv[1:] if argv is None else argv)
+    # Keep `python main.py [--db PATH]` working as a plain JSON rebuild
+    if not argv or (argv[0] not in COMMANDS and argv[0] not in ("-h", "--help")):
+        argv.insert(0, "rebuild")
+
+    parser = argparse.ArgumentParser(description="Biomarker Analysis and Visualization System")
+    subparsers = parser.add_subparsers(dest="command")
+
+    rebuild_parser = subparsers.add_parser("rebuild", help="Rebuild dashboard data from JSON files")
+    rebuild_parser.add_argument("--db", metavar="PATH",
+                                help="Also write processed reports to this SQLite report store")
+    add_memory_arguments(rebuild_parser)
+
+    ingest_parser = subparsers.add_parser("ingest", help="Extract biomarkers from PDF reports")
+    ingest_parser.add_argument("pdfs", nargs="+", metavar="PDF")
+    ingest_parser.add_argument("--patient", default="Unknown", help="Patient name for the reports")
+    ingest_parser.add_argument("--age", type=int)
+    ingest_parser.add_argument("--gender")
+    ingest_parser.add_argument("--pdf-mode", choices=["text", "table", "auto"], default="auto",
+                               help="PDF extraction mode")
+    ingest_parser.add_argument("--output", metavar="FILE",
+                               help="Dashboard JSON output (default: extract/processed_patient_data.json)")
+    ingest_parser.add_argument("--db", metavar="PATH",
+                               help="Also write extracted reports to this SQLite report store")
+    add_pdf_stats_argument(ingest_parser)
+    add_memory_arguments(ingest_parser)
+
+    export_parser = subparsers.add_parser("export", help="Export dashboard data from a report store")
+    export_parser.add_argument("--db", metavar="PATH", required=True)
+    export_parser.add_argument("--patient", required=True, metavar="PATIENT_ID")
+    export_parser.add_argument("--output", metavar="FILE",
+                               help="Dashboard JSON output (default: public/dashboard_data.json)")
+    add_memory_arguments(export_parser)
+
+    compact_parser = subparsers.add_parser("compact", help="Move old reports into cold segments")
+    compact_parser.add_argument("--db", metavar="PATH", required=True)
+    compact_parser.add_argument("--older-than-days", type=int, default=365,
+                                help="Compact reports dated more than this many days ago")
+    compact_parser.add_argument("--before", metavar="DATE",
+                                help="Compact reports dated before this ISO date instead")
+    compact_parser.add_argument("--patient", nargs="+", metavar="PATIENT_ID",
+                                help="Only compact these patients")
+    compact_parser.add_argument("--vacuum", action="store_true",
+                                help="Shrink the database file afterwards")
+
+    columnar_parser = subparsers.add_parser("export-columnar",
+                                            help="Export long-format biomarker rows for analytics")
+    columnar_parser.add_argument("--db", metavar="PATH",
+                                 help="Stream rows from this report store (default: the JSON files in extract/)")
+    columnar_parser.add_argument("--format", choices=["parquet", "feather", "csv"], default="parquet")
+    columnar_parser.add_argument("--output", metavar="DIR",
+                                 help="Output directory (default: extract/analytics)")
+    columnar_parser.add_argument("--row-group-size", type=int, default=50_000)
+    add_memory_arguments(columnar_parser, budget=True)
+
+    fhir_parser = subparsers.add_parser("import-fhir", help="Import FHIR Observation NDJSON")
+    fhir_parser.add_argument("ndjson", nargs="+", metavar="NDJSON")
+    fhir_parser.add_argument("--db", metavar="PATH", required=True)
+    fhir_parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                             help="Parser processes")
+    add_memory_arguments(fhir_parser, budget=True)
+
+    watch_parser = subparsers.add_parser("watch", help="Run the continuous ingestion daemon")
+    watch_parser.add_argument("inbox", metavar="INBOX")
+    watch_parser.add_argument("--output", metavar="DIR",
+                              help="Per-patient output directory (default: public/patients)")
+    add_cohort_output_argument(watch_parser)
+    watch_parser.add_argument("--workers", type=int, default=2,
+                              help="Maximum concurrent ingestions")
+    watch_parser.add_argument("--pdf-mode", choices=["text", "table", "auto"], default="auto",
+                              help="PDF extraction mode")
+    watch_parser.add_argument("--poll", action="store_true",
+                              help="Use polling instead of inotify")
+    add_pdf_stats_argument(watch_parser)
+
+    batch_parser = subparsers.add_parser("batch", help="Run a resumable batch extraction job")
+    batch_parser.add_argument("inputs", nargs="+", metavar="INPUT",
+                              help="PDF/JSON files or directories of them")
+    batch_parser.add_argument("--job-dir", metavar="DIR", required=True,
+                              help="Directory for the checkpoint and per-input results")
+    batch_parser.add_argument("--output", metavar="DIR",
+                              help="Per-patient output directory (default: public/patients)")
+    add_cohort_output_argument(batch_parser)
+    batch_parser.add_argument("--pdf-mode", choices=["text", "table", "auto"], default="auto",
+                              help="PDF extraction mode")
+    batch_parser.add_argument("--checkpoint-every", type=int, default=25,
+                              help="Checkpoint after this many inputs")
+    batch_parser.add_argument("--workers", type=int, default=1,
+                              help="Pre-forked extraction worker processes")
+    batch_parser.add_argument("--max-tasks-per-child", type=int, default=100,
+                              help="Recycle each worker after this many inputs")
+    batch_parser.add_argument("--restart", action="store_true",
+                              help="Discard the previous checkpoint and start over")
+    add_pdf_stats_argument(batch_parser)
+    add_memory_arguments(batch_parser, budget=True)
+
+    queue_parser = subparsers.add_parser("queue", help="Sharded processing through a leased work queue")
+    queue_actions = queue_parser.add_subparsers(dest="queue_action", required=True)
+
+    def add_queue_dir(action_parser):
+        action_parser.add_argument("--queue-dir", metavar="DIR", required=True,
+                                   help="Queue directory shared by all workers")
+
+    def add_queue_layout(action_parser):
+        action_parser.add_argument("inputs", nargs="+", metavar="INPUT",
+                                   help="PDF/JSON files or directories of them")
+        action_parser.add_argument("--shards", type=int, default=8,
+                                   help="Partitions of the patients (by patient hash)")
+        action_parser.add_argument("--item-size", type=int, default=50,
+                                   help="Maximum inputs per work item")
+        action_parser.add_argument("--lease-seconds", type=float, default=300.0,
+                                   help="Re-queue an item whose lease is not renewed for this long")
+        action_parser.add_argument("--max-attempts", type=int, default=3,
+                                   help="Give up on an item after this many expired leases")
+        action_parser.add_argument("--pdf-mode", choices=["text", "table", "auto"], default="auto",
+                                   help="PDF extraction mode")
+
+    def add_queue_output(action_parser):
+        action_parser.add_argument("--output", metavar="DIR",
+                                   help="Per-patient output directory (default: public/patients)")
+        add_cohort_output_argument(action_parser)
+
+    queue_init = queue_actions.add_parser("init", help="Partition inputs into work items")
+    add_queue_dir(queue_init)
+    add_queue_layout(queue_init)
+
+    queue_work = queue_actions.add_parser("work", help="Claim and process items until the queue is drained")
+    add_queue_dir(queue_work)
+    queue_work.add_argument("--owner", help="Worker name in leases (default: host-pid)")
+    queue_work.add_argument("--poll-interval", type=float, default=2.0,
+                            help="Seconds between checks while other workers hold leases")
+    add_pdf_stats_argument(queue_work)
+
+    queue_status = queue_actions.add_parser("status", help="Show item states and lease holders")
+    add_queue_dir(queue_status)
+
+    queue_merge = queue_actions.add_parser("merge", help="Merge per-item results into dashboards")
+    add_queue_dir(queue_merge)
+    add_queue_output(queue_merge)
+    queue_merge.add_argument("--partial", action="store_true",
+                             help="Merge even if items are still pending or leased")
+
+    queue_run = queue_actions.add_parser("run", help="Init, process with local workers, and merge")
+    add_queue_dir(queue_run)
+    add_queue_layout(queue_run)
+    add_queue_output(queue_run)
+    queue_run.add_argument("--local-workers", type=int, default=os.cpu_count() or 1,
+                           help="Worker processes standing in for nodes")
+    add_pdf_stats_argument(queue_run)
+
+    serve_parser = subparsers.add_parser("serve", help="Serve the dashboard with live updates")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8000)
+    serve_parser.add_argument("--watch", nargs="+", metavar="PATH",
+                              help="Dashboard JSON files/directories to watch "
+                                   "(default: public/dashboard_data.json and public/patients)")
+    serve_parser.add_argument("--poll-interval", type=float, default=1.0,
+                              help="Seconds between checks of the watched files")
+    serve_parser.add_argument("--db", metavar="PATH",
+                              help="Report store for range queries, uploads and stored patients' dashboards")
+
+    load_parser = subparsers.add_parser("load-test", help="Load test the API against a synthetic cohort")
+    load_parser.add_argument("--workdir", metavar="DIR", default=str(EXTRACT_DIR / "loadtest"),
+                             help="Directory for the synthetic report store (default: extract/loadtest)")
+    load_parser.add_argument("--patients", type=int, default=200)
+    load_parser.add_argument("--reports", type=int, default=12, help="Reports per synthetic patient")
+    load_parser.add_argument("--users", type=int, default=20, help="Concurrent virtual users")
+    load_parser.add_argument("--duration", type=float, default=30.0, help="Measured seconds")
+    load_parser.add_argument("--warmup", type=float, default=3.0, help="Unmeasured seconds before that")
+    load_parser.add_argument("--interval", type=float, default=5.0,
+                             help="Seconds per row of the over-time report")
+    load_parser.add_argument("--mix", metavar="SPEC",
+                             help="Operation weights, e.g. dashboard=70,range=15,cohort=5,upload=10")
+    load_parser.add_argument("--think-ms", type=float, default=0.0,
+                             help="Mean pause between a user's requests")
+    load_parser.add_argument("--seed", type=int, default=7)
+    load_parser.add_argument("--report", metavar="FILE", help="Write the JSON report here")
+    load_parser.add_argument("--baseline", metavar="FILE",
+                             help="Fail if any p99 regressed against this earlier report")
+    load_parser.add_argument("--tolerance", type=float, default=0.10,
+                             help="Allowed p99 regression against the baseline (fraction)")
+    load_parser.add_argument("--max-p99-ms", type=float, help="Fail if the overall p99 exceeds this")
+    load_parser.add_argument("--max-error-rate", type=float, help="Fail if the error rate exceeds this")
+
+    budget_parser = subparsers.add_parser("startup-budget", help="Check import time against the budget")
+    budget_parser.add_argument("--module", default="src.data_processor")
+    budget_parser.add_argument("--budget-ms", type=float)
+
+    return parser.parse_args(argv)
+
+
+def print_summary(dashboard_data, outputs: List[Path]) -> None:
+    """Print a human readable summary of the dashboard data"""
+    print("\n" + "="*60)
+    print("BIOMARKER ANALYSIS SUMMARY")
+    print("="*60)
+    print(f"Patient: {dashboard_data.patient_profile.name}")
+    print(f"Age: {dashboard_data.patient_profile.age}")
+    print(f"Gender: {dashboard_data.patient_profile.gender}")
+    print(f"Total Reports: {dashboard_data.summary_stats['total_reports']}")
+    print(f"Monitoring Period: {dashboard_data.summary_stats['monitoring_period_days']} days")
+    print(f"Total Biomarkers: {dashboard_data.summary_stats['total_biomarkers']}")
+
+    print(f"\nTREND ANALYSIS:")
+    for biomarker_type, trend in dashboard_data.trends.items():
+        print(f"  {biomarker_type.value}: {trend.trend_direction} ({trend.change_percentage:+.1f}%)")
+
+    print(f"\nALERTS ({len(dashboard_data.alerts)}):")
+    for alert in dashboard_data.alerts:
+        print(f"  • {alert['message']}")
+
+    print(f"\nData exported to:")
+    for output in outputs:
+        print(f"  - {output}")
+    print("="*60)
+
+
+def save_to_store(db_path: str, patient_profile) -> None:
+    """Persist a processed profile to the SQLite report store"""
+    from src.store import ReportStore
+
+    with ReportStore(db_path) as store:
+        store.save_patient_profile(patient_profile)
+
+
+def cohort_report_key(report) -> tuple:
+    """Key under which a report is counted once in the cohort sketches
+
+    Legacy reports without a usable date are stamped with the load time, so
+    they are keyed by their original content instead.
+    """
+    import hashlib
+    import json
+    from datetime import datetime
+
+    original = report.extraction_metadata.get("original_data")
+    if isinstance(original, dict):
+        try:
+            datetime.fromisoformat(str(original.get("report_date")).replace('Z', '+00:00'))
+        except ValueError:
+            digest = hashlib.sha1(json.dumps(original, sort_keys=True, default=str).encode("utf-8"))
+            return (f"undated:{digest.hexdigest()[:16]}", report.source_file)
+    return (report.report_date.isoformat(), report.source_file)
+
+
+def update_store_cohort(processor, db_path: str, patient_profile):
+    """Fold the reports not counted yet into the store's persisted cohort sketches
+
+    The sketch state is kept next to the store (``<db>.cohort_state.json``)
+    with the keys of the reports already counted, so a rebuild loads only the
+    stored patients that have reports it has not seen. Sketches cannot forget
+    values: a report replaced under the same key keeps its first readings.
+    """
+    import json
+    from src.batch_jobs import _write_json_atomic
+    from src.cohort_stats import CohortStatistics
+    from src.store import ReportStore
+
+    state_path = Path(f"{db_path}.cohort_state.json")
+    cohort = CohortStatistics()
+    counted = {}
+    if state_path.exists():
+        try:
+            with open(state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            cohort = CohortStatistics.from_dict(state)
+            counted = {patient_id: {tuple(key) for key in keys}
+                       for patient_id, keys in state["counted"].items()}
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"⚠️ Unreadable cohort state {state_path} ({e}); recounting the store")
+            cohort, counted = CohortStatistics(), {}
+
+    def fold(profile) -> int:
+        seen = counted.setdefault(profile.patient_id, set())
+        added = 0
+        for report in profile.reports:
+            key = cohort_report_key(report)
+            if key not in seen:
+                cohort.add_report(report, profile.age, profile.gender)
+                seen.add(key)
+                added += 1
+        return added
+
+    # This patient's stored reports are replaced by the ones just loaded
+    added = fold(patient_profile)
+    with ReportStore(db_path) as store:
+        stored = store.report_keys()
+        pending = [patient_id for patient_id in store.patient_ids()
+                   if patient_id != patient_profile.patient_id
+                   and (patient_id not in counted or not stored.get(patient_id, set()) <= counted[patient_id])]
+        for patient_id in pending:
+            added += fold(processor.load_from_store(store, patient_id))
+    logger.info(f"📊 Cohort: {added} new reports counted ({len(pending)} stored patients loaded)")
+
+    state = cohort.to_dict()
+    state["counted"] = {patient_id: sorted(keys) for patient_id, keys in counted.items()}
+    _write_json_atomic(state_path, state)
+    return cohort
+
+
+def load_cohort_stats(path: Path):
+    """Previously exported cohort tables, or None if there are none"""
+    import json
+    if not path.exists():
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"⚠️ Ignoring unreadable cohort statistics {path}: {e}")
+        return None
+
+
+def report_memory(args) -> None:
+    """Print (and optionally save) the per-stage memory profile of this run"""
+    profiler = getattr(args, "profiler", None)
+    if profiler is None or not profiler.enabled:
+        return
+    print("\nMEMORY PROFILE")
+    print(profiler.format_report())
+    if args.profile_memory != "-":
+        profiler.save(args.profile_memory)
+    profiler.stop()
+
+
+def rebuild(args):
+    """Rebuild dashboard data from the legacy JSON files"""
+    from src.data_processor import BiomarkerDataProcessor
 
-def main():
-    """Main application function"""
     logger.info("Starting Biomarker Analysis System")
-    
-    # Setup paths
-    base_dir = Path(__file__).parent
-    extract_dir = base_dir / "extract"
-    public_dir = base_dir / "public"
-    
+
     # Find JSON data files
-    json_files = [
-        extract_dir / "combined_patient_data.json",
-        extract_dir / "enhanced_patient_data.json"
-    ]
-    
+    json_files = JSON_FILES
+
     # Filter to existing files
     existing_files = [str(f) for f in json_files if f.exists()]
-    
+
     if not existing_files:
         logger.error("No JSON data files found!")
         logger.info("Expected files:")
         for f in json_files:
             logger.info(f"  - {f}")
         return
-    
+
     logger.info(f"Found {len(existing_files)} JSON data files:")
     for f in existing_files:
         logger.info(f"  - {f}")
-    
+
+    # Create data processor
+    processor = BiomarkerDataProcessor(profiler=args.profiler)
+
+    # Process data
+    with processor.profiler.stage("convert"):
+        patient_profile = processor.load_and_process_data(existing_files)
+
+    # Cohort statistics over this patient plus the others in the store; a
+    # single patient is no cohort, so without a store the exported tables
+    # (from batch, queue or watch runs) are only read
+    outputs = []
+    if args.db:
+        cohort = update_store_cohort(processor, args.db, patient_profile)
+        cohort_stats = processor.export_cohort_stats(cohort, str(COHORT_STATS_FILE))
+        outputs.append(COHORT_STATS_FILE)
+    else:
+        cohort_stats = load_cohort_stats(COHORT_STATS_FILE)
+
+    # Create dashboard
+    dashboard_data = processor.build_dashboard_data(patient_profile, cohort_stats)
+
+    # Export enhanced data
+    enhanced_output = EXTRACT_DIR / "processed_patient_data.json"
+    processor.export_to_json(dashboard_data, str(enhanced_output))
+
+    # Export for web dashboard
+    web_output = PUBLIC_DIR / "dashboard_data.json"
+    processor.export_to_json(dashboard_data, str(web_output))
+
+    # Persist reports to the SQLite store for cohort queries
+    if args.db:
+        save_to_store(args.db, dashboard_data.patient_profile)
+
+    print_summary(dashboard_data, [enhanced_output, web_output] + outputs)
+
+
+def ingest(args):
+    """Extract biomarkers from PDF reports into dashboard data"""
+    from src.data_processor import BiomarkerDataProcessor
+    from src.models import PatientProfile
+
+    processor = BiomarkerDataProcessor(profiler=args.profiler, pdf_stats_path=args.pdf_stats)
+    with processor.profiler.stage("extract"):
+        reports = [processor.extractor.parse_pdf_report(pdf, mode=args.pdf_mode) for pdf in args.pdfs]
+    processor.extractor.pdf_backends.save_stats()
+    reports.sort(key=lambda r: r.report_date)
+
+    patient_profile = PatientProfile(
+        patient_id=args.patient.replace(" ", "_").upper(),
+        name=args.patient,
+        age=args.age,
+        gender=args.gender,
+        reports=reports
+    )
+    dashboard_data = processor.build_dashboard_data(patient_profile)
+
+    output = Path(args.output) if args.output else EXTRACT_DIR / "processed_patient_data.json"
+    processor.export_to_json(dashboard_data, str(output))
+    if args.db:
+        save_to_store(args.db, patient_profile)
+
+    print_summary(dashboard_data, [output])
+
+
+def export(args):
+    """Export dashboard data for one patient from the report store"""
+    from src.data_processor import BiomarkerDataProcessor
+    from src.store import ReportStore
+
+    processor = BiomarkerDataProcessor(profiler=args.profiler)
+    with ReportStore(args.db) as store, processor.profiler.stage("convert"):
+        patient_profile = processor.load_from_store(store, args.patient)
+    dashboard_data = processor.build_dashboard_data(patient_profile)
+
+    output = Path(args.output) if args.output else PUBLIC_DIR / "dashboard_data.json"
+    processor.export_to_json(dashboard_data, str(output))
+    print_summary(dashboard_data, [output])
+
+
+def compact(args):
+    """Compact finalized history into the cold tier of the report store"""
+    from datetime import datetime, timedelta
+    from src.store import ReportStore
+
+    before = (datetime.fromisoformat(args.before) if args.before
+              else datetime.now() - timedelta(days=args.older_than_days))
+    with ReportStore(args.db) as store:
+        totals = store.compact(before, patient_ids=args.patient)
+        if args.vacuum:
+            store.conn.execute("VACUUM")
+        stats = store.tier_stats()
+
+    print(f"Compacted {totals['reports']} reports ({totals['readings']} readings) of "
+          f"{totals['patients']} patients dated before {before:%Y-%m-%d}")
+    print(f"  hot:  {stats['hot_reports']} reports, {stats['hot_readings']} readings, "
+          f"{stats['hot_db_bytes'] / 1024:.0f} KB database")
+    print(f"  cold: {stats['cold_reports']} reports, {stats['cold_readings']} readings in "
+          f"{stats['segments']} segments, {stats['cold_segment_bytes'] / 1024:.0f} KB")
+
+
+def export_columnar(args):
+    """Stream processed readings to partitioned columnar files"""
+    from src.columnar_export import ColumnarExporter, rows_from_profiles, rows_from_store
+
+    output = args.output or str(EXTRACT_DIR / "analytics")
+    exporter = ColumnarExporter(output, fmt=args.format, row_group_size=args.row_group_size,
+                                memory_budget_mb=args.memory_budget)
+
+    if args.db:
+        from src.store import ReportStore
+        with ReportStore(args.db) as store, args.profiler.stage("export"):
+            result = exporter.export(rows_from_store(store))
+    else:
+        from src.data_processor import BiomarkerDataProcessor
+        json_files = [str(f) for f in JSON_FILES if f.exists()]
+        with args.profiler.stage("convert"):
+            patient_profile = BiomarkerDataProcessor().load_and_process_data(json_files)
+        with args.profiler.stage("export"):
+            result = exporter.export(rows_from_profiles([patient_profile]))
+
+    print(f"Exported {result['rows']} rows in {result['partitions']} {result['format']} partition(s) to {output}")
+
+
+def import_fhir(args):
+    """Import FHIR bulk NDJSON exports into the report store"""
+    from src.fhir_import import FhirNdjsonImporter
+    from src.store import ReportStore
+
+    importer = FhirNdjsonImporter(workers=args.workers, memory_budget_mb=args.memory_budget)
+    if importer.workers > 1:
+        args.profiler.note(f"NDJSON parsing ran in {importer.workers} worker processes; "
+                           f"the convert stage covers grouping and store writes in this process only")
+    with ReportStore(args.db) as store:
+        for path in args.ndjson:
+            with args.profiler.stage("convert"):
+                totals = importer.import_to_store(path, store)
+            skipped = f", {totals['rejected']} observations skipped" if totals["rejected"] else ""
+            print(f"{path}: {totals['reports']} reports for {totals['patients']} patients{skipped}")
+
+
+def watch(args):
+    """Run the inbox ingestion daemon until interrupted"""
+    import asyncio
+    from src.watcher import IngestionDaemon
+
+    daemon = IngestionDaemon(
+        inbox_dir=args.inbox,
+        output_dir=args.output or str(PUBLIC_DIR / "patients"),
+        cohort_output=args.cohort_output,
+        max_workers=args.workers,
+        pdf_mode=args.pdf_mode,
+        use_inotify=not args.poll,
+        pdf_stats_path=args.pdf_stats
+    )
+    try:
+        asyncio.run(daemon.run())
+    except KeyboardInterrupt:
+        logger.info("Ingestion daemon stopped")
+
+
+def batch(args):
+    """Run a checkpointed batch job; rerunning after a kill resumes it"""
+    from src.batch_jobs import BatchJob
+
+    job = BatchJob(
+        job_dir=args.job_dir,
+        output_dir=args.output or str(PUBLIC_DIR / "patients"),
+        cohort_output=args.cohort_output,
+        pdf_mode=args.pdf_mode,
+        checkpoint_every=args.checkpoint_every,
+        memory_budget_mb=args.memory_budget,
+        profiler=args.profiler,
+        workers=args.workers,
+        max_tasks_per_child=args.max_tasks_per_child,
+        pdf_stats_path=args.pdf_stats
+    )
+    summary = job.run(args.inputs, restart=args.restart)
+    print(f"Batch job: {summary['done']} done, {summary['failed']} failed, "
+          f"{summary['patients']} patients exported")
+    for worker in job.worker_report:
+        print(f"  worker {worker['pid']}: {worker['tasks']} inputs, "
+              f"{worker['tasks_per_second']:.2f} inputs/s while busy, "
+              f"peak RSS {worker['rss_peak_mb']:.1f} MB")
+    if summary["interrupted"]:
+        print(f"Interrupted; rerun with --job-dir {args.job_dir} to resume")
+        sys.exit(130)
+
+
+def queue(args):
+    """Coordinate or take part in sharded processing through a work queue"""
+    from src.work_queue import QueueWorker, WorkQueue, merge_results, spawn_local_workers
+
+    output = getattr(args, "output", None) or str(PUBLIC_DIR / "patients")
+
+    if args.queue_action in ("init", "run"):
+        work_queue = WorkQueue.create(
+            args.queue_dir, args.inputs,
+            shards=args.shards,
+            item_size=args.item_size,
+            lease_seconds=args.lease_seconds,
+            max_attempts=args.max_attempts,
+            pdf_mode=args.pdf_mode
+        )
+        manifest = work_queue.manifest
+        print(f"Queued {manifest['inputs']} inputs as {manifest['items']} items in {args.queue_dir}")
+
+    if args.queue_action == "work":
+        summary = QueueWorker(args.queue_dir, owner=args.owner, poll_interval=args.poll_interval,
+                              pdf_stats_path=args.pdf_stats).run()
+        print(f"Worker {summary['owner']}: {summary['items']} items, {summary['inputs']} inputs")
+        if summary["interrupted"]:
+            sys.exit(130)
+
+    elif args.queue_action == "status":
+        status = WorkQueue(args.queue_dir).status()
+        print(f"{status['items']} items: {status['pending']} pending, {status['leased']} leased, "
+              f"{status['done']} done, {status['failed']} failed")
+        for lease in status["leases"]:
+            print(f"  {lease['item_id']} leased by {lease['owner']} ({lease['age_seconds']:.0f}s since renewal)")
+
+    elif args.queue_action == "run":
+        workers = spawn_local_workers(args.queue_dir, args.local_workers, pdf_stats_path=args.pdf_stats)
+        failed = [worker.args for worker in workers if worker.wait() != 0]
+        if failed:
+            logger.warning(f"{len(failed)} local worker(s) exited with an error")
+
+    if args.queue_action in ("merge", "run"):
+        summary = merge_results(args.queue_dir, output, allow_partial=getattr(args, "partial", False),
+                                cohort_output=args.cohort_output)
+        print(f"Merged {summary['items']} items into {summary['patients']} patients "
+              f"({summary['failed_items']} items and {summary['failed_inputs']} inputs failed)")
+
+
+def serve(args):
+    """Serve public/ plus the live update API from one async process"""
+    import uvicorn
+    from src.api import create_app
+
+    watch_paths = args.watch or [str(PUBLIC_DIR / "dashboard_data.json"), str(PUBLIC_DIR / "patients")]
+    app = create_app(str(PUBLIC_DIR), watch_paths, poll_interval=args.poll_interval, store_path=args.db)
+    # log_config=None keeps uvicorn on our background log writer; event streams
+    # never end on their own, so shutdown closes them after a short grace period
+    uvicorn.run(app, host=args.host, port=args.port, log_config=None, access_log=False,
+                timeout_graceful_shutdown=3)
+
+
+def load_test(args):
+    """Load test a locally started server; exits non-zero when a gate fails"""
+    import json
+    from src.load_test import check_regression, format_report, parse_mix, run_local, save_report
+
+    report = run_local(
+        args.workdir,
+        patients=args.patients,
+        reports_per_patient=args.reports,
+        users=args.users,
+        duration=args.duration,
+        warmup=args.warmup,
+        mix=parse_mix(args.mix),
+        seed=args.seed,
+        interval=args.interval,
+        think_ms=args.think_ms
+    )
+    print(format_report(report))
+    if args.report:
+        save_report(report, args.report)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+    problems = check_regression(report, max_p99_ms=args.max_p99_ms, max_error_rate=args.max_error_rate,
+                                baseline=baseline, tolerance=args.tolerance)
+    for problem in problems:
+        print(f"  ✗ {problem}")
+    if problems:
+        sys.exit(1)
+
+
+def startup_budget(args):
+    """Check import time of a module against the startup budget"""
+    from src.startup import check_startup_budget, measure_import_time, DEFAULT_BUDGET_MS
+
+    budget_ms = args.budget_ms or DEFAULT_BUDGET_MS
+    # One cold import in a fresh interpreter, both reported and checked
+    measurement = measure_import_time(args.module)
+    total_ms, _ = measurement
+    problems = check_startup_budget(args.module, budget_ms, measurement=measurement)
+    print(f"import {args.module}: {total_ms:.1f} ms (budget {budget_ms:.0f} ms)")
+    for problem in problems:
+        print(f"  ✗ {problem}")
+    if problems:
+        sys.exit(1)
+
+
+def main():
+    """Main application function"""
+    args = parse_args()
+    from src.memory_profile import MemoryProfiler
+    args.profiler = MemoryProfiler(enabled=bool(getattr(args, "profile_memory", None)))
+    handlers = {
+        "rebuild": rebuild,
+        "ingest": ingest,
+        "export": export,
+        "compact": compact,
+        "export-columnar": export_columnar,
+        "import-fhir": import_fhir,
+        "watch": watch,
+        "batch": batch,
+        "queue": queue,
+        "serve": serve,
+        "load-test": load_test,
+        "startup-budget": startup_budget,
+    }
+
     try:
-        # Create data processor
-        processor = BiomarkerDataProcessor()
-        
-        # Process data and create dashboard
-        dashboard_data = processor.create_dashboard_data(existing_files)
-        
-        # Export enhanced data
-        enhanced_output = extract_dir / "processed_patient_data.json"
-        processor.export_to_json(dashboard_data, str(enhanced_output))
-        
-        # Export for web dashboard
-        web_output = public_dir / "dashboard_data.json"
-        processor.export_to_json(dashboard_data, str(web_output))
-        
-        # Print summary
-        print("\n" + "="*60)
-        print("BIOMARKER ANALYSIS SUMMARY")
-        print("="*60)
-        print(f"Patient: {dashboard_data.patient_profile.name}")
-        print(f"Age: {dashboard_data.patient_profile.age}")
-        print(f"Gender: {dashboard_data.patient_profile.gender}")
-        print(f"Total Reports: {dashboard_data.summary_stats['total_reports']}")
-        print(f"Monitoring Period: {dashboard_data.summary_stats['monitoring_period_days']} days")
-        print(f"Total Biomarkers: {dashboard_data.summary_stats['total_biomarkers']}")
-        
-        print(f"\nTREND ANALYSIS:")
-        for biomarker_type, trend in dashboard_data.trends.items():
-            print(f"  {biomarker_type.value}: {trend.trend_direction} ({trend.change_percentage:+.1f}%)")
-        
-        print(f"\nALERTS ({len(dashboard_data.alerts)}):")
-        for alert in dashboard_data.alerts:
-            print(f"  • {alert['message']}")
-        
-        print(f"\nData exported to:")
-        print(f"  - {enhanced_output}")
-        print(f"  - {web_output}")
-        print("="*60)
-        
-        logger.info("Application completed successfully!")
-        
+        handlers[args.command](args)
+        report_memory(args)
+        if args.command != "startup-budget":
+            logger.info("Application completed successfully!")
+
     except Exception as e:
         logger.error(f"Application failed: {str(e)}")
         raise
 
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
@@ -214,6 +214,39 @@ function predictNextValue(dates, values) {
   return Math.round((slope*nextX+intercept)*100)/100;
 }
 
+// --- Chart Downsampling ---
+// Charts plot at most this many points; longer histories arrive without
+// trend.values/dates and are plotted from the server's precomputed LTTB
+// levels in trend.resolutions (RESOLUTION_TARGETS in src/downsampling.py).
+const CHART_MAX_POINTS = 200;
+
+function pickResolution(trend, maxPoints) {
+  const levels = trend && trend.resolutions ? Object.keys(trend.resolutions).map(Number) : [];
+  const fitting = levels.filter(size => size <= maxPoints);
+  return fitting.length ? trend.resolutions[String(Math.max(...fitting))] : null;
+}
+
+function thinToResolution(series, labels, trend) {
+  // Keep only the readings whose exact timestamps survive in the downsampled
+  // level, each level point at most once, so same-day readings stay in budget
+  if (labels.length <= CHART_MAX_POINTS) return series;
+  const level = pickResolution(trend, CHART_MAX_POINTS);
+  if (!level) return series;
+  const remaining = new Map();
+  for (const d of level.dates) remaining.set(String(d), (remaining.get(String(d)) || 0) + 1);
+  const idx = [];
+  labels.forEach((l, i) => {
+    const left = remaining.get(String(l));
+    if (left) {
+      remaining.set(String(l), left - 1);
+      idx.push(i);
+    }
+  });
+  const thinned = {};
+  for (const [name, arr] of Object.entries(series)) thinned[name] = idx.map(i => arr[i]);
+  return thinned;
+}
+
 // --- Comparative Analytics (static demo) ---
 const populationAverages = {
   'Total Cholesterol': 170,
@@ -226,6 +259,21 @@ const populationAverages = {
   'Vitamin B12': 350
 };
 
+// Replace the static averages with cohort means exported by the processor
+// (cohort_stats.json); keeps the static table when the file is absent.
+async function loadCohortAverages() {
+  try {
+    const res = await fetch('cohort_stats.json');
+    if (!res.ok) return;
+    const cohort = await res.json();
+    for (const [biomarker, entry] of Object.entries(cohort.biomarkers || {})) {
+      if (entry.overall && entry.overall.count) populationAverages[biomarker] = entry.overall.mean;
+    }
+  } catch (e) {
+    // Static demo averages remain in place
+  }
+}
+
 // --- API Integration Info ---
 function renderApiInfo() {
   const el = document.getElementById('api-info');
@@ -233,7 +281,7 @@ function renderApiInfo() {
   el.innerHTML = `<div class="api-info-card">
     <h3>API Integration</h3>
     <p>Connect your LIS/EMR system to this dashboard using our REST API.</p>
-    <pre style="background:#111827;color:#FF204E;padding:0.7em 1em;border-radius:0.7em;font-size:1.1em;overflow-x:auto;">POST /api/upload_lab_report\nGET /api/patient/:id/biomarkers</pre>
+    <pre style="background:#111827;color:#FF204E;padding:0.7em 1em;border-radius:0.7em;font-size:1.1em;overflow-x:auto;">POST /api/patients/:id/reports\nGET /api/patients/:id/biomarkers/:name?since=&until=\nGET /api/patients/:id/trends/:name?since=&until=&max_points=\nGET /api/biomarkers/:name?min_value=&since=\nGET /api/patients/:id/events (live updates, SSE)</pre>
   </div>`;
 }
 
@@ -338,9 +386,10 @@ function renderCharts(trends, dedupedReports) {
   }
   for (const key in trends) {
     const trend = trends[key];
-    // Use trend.values and trend.dates for chart data
-    const values = trend.values || [];
-    const labels = trend.dates || [];
+    // Use trend.values and trend.dates for chart data (a downsampled level for long histories)
+    const level = (trend.values || []).length ? null : pickResolution(trend, CHART_MAX_POINTS);
+    const values = (level || trend).values || [];
+    const labels = (level || trend).dates || [];
     const pointColors = values.map((v, i) => {
       // Try to get status from dedupedReports for this date/biomarker
       const report = dedupedReports.find(r => r.report_date === labels[i]);
@@ -501,7 +550,7 @@ document.getElementById('upload-json').onchange = function(e) {
     try {
       const data = JSON.parse(evt.target.result);
       localStorage.setItem('uploaded_dashboard_data', JSON.stringify(data));
-      location.reload();
+      main();
     } catch (err) {
       alert('Invalid JSON file.');
     }
@@ -511,7 +560,7 @@ document.getElementById('upload-json').onchange = function(e) {
 
 document.getElementById('refresh-btn').onclick = () => {
   localStorage.removeItem('uploaded_dashboard_data');
-  location.reload();
+  main();
 };
 
 document.getElementById('privacy-toggle').onchange = function(e) {
@@ -537,7 +586,7 @@ function updatePatientSelector(patients, currentId) {
     sel.value = currentId;
     sel.onchange = function() {
       localStorage.setItem('selected_patient_id', sel.value);
-      location.reload();
+      main();
     };
   } else {
     sel.style.display = 'none';
@@ -592,85 +641,120 @@ function renderAlertsPanel(alerts) {
 }
 
 // --- Render Chart Grid (3-column, responsive) ---
+// biomarker -> { card, chart }, so live updates can redraw a single chart
+const gridCharts = {};
+
 function renderChartGrid(trends, dedupedReports) {
   const el = document.getElementById('chart-grid');
   if (!el) return;
   el.innerHTML = '';
+  for (const key of Object.keys(gridCharts)) {
+    gridCharts[key].chart.destroy();
+    delete gridCharts[key];
+  }
   // Find all unique biomarkers
   let allBiomarkers = new Set();
   dedupedReports.forEach(r => Object.keys(r.biomarkers).forEach(b => allBiomarkers.add(b)));
   allBiomarkers = Array.from(allBiomarkers);
   for (const key of allBiomarkers) {
-    const values = [];
-    const labels = [];
-    const units = [];
-    const statuses = [];
-    const refs = [];
-    for (const report of dedupedReports) {
-      const biomarkerObj = report.biomarkers[key];
-      if (biomarkerObj && typeof biomarkerObj === 'object' && biomarkerObj.value !== undefined) {
-        values.push(biomarkerObj.value);
-        labels.push(report.report_date);
-        units.push(biomarkerObj.unit || '');
-        statuses.push(biomarkerObj.status || '');
-        refs.push(biomarkerObj.reference_range ? `${biomarkerObj.reference_range.min} - ${biomarkerObj.reference_range.max} ${biomarkerObj.unit || ''}` : '');
-      }
-    }
     const card = document.createElement('div');
     card.className = 'chart-card';
     card.style.border = '2px solid #FF204E';
     card.style.background = '#fff';
-    card.innerHTML = `<h3>${key}</h3><canvas></canvas>`;
     el.appendChild(card);
-    const ctx = card.querySelector('canvas').getContext('2d');
-    new Chart(ctx, {
-      type: 'line',
-      data: {
-        labels,
-        datasets: [{
-          label: key,
-          data: values,
-          borderColor: '#2563eb',
-          backgroundColor: 'rgba(37,99,235,0.08)',
-          pointRadius: 5,
-          pointBackgroundColor: statuses.map(s => getStatusColor(s)),
-          pointBorderColor: '#fff',
-          pointHoverRadius: 7,
-          tension: 0.4,
-          fill: true
-        }]
-      },
-      options: {
-        plugins: {
-          legend: { display: false },
-          tooltip: {
-            enabled: true,
-            callbacks: {
-              title: ctx => `Date: ${ctx[0].label}`,
-              label: ctx => {
-                const i = ctx.dataIndex;
-                return [
-                  `Value: ${ctx.parsed.y} ${units[i]}`,
-                  `Status: ${statuses[i]}`,
-                  refs[i] ? `Ref: ${refs[i]}` : ''
-                ].filter(Boolean);
-              }
+    renderChartGridCard(card, key, trends, dedupedReports);
+  }
+}
+
+// Redraw (or add, or remove) the chart of one biomarker in place
+function patchChartGridCard(key, trends, dedupedReports) {
+  const el = document.getElementById('chart-grid');
+  if (!el) return;
+  const existing = gridCharts[key];
+  if (existing) existing.chart.destroy();
+  if (!dedupedReports.some(r => r.biomarkers[key])) {
+    if (existing) existing.card.remove();
+    delete gridCharts[key];
+    return;
+  }
+  let card = existing && existing.card;
+  if (!card) {
+    card = document.createElement('div');
+    card.className = 'chart-card';
+    card.style.border = '2px solid #FF204E';
+    card.style.background = '#fff';
+    el.appendChild(card);
+  }
+  renderChartGridCard(card, key, trends, dedupedReports, { duration: 0 });
+}
+
+function renderChartGridCard(card, key, trends, dedupedReports, animation) {
+  let values = [];
+  let labels = [];
+  let units = [];
+  let statuses = [];
+  let refs = [];
+  for (const report of dedupedReports) {
+    const biomarkerObj = report.biomarkers[key];
+    if (biomarkerObj && typeof biomarkerObj === 'object' && biomarkerObj.value !== undefined) {
+      values.push(biomarkerObj.value);
+      labels.push(report.report_date);
+      units.push(biomarkerObj.unit || '');
+      statuses.push(biomarkerObj.status || '');
+      refs.push(biomarkerObj.reference_range ? `${biomarkerObj.reference_range.min} - ${biomarkerObj.reference_range.max} ${biomarkerObj.unit || ''}` : '');
+    }
+  }
+  ({ values, units, statuses, refs, labels } = thinToResolution({ values, units, statuses, refs, labels }, labels, trends && trends[key]));
+  card.innerHTML = `<h3>${key}</h3><canvas></canvas>`;
+  const ctx = card.querySelector('canvas').getContext('2d');
+  const chart = new Chart(ctx, {
+    type: 'line',
+    data: {
+      labels,
+      datasets: [{
+        label: key,
+        data: values,
+        borderColor: '#2563eb',
+        backgroundColor: 'rgba(37,99,235,0.08)',
+        pointRadius: 5,
+        pointBackgroundColor: statuses.map(s => getStatusColor(s)),
+        pointBorderColor: '#fff',
+        pointHoverRadius: 7,
+        tension: 0.4,
+        fill: true
+      }]
+    },
+    options: {
+      plugins: {
+        legend: { display: false },
+        tooltip: {
+          enabled: true,
+          callbacks: {
+            title: ctx => `Date: ${ctx[0].label}`,
+            label: ctx => {
+              const i = ctx.dataIndex;
+              return [
+                `Value: ${ctx.parsed.y} ${units[i]}`,
+                `Status: ${statuses[i]}`,
+                refs[i] ? `Ref: ${refs[i]}` : ''
+              ].filter(Boolean);
             }
-          },
-          title: { display: false }
-        },
-        interaction: { mode: 'nearest', intersect: false },
-        hover: { mode: 'nearest', intersect: false },
-        scales: {
-          x: { title: { display: true, text: 'Date' } },
-          y: { title: { display: true, text: 'Value' }, beginAtZero: false }
+          }
         },
-        responsive: true,
-        maintainAspectRatio: false,
-        animation: { duration: 900, easing: 'easeOutQuart' }
-      }
-    });
-  }
+        title: { display: false }
+      },
+      interaction: { mode: 'nearest', intersect: false },
+      hover: { mode: 'nearest', intersect: false },
+      scales: {
+        x: { title: { display: true, text: 'Date' } },
+        y: { title: { display: true, text: 'Value' }, beginAtZero: false }
+      },
+      responsive: true,
+      maintainAspectRatio: false,
+      animation: animation || { duration: 900, easing: 'easeOutQuart' }
+    }
+  });
+  gridCharts[key] = { card, chart };
 }
 
 // --- Render Trend Cards Sidebar ---
@@ -726,22 +810,56 @@ function renderTabularDataPanel(dedupedReports) {
   for (const b of allBiomarkers) html += `<th>${b}</th>`;
   html += '</tr></thead><tbody>';
   for (const report of dedupedReports) {
-    html += `<tr><td>${report.report_date}</td>`;
-    for (const b of allBiomarkers) {
-      const obj = report.biomarkers[b];
-      if (obj && typeof obj === 'object' && obj.value !== undefined) {
-        html += `<td tabindex="0" class="${obj.status ? obj.status.toLowerCase() : ''}">${obj.value} ${obj.unit || ''}<br><span class="ref-range">${obj.reference_range ? obj.reference_range.min + ' - ' + obj.reference_range.max + ' ' + (obj.unit || '') : ''}</span></td>`;
-      } else {
-        html += '<td>-</td>';
-      }
-    }
-    html += '</tr>';
+    html += `<tr data-date="${report.report_date}">${tabularRowCells(report, allBiomarkers)}</tr>`;
   }
   html += '</tbody></table></div>';
   el.innerHTML = html;
+  el.dataset.columns = JSON.stringify(allBiomarkers);
   animateTable();
 }
 
+function tabularRowCells(report, allBiomarkers) {
+  let html = `<td>${report.report_date}</td>`;
+  for (const b of allBiomarkers) {
+    const obj = report.biomarkers[b];
+    if (obj && typeof obj === 'object' && obj.value !== undefined) {
+      html += `<td tabindex="0" class="${obj.status ? obj.status.toLowerCase() : ''}">${obj.value} ${obj.unit || ''}<br><span class="ref-range">${obj.reference_range ? obj.reference_range.min + ' - ' + obj.reference_range.max + ' ' + (obj.unit || '') : ''}</span></td>`;
+    } else {
+      html += '<td>-</td>';
+    }
+  }
+  return html;
+}
+
+// Replace, insert or drop the table row of one date; new columns need a full render
+function patchTabularRow(date, dedupedReports) {
+  const el = document.getElementById('data-table-section');
+  if (!el) return;
+  let allBiomarkers = new Set();
+  dedupedReports.forEach(r => Object.keys(r.biomarkers).forEach(b => allBiomarkers.add(b)));
+  allBiomarkers = Array.from(allBiomarkers);
+  const tbody = el.querySelector('tbody');
+  if (!tbody || el.dataset.columns !== JSON.stringify(allBiomarkers)) {
+    renderTabularDataPanel(dedupedReports);
+    return;
+  }
+  const report = dedupedReports.find(r => r.report_date === date);
+  const row = tbody.querySelector(`tr[data-date="${date}"]`);
+  if (!report) {
+    if (row) row.remove();
+    return;
+  }
+  if (row) {
+    row.innerHTML = tabularRowCells(report, allBiomarkers);
+    return;
+  }
+  const newRow = document.createElement('tr');
+  newRow.dataset.date = date;
+  newRow.innerHTML = tabularRowCells(report, allBiomarkers);
+  const next = Array.from(tbody.rows).find(r => r.dataset.date > date);
+  tbody.insertBefore(newRow, next || null);
+}
+
 // --- Render AI Footer Clinical Summary ---
 function renderAIFooterSummary(alerts, dedupedReports) {
   // Compose summary: count normal, borderline, abnormal
@@ -770,6 +888,128 @@ function renderAIFooterSummary(alerts, dedupedReports) {
   summaryEl.innerHTML = summary;
 }
 
+// --- Live updates (Server-Sent Events from `python main.py serve`) ---
+let dashboardState = null;
+let liveSource = null;
+let livePatchFrame = null;
+const livePending = { charts: new Set(), dates: new Set(), alerts: false, summary: false, profile: false };
+
+function renderDashboard(data) {
+  dashboardState = data;
+  // Deduplicate reports for chart clarity
+  const dedupedReports = deduplicateReports(data.patient_profile.reports);
+  renderPatientSnapshot(data.patient_profile, dedupedReports);
+  renderSummary(data.summary_stats, dedupedReports, data.alerts);
+  renderAlertsPanel(data.alerts);
+  renderTrendSidebar(dedupedReports);
+  renderChartGrid(data.trends, dedupedReports);
+  renderTabularDataPanel(dedupedReports);
+  renderAIFooterSummary(data.alerts, dedupedReports);
+  showAlertBanner(data.alerts || []);
+}
+
+function sameAlert(a, b) {
+  return a.biomarker === b.biomarker && a.type === b.type && a.status === b.status
+    && a.value === b.value && a.message === b.message;
+}
+
+function markReportDirty(report) {
+  livePending.dates.add(String(report.report_date).slice(0, 10));
+  Object.keys(report.biomarkers || {}).forEach(b => livePending.charts.add(b));
+}
+
+const liveHandlers = {
+  report_added: ({ report }) => {
+    const reports = dashboardState.patient_profile.reports;
+    const i = reports.findIndex(r => r.report_date === report.report_date && r.source_file === report.source_file);
+    if (i >= 0) markReportDirty(reports.splice(i, 1)[0]);
+    reports.push(report);
+    reports.sort((a, b) => String(a.report_date).localeCompare(String(b.report_date)));
+    markReportDirty(report);
+  },
+  report_removed: ({ report_date, source_file }) => {
+    const reports = dashboardState.patient_profile.reports;
+    const i = reports.findIndex(r => r.report_date === report_date && r.source_file === source_file);
+    if (i >= 0) markReportDirty(reports.splice(i, 1)[0]);
+  },
+  trend_changed: ({ biomarker, trend }) => {
+    dashboardState.trends[biomarker] = trend;
+    livePending.charts.add(biomarker);
+  },
+  trend_removed: ({ biomarker }) => {
+    delete dashboardState.trends[biomarker];
+    livePending.charts.add(biomarker);
+  },
+  alert_added: ({ alert }) => {
+    dashboardState.alerts.push(alert);
+    livePending.alerts = true;
+  },
+  alert_cleared: ({ alert }) => {
+    dashboardState.alerts = dashboardState.alerts.filter(a => !sameAlert(a, alert));
+    livePending.alerts = true;
+  },
+  summary_changed: ({ summary_stats }) => {
+    dashboardState.summary_stats = summary_stats;
+    livePending.summary = true;
+  },
+  profile_changed: (details) => {
+    Object.assign(dashboardState.patient_profile, { name: details.name, age: details.age, gender: details.gender });
+    livePending.profile = true;
+  }
+};
+
+// Patch only what the batched events touched, once per animation frame
+function applyLivePatch() {
+  livePatchFrame = null;
+  const data = dashboardState;
+  const dedupedReports = deduplicateReports(data.patient_profile.reports);
+  const reportsChanged = livePending.dates.size > 0;
+  if (livePending.profile || reportsChanged) renderPatientSnapshot(data.patient_profile, dedupedReports);
+  if (reportsChanged) {
+    renderTrendSidebar(dedupedReports);
+    for (const date of livePending.dates) patchTabularRow(date, dedupedReports);
+  }
+  for (const key of livePending.charts) patchChartGridCard(key, data.trends, dedupedReports);
+  if (livePending.summary || livePending.alerts || reportsChanged) renderSummary(data.summary_stats, dedupedReports, data.alerts);
+  if (livePending.alerts) {
+    renderAlertsPanel(data.alerts);
+    showAlertBanner(data.alerts || []);
+  }
+  if (livePending.alerts || reportsChanged) renderAIFooterSummary(data.alerts, dedupedReports);
+  livePending.charts.clear();
+  livePending.dates.clear();
+  livePending.alerts = livePending.summary = livePending.profile = false;
+}
+
+function connectLiveUpdates(patientId) {
+  if (liveSource) {
+    liveSource.close();
+    liveSource = null;
+  }
+  // Only available when served by the API server, not from static hosting or file://
+  if (!patientId || !window.EventSource || !location.protocol.startsWith('http')) return;
+  liveSource = new EventSource(`/api/patients/${encodeURIComponent(patientId)}/events`);
+  for (const [type, handler] of Object.entries(liveHandlers)) {
+    liveSource.addEventListener(type, (e) => {
+      if (!dashboardState) return;
+      handler(JSON.parse(e.data));
+      if (!livePatchFrame) livePatchFrame = requestAnimationFrame(applyLivePatch);
+    });
+  }
+  // resync: missed events (or a restarted server); patient_added: the server
+  // (re)loaded this patient's dashboard. Either way, refetch the whole document.
+  const refetchDashboard = async () => {
+    const res = await fetch(`/api/patients/${encodeURIComponent(patientId)}/dashboard`);
+    if (res.ok) renderDashboard(await res.json());
+  };
+  liveSource.addEventListener('resync', refetchDashboard);
+  liveSource.addEventListener('patient_added', refetchDashboard);
+  liveSource.onerror = () => {
+    // A 404 (no API server) closes the stream for good; stop retrying quietly
+    if (liveSource && liveSource.readyState === EventSource.CLOSED) liveSource = null;
+  };
+}
+
 // --- MAIN ---
 async function main() {
   let data;
@@ -779,6 +1019,7 @@ async function main() {
   } else {
     data = await fetchDashboardData();
   }
+  await loadCohortAverages();
   // Multi-patient support
   let patients = [data.patient_profile];
   if (data.patients && Array.isArray(data.patients)) {
@@ -787,16 +1028,8 @@ async function main() {
     data.patient_profile = patients.find(p => p.patient_id === selectedId) || patients[0];
     updatePatientSelector(patients, data.patient_profile.patient_id);
   }
-  // Deduplicate reports for chart clarity
-  const dedupedReports = deduplicateReports(data.patient_profile.reports);
-  renderPatientSnapshot(data.patient_profile, dedupedReports);
-  renderSummary(data.summary_stats, dedupedReports, data.alerts);
-  renderAlertsPanel(data.alerts);
-  renderTrendSidebar(dedupedReports);
-  renderChartGrid(data.trends, dedupedReports);
-  renderTabularDataPanel(dedupedReports);
-  renderAIFooterSummary(data.alerts, dedupedReports);
-  showAlertBanner(data.alerts || []);
+  renderDashboard(data);
+  connectLiveUpdates(uploaded ? null : data.patient_profile.patient_id);
   // Restore theme palette
   const palette = localStorage.getItem('theme_palette');
   if (palette && palette !== 'default') {
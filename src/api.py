@@ -0,0 +1,299 @@
+"""
+Dashboard API Server
+====================
+
+FastAPI application that serves the static dashboard from ``public/``, the
+per-patient dashboard documents, and a Server-Sent Events stream of change
+events produced by ``LiveUpdateHub``. One async process serves every open
+dashboard; each change is diffed and encoded once and then pushed to all
+subscribers of the affected patient.
+
+Dashboard documents are picked up from the watched files and directories
+(``public/dashboard_data.json`` and the ingestion daemon's per-patient output
+by default), so the ingestion daemon and batch jobs need no extra wiring.
+Chart series for a date range come from ``/api/patients/{id}/trends/{name}``,
+read from the store's raw readings for stored patients (otherwise sliced from
+the dashboard's trend) and downsampled to a point budget. Date bounds with a
+UTC offset are normalised to naive UTC, the form dates are stored in.
+
+With a report store (``store_path``) the server also answers range queries
+over stored readings, accepts uploaded lab reports, and builds dashboards
+for stored patients on first request. Store work runs on a small thread
+pool with one SQLite connection per thread; an upload is written, the
+patient's dashboard is recomputed, and the diff goes out to subscribers.
+"""
+
+import asyncio
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from fastapi import Body, FastAPI, Header, HTTPException
+from fastapi.responses import StreamingResponse
+from fastapi.staticfiles import StaticFiles
+
+from .downsampling import DEFAULT_MAX_POINTS, as_naive_utc, range_series, select_series
+from .live_updates import ALL_PATIENTS, LiveUpdateHub
+
+logger = logging.getLogger(__name__)
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "X-Accel-Buffering": "no",
+}
+
+
+class StoreWorkers:
+    """Runs report store calls on a thread pool, one connection per thread
+
+    SQLite connections cannot be shared between threads; in WAL mode each
+    thread's connection reads concurrently while writes take turns.
+    """
+
+    def __init__(self, db_path: str, threads: int = 4):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._stores = []
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="store")
+        self.processor = None
+
+    def _store(self):
+        store = getattr(self._local, "store", None)
+        if store is None:
+            from .store import ReportStore
+            store = ReportStore(self.db_path)
+            self._local.store = store
+            with self._lock:
+                self._stores.append(store)
+        return store
+
+    async def run(self, fn, *args):
+        """Await ``fn(store, *args)`` on a store thread"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, lambda: fn(self._store(), *args))
+
+    def dashboard(self, store, patient_id: str) -> Dict[str, Any]:
+        """Compute a patient's dashboard document from the store"""
+        if self.processor is None:
+            from .data_processor import BiomarkerDataProcessor
+            self.processor = BiomarkerDataProcessor()
+        patient_profile = self.processor.load_from_store(store, patient_id)
+        dashboard_data = self.processor.build_dashboard_data(patient_profile)
+        # Same document shape as the exported dashboard files
+        return json.loads(json.dumps(dashboard_data.dict(), default=str))
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            for store in self._stores:
+                store.close()
+            self._stores.clear()
+
+
+def _parse_date(value: Optional[str], name: str) -> Optional[datetime]:
+    if value is None:
+        return None
+    try:
+        # Offsets are normalised so bounds compare with stored (naive UTC) dates
+        return as_naive_utc(datetime.fromisoformat(value))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid {name} date: {value}")
+
+
+def _parse_range(since: Optional[str], until: Optional[str]):
+    start, end = _parse_date(since, "since"), _parse_date(until, "until")
+    if start is not None and end is not None and start > end:
+        raise HTTPException(status_code=400, detail="since must not be after until")
+    return start, end
+
+
+def _parse_biomarker(name: str):
+    from .models import BiomarkerType
+    try:
+        return BiomarkerType(name)
+    except ValueError:
+        raise HTTPException(status_code=404, detail=f"Unknown biomarker: {name}")
+
+
+def create_app(static_dir: Optional[str], watch_paths: List[str],
+               poll_interval: float = 1.0,
+               hub: Optional[LiveUpdateHub] = None,
+               store_path: Optional[str] = None,
+               store_threads: int = 4) -> FastAPI:
+    """Build the API app around a hub watching ``watch_paths``
+
+    ``store_path`` enables the report store endpoints (range queries and
+    report uploads) and serves stored patients' dashboards.
+    """
+    hub = hub or LiveUpdateHub()
+    app = FastAPI(title="Biomarker Dashboard API")
+    app.state.hub = hub
+    background: List[asyncio.Task] = []
+    workers = StoreWorkers(store_path, store_threads) if store_path else None
+    stored_patients: Dict[str, str] = {}
+    # Uploads for one patient are applied in order
+    upload_locks: Dict[str, asyncio.Lock] = {}
+
+    def require_store() -> StoreWorkers:
+        if workers is None:
+            raise HTTPException(status_code=404, detail="No report store configured")
+        return workers
+
+    @app.on_event("startup")
+    async def start_watching() -> None:
+        await hub.load_files_from(watch_paths, broadcast=False)
+        if workers:
+            rows = await workers.run(
+                lambda store: store.conn.execute("SELECT patient_id, name FROM patients").fetchall()
+            )
+            stored_patients.update((row["patient_id"], row["name"]) for row in rows)
+            logger.info(f"💾 {len(stored_patients)} patient(s) in report store {store_path}")
+        background.append(asyncio.create_task(hub.watch_files(watch_paths, poll_interval)))
+        background.append(asyncio.create_task(hub.heartbeat()))
+        logger.info(f"📡 Watching {len(watch_paths)} path(s), {len(hub.dashboards)} patient(s) loaded")
+
+    @app.on_event("shutdown")
+    async def stop_watching() -> None:
+        for task in background:
+            task.cancel()
+        if workers:
+            workers.close()
+
+    @app.get("/api/patients")
+    async def list_patients():
+        names = dict(stored_patients)
+        names.update(
+            (patient_id, dashboard["patient_profile"].get("name"))
+            for patient_id, dashboard in hub.dashboards.items()
+        )
+        return [{"patient_id": patient_id, "name": name} for patient_id, name in sorted(names.items())]
+
+    @app.get("/api/patients/{patient_id}/dashboard")
+    async def get_dashboard(patient_id: str):
+        if patient_id not in hub.dashboards:
+            if patient_id not in stored_patients:
+                raise HTTPException(status_code=404, detail=f"Unknown patient: {patient_id}")
+            dashboard = await workers.run(workers.dashboard, patient_id)
+            # An upload may have published a newer document meanwhile
+            if patient_id not in hub.dashboards:
+                hub.update(dashboard, broadcast=False)
+        return hub.dashboards[patient_id]
+
+    @app.get("/api/patients/{patient_id}/trends/{biomarker}")
+    async def trend_series(patient_id: str, biomarker: str,
+                           since: Optional[str] = None, until: Optional[str] = None,
+                           max_points: int = DEFAULT_MAX_POINTS):
+        """Chart series of one trend for a date range, at most ``max_points`` points"""
+        from .models import BiomarkerTrend
+        if max_points < 3:
+            raise HTTPException(status_code=400, detail="max_points must be at least 3")
+        biomarker_type = _parse_biomarker(biomarker)
+        start, end = _parse_range(since, until)
+        if patient_id in stored_patients:
+            # Raw readings for the range come from the store; dashboards only
+            # carry downsampled levels for long histories
+            rows = await workers.run(
+                lambda store: store.query_values(biomarker_type, since=start, until=end, patient_id=patient_id)
+            )
+            if rows:
+                dates = [datetime.fromisoformat(row["report_date"]) for row in rows]
+                series = range_series(dates, [row["value"] for row in rows], max_points=max_points)
+                return {"biomarker": biomarker_type.value, **series.dict()}
+        dashboard = await get_dashboard(patient_id)
+        trend = dashboard.get("trends", {}).get(biomarker_type.value)
+        if trend is None:
+            raise HTTPException(status_code=404, detail=f"No {biomarker_type.value} trend for {patient_id}")
+        series = select_series(BiomarkerTrend.parse_obj(trend), start=start, end=end, max_points=max_points)
+        return {"biomarker": biomarker_type.value, **series.dict()}
+
+    @app.get("/api/patients/{patient_id}/biomarkers/{biomarker}")
+    async def patient_readings(patient_id: str, biomarker: str,
+                               since: Optional[str] = None, until: Optional[str] = None):
+        """One patient's readings of a biomarker within a date range"""
+        store_workers = require_store()
+        if patient_id not in stored_patients:
+            raise HTTPException(status_code=404, detail=f"Unknown patient: {patient_id}")
+        biomarker_type = _parse_biomarker(biomarker)
+        start, end = _parse_range(since, until)
+        return await store_workers.run(
+            lambda store: store.query_values(biomarker_type, since=start, until=end, patient_id=patient_id)
+        )
+
+    @app.get("/api/biomarkers/{biomarker}")
+    async def cohort_readings(biomarker: str,
+                              min_value: Optional[float] = None, max_value: Optional[float] = None,
+                              since: Optional[str] = None, until: Optional[str] = None,
+                              status: Optional[str] = None, limit: int = 1000):
+        """Readings across all stored patients, e.g. HbA1c above 6.5 in the last 90 days"""
+        store_workers = require_store()
+        biomarker_type = _parse_biomarker(biomarker)
+        start, end = _parse_range(since, until)
+        rows = await store_workers.run(
+            lambda store: store.query_values(
+                biomarker_type, min_value=min_value, max_value=max_value,
+                since=start, until=end, status=status
+            )
+        )
+        return {"total": len(rows), "readings": rows[-limit:] if limit > 0 else []}
+
+    @app.post("/api/patients/{patient_id}/reports", status_code=201)
+    async def upload_report(patient_id: str, report: Dict[str, Any] = Body(...)):
+        """Add a lab report (``{"report_date", "source_file", "biomarkers": {name: value}}``)
+
+        The patient's dashboard is recomputed and the changes are streamed
+        to its subscribers.
+        """
+        store_workers = require_store()
+        if patient_id not in stored_patients:
+            raise HTTPException(status_code=404, detail=f"Unknown patient: {patient_id}")
+        if not isinstance(report.get("biomarkers"), dict) or not report["biomarkers"]:
+            raise HTTPException(status_code=400, detail="Report has no biomarkers")
+
+        def add_and_rebuild(store) -> Dict[str, Any]:
+            from .extractor import BiomarkerExtractor
+            extractor = store_workers.processor.extractor if store_workers.processor else BiomarkerExtractor()
+            converted = extractor.convert_legacy_to_patient_profile(
+                {"patient": patient_id, "reports": [report]}
+            )
+            if not any(r.biomarkers for r in converted.reports):
+                raise HTTPException(status_code=400, detail="No known biomarkers in report")
+            store.add_reports(patient_id, converted.reports)
+            return store_workers.dashboard(store, patient_id)
+
+        lock = upload_locks.setdefault(patient_id, asyncio.Lock())
+        async with lock:
+            dashboard = await store_workers.run(add_and_rebuild)
+            events = hub.update(dashboard)
+        return {"patient_id": patient_id, "events": [event["type"] for event in events]}
+
+    def event_stream(patient_id: str, last_event_id: Optional[str]) -> StreamingResponse:
+        subscriber = hub.subscribe(patient_id, last_event_id)
+
+        async def frames():
+            try:
+                # Tell EventSource how long to wait before reconnecting
+                yield b"retry: 3000\n\n"
+                while True:
+                    yield await subscriber.queue.get()
+            finally:
+                hub.unsubscribe(subscriber)
+
+        return StreamingResponse(frames(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+    @app.get("/api/patients/{patient_id}/events")
+    async def patient_events(patient_id: str, last_event_id: Optional[str] = Header(None)):
+        return event_stream(patient_id, last_event_id)
+
+    @app.get("/api/events")
+    async def all_events(last_event_id: Optional[str] = Header(None)):
+        return event_stream(ALL_PATIENTS, last_event_id)
+
+    if static_dir:
+        app.mount("/", StaticFiles(directory=static_dir, html=True), name="static")
+
+    return app
@@ -0,0 +1,369 @@
+"""
+Resumable Batch Jobs
+====================
+
+Processes a fixed set of input files (PDF reports and legacy JSON exports)
+into per-patient dashboard data, checkpointing progress to a job directory
+so that a crashed or killed run resumes where it stopped.
+
+Each input is identified by a fingerprint of its path, size and mtime, and
+its extracted profile is written atomically to ``results/<fingerprint>.json``.
+Re-processing an input therefore overwrites the same file and is idempotent.
+The checkpoint records the completed fingerprints together with the partial
+cohort aggregates, so every input is folded into the cohort exactly once.
+
+With ``workers`` > 1 inputs are extracted by a ``PreforkExtractorPool`` and
+only recorded (result file, cohort, checkpoint) in the parent.
+
+Per-input results go to disk as soon as they are extracted, so the parent
+holds no profiles between inputs beyond those the worker pool has finished
+but not yet handed over. With a memory budget, going over the limit (checked
+at most once per ``checkpoint_every`` inputs) checkpoints, releases what can
+be released without losing work (see ``release_memory``), halves the number
+of inputs in flight on the workers, and logs the RSS actually freed; the
+final export loads one patient at a time.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import signal
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .models import PatientProfile
+from .data_processor import BiomarkerDataProcessor
+from .cohort_stats import CohortStatistics
+from .memory_profile import MemoryBudget, MemoryProfiler, current_rss_mb, release_memory
+from .worker_pool import PreforkExtractorPool
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_SUFFIXES = (".pdf", ".json")
+CHECKPOINT_FILE = "checkpoint.json"
+RESULTS_DIR = "results"
+
+
+def input_fingerprint(path: str) -> str:
+    """Stable identifier for one version of an input file"""
+    stat = os.stat(path)
+    key = f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:20]
+
+
+def expand_inputs(paths: List[str]) -> List[Tuple[str, str]]:
+    """Expand files and directories into sorted (path, patient name) pairs
+
+    PDFs inside a directory are attributed to the sub-folder they sit in, as
+    in the ingestion inbox; PDFs listed directly use their parent folder.
+    """
+    inputs: Dict[str, str] = {}
+    for path in paths:
+        root = Path(path)
+        if root.is_dir():
+            for file_path in sorted(root.rglob("*")):
+                if file_path.is_file() and file_path.suffix.lower() in SUPPORTED_SUFFIXES:
+                    patient = file_path.parent.name if file_path.parent != root else "Unknown"
+                    inputs.setdefault(str(file_path), patient)
+        elif root.is_file():
+            inputs.setdefault(str(root), root.parent.name or "Unknown")
+        else:
+            logger.warning(f"⚠️  Input not found: {path}")
+    return sorted(inputs.items())
+
+
+def merge_patient_profiles(profiles: Iterable[PatientProfile]) -> Optional[PatientProfile]:
+    """Merge partial profiles of one patient into a single profile with sorted reports"""
+    profile = None
+    for incoming in profiles:
+        if profile is None:
+            profile = incoming
+            continue
+        profile.reports.extend(incoming.reports)
+        if profile.age is None:
+            profile.age = incoming.age
+        profile.gender = profile.gender or incoming.gender
+    if profile is not None:
+        profile.reports.sort(key=lambda r: r.report_date)
+    return profile
+
+
+def _write_json_atomic(path: Path, data: Any) -> None:
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, default=str)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class BatchJob:
+    """Checkpointed batch extraction that can be killed and resumed"""
+
+    def __init__(self, job_dir: str, output_dir: str,
+                 cohort_output: Optional[str] = None,
+                 pdf_mode: str = "auto",
+                 checkpoint_every: int = 25,
+                 checkpoint_seconds: float = 30.0,
+                 memory_budget_mb: Optional[float] = None,
+                 profiler: Optional[MemoryProfiler] = None,
+                 workers: int = 1,
+                 max_tasks_per_child: Optional[int] = 100,
+                 pdf_stats_path: Optional[str] = None):
+        self.job_dir = Path(job_dir)
+        self.output_dir = Path(output_dir)
+        self.cohort_output = cohort_output
+        self.pdf_mode = pdf_mode
+        self.pdf_stats_path = pdf_stats_path
+        self.workers = workers
+        self.max_tasks_per_child = max_tasks_per_child
+        self.worker_report: List[Dict[str, Any]] = []
+        self.checkpoint_every = checkpoint_every
+        # Inputs between two reactions to the memory budget
+        self.budget_cooldown = checkpoint_every
+        self.checkpoint_seconds = checkpoint_seconds
+
+        self.results_dir = self.job_dir / RESULTS_DIR
+        self.checkpoint_path = self.job_dir / CHECKPOINT_FILE
+        self.processor = BiomarkerDataProcessor(profiler=profiler, pdf_stats_path=pdf_stats_path)
+        # PDF backend stats are saved with each checkpoint rather than per document
+        self.processor.extractor.pdf_backends.autosave = False
+        self.budget = MemoryBudget(memory_budget_mb) if memory_budget_mb else None
+
+        self.cohort = CohortStatistics()
+        self.done: Dict[str, str] = {}
+        self.failed: Dict[str, str] = {}
+        # fingerprint -> patient id, so the final export can load one patient at a time
+        self.patients: Dict[str, str] = {}
+        self._stop_signal: Optional[int] = None
+        self._last_checkpoint = time.monotonic()
+        self._since_checkpoint = 0
+        self._since_budget_flush = checkpoint_every
+        # The running worker pool, whose in-flight window the budget may shrink
+        self._pool: Optional[PreforkExtractorPool] = None
+
+    # ------------------------------------------------------------------
+    # Checkpoints
+    # ------------------------------------------------------------------
+
+    def reset(self) -> None:
+        """Discard the checkpoint and all per-input results"""
+        if self.results_dir.exists():
+            shutil.rmtree(self.results_dir)
+        if self.checkpoint_path.exists():
+            self.checkpoint_path.unlink()
+        self.cohort = CohortStatistics()
+        self.done = {}
+        self.failed = {}
+        self.patients = {}
+
+    def load_checkpoint(self) -> bool:
+        """Restore progress from the last checkpoint, if there is one"""
+        if not self.checkpoint_path.exists():
+            return False
+        with open(self.checkpoint_path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        self.done = state.get("done", {})
+        self.failed = state.get("failed", {})
+        self.patients = state.get("patients", {})
+        self.cohort = CohortStatistics.from_dict(state["cohort"])
+        logger.info(f"🔁 Resuming batch job from {self.checkpoint_path} "
+                    f"({len(self.done)} done, {len(self.failed)} failed)")
+        return True
+
+    def save_checkpoint(self, completed: bool = False) -> None:
+        """Atomically persist the processed input set and partial aggregates"""
+        _write_json_atomic(self.checkpoint_path, {
+            "version": 1,
+            "updated_at": datetime.now().isoformat(),
+            "completed": completed,
+            "done": self.done,
+            "failed": self.failed,
+            "patients": self.patients,
+            "cohort": self.cohort.to_dict(),
+        })
+        self._last_checkpoint = time.monotonic()
+        self._since_checkpoint = 0
+        self.processor.extractor.pdf_backends.save_stats()
+
+    def _maybe_checkpoint(self) -> None:
+        self._since_checkpoint += 1
+        self._since_budget_flush += 1
+        if (self.budget and self._since_budget_flush >= self.budget_cooldown
+                and self.budget.exceeded()):
+            self._since_budget_flush = 0
+            self._release_memory()
+            return
+        if (self._since_checkpoint >= self.checkpoint_every
+                or time.monotonic() - self._last_checkpoint >= self.checkpoint_seconds):
+            self.save_checkpoint()
+
+    def _release_memory(self) -> None:
+        """React to the memory budget: flush, release caches, and fetch fewer results at once"""
+        rss_before = current_rss_mb()
+        # Writes the pending PDF backend stats, the only results not yet on disk
+        self.save_checkpoint()
+        freed = release_memory()
+        shrunk = ""
+        if self._pool is not None and self._pool.window > 1:
+            self._pool.window = max(1, self._pool.window // 2)
+            shrunk = f"; {self._pool.window} input(s) now in flight on the workers"
+        logger.warning(f"⚠️  Over the {self.budget.limit_mb:.0f} MB memory budget at {rss_before:.0f} MB: "
+                       f"released {freed:.1f} MB, RSS now {current_rss_mb():.0f} MB{shrunk}")
+
+    # ------------------------------------------------------------------
+    # Per-input processing
+    # ------------------------------------------------------------------
+
+    def _result_path(self, fingerprint: str) -> Path:
+        return self.results_dir / f"{fingerprint}.json"
+
+    def _load_result(self, fingerprint: str) -> PatientProfile:
+        with open(self._result_path(fingerprint), 'r', encoding='utf-8') as f:
+            return PatientProfile.parse_obj(json.load(f))
+
+    def _record_failure(self, fingerprint: str, path: str, error: str) -> None:
+        logger.error(f"❌ Failed to process {path}: {error}")
+        self.failed[fingerprint] = path
+        self._maybe_checkpoint()
+
+    def _record(self, fingerprint: str, path: str, profile: PatientProfile, write: bool = True) -> None:
+        """Persist one input's result and fold it into the partial aggregates"""
+        if write:
+            _write_json_atomic(self._result_path(fingerprint), profile.dict())
+        with self.processor.profiler.stage("stats"):
+            self.cohort.add_profile(profile)
+        self.done[fingerprint] = path
+        self.patients[fingerprint] = profile.patient_id
+        self.failed.pop(fingerprint, None)
+        self._maybe_checkpoint()
+
+    def _recover(self, fingerprint: str, path: str) -> bool:
+        """Record a result written before a crash but not yet covered by a checkpoint"""
+        if not self._result_path(fingerprint).exists():
+            return False
+        self._record(fingerprint, path, self._load_result(fingerprint), write=False)
+        return True
+
+    def process_input(self, path: str, patient: str) -> None:
+        """Extract one input and record it; safe to repeat after a crash"""
+        fingerprint = input_fingerprint(path)
+        if fingerprint in self.done or self._recover(fingerprint, path):
+            return
+        try:
+            profile = self.processor.extractor.parse_input_file(path, patient, pdf_mode=self.pdf_mode)
+        except Exception as e:
+            self._record_failure(fingerprint, path, str(e))
+            return
+        self._record(fingerprint, path, profile)
+
+    def _process_parallel(self, inputs: List[Tuple[str, str]]) -> None:
+        """Extract inputs on pre-forked workers, recording results in this process"""
+        pending: Dict[str, str] = {}
+        tasks = []
+        for path, patient in inputs:
+            fingerprint = input_fingerprint(path)
+            if fingerprint in self.done or self._recover(fingerprint, path):
+                continue
+            pending[path] = fingerprint
+            tasks.append((path, patient))
+        if not tasks:
+            return
+
+        with PreforkExtractorPool(
+            processes=min(self.workers, len(tasks)),
+            max_tasks_per_child=self.max_tasks_per_child,
+            pdf_mode=self.pdf_mode,
+            pdf_stats_path=self.pdf_stats_path
+        ) as pool:
+            self._pool = pool
+            for result in pool.imap(tasks):
+                if result.error:
+                    self._record_failure(pending[result.path], result.path, result.error)
+                else:
+                    self._record(pending[result.path], result.path, result.profile)
+                if self._stop_signal is not None:
+                    pool.close(terminate=True)
+                    break
+            pool.log_throughput()
+            self.worker_report = pool.throughput_report()
+        self._pool = None
+        profiler = self.processor.profiler
+        profiler.note(f"extract and convert ran in {len(self.worker_report)} worker process(es) "
+                      f"and are not in the stages above; see the per-worker peaks")
+        profiler.record_workers(self.worker_report)
+
+    # ------------------------------------------------------------------
+    # Running
+    # ------------------------------------------------------------------
+
+    def _request_stop(self, signum, frame) -> None:
+        logger.info(f"🛑 Received signal {signum}, checkpointing batch job")
+        self._stop_signal = signum
+
+    def run(self, inputs: List[str], restart: bool = False) -> Dict[str, Any]:
+        """Process all inputs, resuming from the last checkpoint unless ``restart``"""
+        self.results_dir.mkdir(parents=True, exist_ok=True)
+        if restart:
+            self.reset()
+            self.results_dir.mkdir(parents=True, exist_ok=True)
+        else:
+            self.load_checkpoint()
+
+        previous_handlers = {
+            signum: signal.signal(signum, self._request_stop)
+            for signum in (signal.SIGTERM, signal.SIGINT)
+        }
+        try:
+            if self.workers > 1:
+                self._process_parallel(expand_inputs(inputs))
+            else:
+                for path, patient in expand_inputs(inputs):
+                    if self._stop_signal is not None:
+                        break
+                    self.process_input(path, patient)
+        finally:
+            self.save_checkpoint()
+            for signum, handler in previous_handlers.items():
+                signal.signal(signum, handler)
+
+        summary = {"done": len(self.done), "failed": len(self.failed), "patients": 0, "interrupted": False}
+        if self._stop_signal is not None:
+            summary["interrupted"] = True
+            logger.info(f"⏸️  Batch job interrupted after {len(self.done)} inputs; rerun to resume")
+            return summary
+
+        summary["patients"] = self.finalize()
+        self.save_checkpoint(completed=True)
+        return summary
+
+    def _load_patient(self, fingerprints: List[str]) -> PatientProfile:
+        """Merge the per-input results of one patient into a single profile"""
+        return merge_patient_profiles(self._load_result(fingerprint) for fingerprint in fingerprints)
+
+    def finalize(self) -> int:
+        """Merge per-input results per patient and export dashboards and cohort stats
+
+        The cohort percentile tables go to ``cohort_output`` when one is set.
+        """
+        by_patient: Dict[str, List[str]] = {}
+        for fingerprint in sorted(self.done, key=self.done.get):
+            patient_id = self.patients.get(fingerprint) or self._load_result(fingerprint).patient_id
+            by_patient.setdefault(patient_id, []).append(fingerprint)
+
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        if self.cohort_output:
+            cohort_stats = self.processor.export_cohort_stats(self.cohort, self.cohort_output)
+        else:
+            cohort_stats = self.cohort.export()
+        for patient_id, fingerprints in by_patient.items():
+            profile = self._load_patient(fingerprints)
+            dashboard_data = self.processor.build_dashboard_data(profile, cohort_stats)
+            self.processor.export_to_json(dashboard_data, str(self.output_dir / f"{patient_id}.json"))
+
+        logger.info(f"✅ Batch job finished: {len(by_patient)} patients from {len(self.done)} inputs")
+        return len(by_patient)
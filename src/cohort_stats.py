@@ -0,0 +1,305 @@
+"""
+Cohort Population Statistics
+============================
+
+Streaming, mergeable statistics per biomarker x age band x sex. Each stratum
+keeps running moments (count, mean, variance) and a KLL quantile sketch, so
+statistics can be updated report by report, merged across worker shards and
+exported as small percentile tables for O(1) patient comparisons.
+"""
+
+import bisect
+import json
+import logging
+import math
+import random
+from typing import Dict, List, Optional, Tuple, Any
+
+from .models import BiomarkerType, LabReport, PatientProfile
+
+logger = logging.getLogger(__name__)
+
+AGE_BANDS = [(0, 29), (30, 44), (45, 59), (60, 74), (75, 150)]
+
+# Quantiles exported for each stratum (0th..100th percentile)
+EXPORT_QUANTILES = [i / 100 for i in range(101)]
+
+
+def age_band(age: Optional[int]) -> str:
+    """Map an age to its band label"""
+    if age is None:
+        return "unknown"
+    for low, high in AGE_BANDS:
+        if low <= age <= high:
+            return f"{low}-{high}" if high < 150 else f"{low}+"
+    return "unknown"
+
+
+def normalize_sex(gender: Optional[str]) -> str:
+    """Normalize free-text gender to Male/Female/Unknown"""
+    value = (gender or "").strip().lower()
+    if value in ("m", "male", "man"):
+        return "Male"
+    if value in ("f", "female", "woman"):
+        return "Female"
+    return "Unknown"
+
+
+class RunningMoments:
+    """Count, mean and variance with Welford updates and Chan merges"""
+
+    __slots__ = ("count", "mean", "m2", "min", "max")
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def update(self, x: float) -> None:
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+        self.min = min(self.min, x)
+        self.max = max(self.max, x)
+
+    def merge(self, other: "RunningMoments") -> None:
+        if not other.count:
+            return
+        total = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / total
+        self.m2 += other.m2 + delta * delta * self.count * other.count / total
+        self.count = total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    @property
+    def variance(self) -> float:
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    def to_dict(self) -> Dict[str, float]:
+        return {"count": self.count, "mean": self.mean, "m2": self.m2, "min": self.min, "max": self.max}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, float]) -> "RunningMoments":
+        moments = cls()
+        for name in cls.__slots__:
+            setattr(moments, name, data[name])
+        return moments
+
+
+class KLLSketch:
+    """KLL quantile sketch (Karnin, Lang, Liberty) with mergeable compactors"""
+
+    def __init__(self, k: int = 200, seed: Optional[int] = None):
+        self.k = k
+        self.n = 0
+        self.compactors: List[List[float]] = []
+        self.size = 0
+        self.max_size = 0
+        self._random = random.Random(seed)
+        self._grow()
+
+    def _capacity(self, height: int) -> int:
+        depth = len(self.compactors) - height - 1
+        return int(math.ceil(self.k * (2 / 3) ** depth)) + 1
+
+    def _grow(self) -> None:
+        self.compactors.append([])
+        self.max_size = sum(self._capacity(h) for h in range(len(self.compactors)))
+
+    def _compress(self) -> None:
+        for height in range(len(self.compactors)):
+            if len(self.compactors[height]) >= self._capacity(height):
+                if height + 1 >= len(self.compactors):
+                    self._grow()
+                items = sorted(self.compactors[height])
+                offset = self._random.randint(0, 1)
+                self.compactors[height + 1].extend(items[offset::2])
+                self.compactors[height] = []
+                self.size = sum(len(c) for c in self.compactors)
+                if self.size < self.max_size:
+                    break
+
+    def update(self, x: float) -> None:
+        self.compactors[0].append(x)
+        self.n += 1
+        self.size += 1
+        if self.size >= self.max_size:
+            self._compress()
+
+    def merge(self, other: "KLLSketch") -> None:
+        while len(self.compactors) < len(other.compactors):
+            self._grow()
+        for height, items in enumerate(other.compactors):
+            self.compactors[height].extend(items)
+        self.n += other.n
+        self.size = sum(len(c) for c in self.compactors)
+        while self.size >= self.max_size:
+            self._compress()
+
+    def _weighted(self) -> List[Tuple[float, int]]:
+        return sorted(
+            (x, 2 ** height)
+            for height, items in enumerate(self.compactors)
+            for x in items
+        )
+
+    def quantiles(self, qs: List[float]) -> List[Optional[float]]:
+        """Values at the given quantile fractions"""
+        weighted = self._weighted()
+        if not weighted:
+            return [None for _ in qs]
+        total = sum(w for _, w in weighted)
+        cumulative = []
+        running = 0
+        for _, weight in weighted:
+            running += weight
+            cumulative.append(running)
+        result = []
+        for q in qs:
+            target = q * total
+            index = min(bisect.bisect_left(cumulative, target), len(weighted) - 1)
+            result.append(weighted[index][0])
+        return result
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"k": self.k, "n": self.n, "compactors": self.compactors}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "KLLSketch":
+        sketch = cls(k=data["k"])
+        sketch.compactors = [list(c) for c in data["compactors"]]
+        sketch.n = data["n"]
+        sketch.max_size = sum(sketch._capacity(h) for h in range(len(sketch.compactors)))
+        sketch.size = sum(len(c) for c in sketch.compactors)
+        return sketch
+
+
+class StratumStats:
+    """Moments and quantile sketch for one biomarker x age band x sex cell"""
+
+    def __init__(self, k: int = 200):
+        self.moments = RunningMoments()
+        self.sketch = KLLSketch(k=k)
+
+    def update(self, value: float) -> None:
+        self.moments.update(value)
+        self.sketch.update(value)
+
+    def merge(self, other: "StratumStats") -> None:
+        self.moments.merge(other.moments)
+        self.sketch.merge(other.sketch)
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "count": self.moments.count,
+            "mean": round(self.moments.mean, 4),
+            "std": round(math.sqrt(self.moments.variance), 4),
+            "min": self.moments.min,
+            "max": self.moments.max,
+            "percentiles": self.sketch.quantiles(EXPORT_QUANTILES),
+        }
+
+
+StratumKey = Tuple[str, str, str]  # (biomarker, age band, sex)
+
+
+class CohortStatistics:
+    """Mergeable cross-patient statistics per biomarker x age band x sex"""
+
+    def __init__(self, k: int = 200):
+        self.k = k
+        self.strata: Dict[StratumKey, StratumStats] = {}
+
+    def _stratum(self, key: StratumKey) -> StratumStats:
+        stats = self.strata.get(key)
+        if stats is None:
+            stats = self.strata[key] = StratumStats(k=self.k)
+        return stats
+
+    def add_report(self, report: LabReport, age: Optional[int], gender: Optional[str]) -> None:
+        """Fold every reading of one report into its stratum"""
+        band = age_band(age)
+        sex = normalize_sex(gender)
+        for biomarker_type, biomarker in report.biomarkers.items():
+            self._stratum((biomarker_type.value, band, sex)).update(biomarker.value)
+
+    def add_profile(self, patient_profile: PatientProfile) -> None:
+        for report in patient_profile.reports:
+            self.add_report(report, patient_profile.age, patient_profile.gender)
+
+    def merge(self, other: "CohortStatistics") -> None:
+        """Merge another shard's statistics into this one"""
+        for key, stats in other.strata.items():
+            self._stratum(key).merge(stats)
+
+    # ------------------------------------------------------------------
+    # Serialization (shard state) and export (dashboard tables)
+    # ------------------------------------------------------------------
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "k": self.k,
+            "strata": [
+                {"key": list(key), "moments": s.moments.to_dict(), "sketch": s.sketch.to_dict()}
+                for key, s in self.strata.items()
+            ],
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "CohortStatistics":
+        cohort = cls(k=data.get("k", 200))
+        for entry in data.get("strata", []):
+            stats = StratumStats(k=cohort.k)
+            stats.moments = RunningMoments.from_dict(entry["moments"])
+            stats.sketch = KLLSketch.from_dict(entry["sketch"])
+            cohort.strata[tuple(entry["key"])] = stats
+        return cohort
+
+    def save(self, path: str) -> None:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f)
+
+    @classmethod
+    def load(cls, path: str) -> "CohortStatistics":
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls.from_dict(json.load(f))
+
+    def export(self) -> Dict[str, Any]:
+        """Percentile tables per stratum plus an all-ages/all-sexes row per biomarker"""
+        by_biomarker: Dict[str, Dict[str, Any]] = {}
+        overall: Dict[str, StratumStats] = {}
+
+        for (biomarker, band, sex), stats in sorted(self.strata.items()):
+            by_biomarker.setdefault(biomarker, {"strata": {}})["strata"].setdefault(band, {})[sex] = stats.summary()
+            overall.setdefault(biomarker, StratumStats(k=self.k)).merge(stats)
+
+        for biomarker, stats in overall.items():
+            by_biomarker[biomarker]["overall"] = stats.summary()
+
+        return {"quantiles": EXPORT_QUANTILES, "biomarkers": by_biomarker}
+
+
+def percentile_rank(exported: Dict[str, Any], biomarker: BiomarkerType, value: float,
+                    age: Optional[int] = None, gender: Optional[str] = None) -> Optional[float]:
+    """Percentile (0-100) of a value within its stratum from exported tables
+
+    Falls back to the biomarker's overall table when the stratum is empty.
+    Lookup is a binary search over a fixed 101-entry table, independent of
+    cohort size.
+    """
+    entry = exported.get("biomarkers", {}).get(biomarker.value)
+    if not entry:
+        return None
+
+    table = entry["strata"].get(age_band(age), {}).get(normalize_sex(gender)) or entry.get("overall")
+    percentiles = [p for p in table["percentiles"] if p is not None] if table else []
+    if not percentiles:
+        return None
+
+    position = bisect.bisect_right(percentiles, value)
+    return round(100.0 * position / len(percentiles), 1)
@@ -0,0 +1,222 @@
+"""
+Cold Report Tier
+================
+
+Immutable, compressed storage for finalized historical reports.
+
+A segment holds a run of one patient's reports reduced to what the
+dashboards read: report date, source file, and per biomarker the values,
+statuses, units, reference ranges and confidences. It is stored as
+zlib-compressed column-oriented JSON. Columns that are constant within a
+segment (usually unit, reference range and confidence) are stored once.
+Segment files are named after a hash of their content, written once and
+never modified.
+
+The raw provenance of the same reports (their ``extraction_metadata``,
+which can hold whole source documents) goes to a separate gzip JSON-lines
+archive next to the segment. Dashboards never read it.
+
+Decoded segments are kept in a small LRU cache. They are immutable, so a
+cached copy never goes stale.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import zlib
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .models import BiomarkerType, BiomarkerValue, LabReport
+
+SEGMENT_VERSION = 1
+SEGMENT_SUFFIX = ".seg"
+ARCHIVE_SUFFIX = ".provenance.jsonl.gz"
+
+# (report_date, source_file, extraction_metadata, [(biomarker, value, unit, status, confidence, ref_min, ref_max)])
+HotReport = Tuple[str, str, str, List[Tuple[str, float, str, Optional[str], Optional[float],
+                                            Optional[float], Optional[float]]]]
+
+
+def _pack(column: List[Any]) -> Any:
+    """Store a column once when all its entries are equal"""
+    if column and all(entry == column[0] for entry in column):
+        return {"all": column[0]}
+    return column
+
+
+def _unpack(packed: Any, length: int) -> List[Any]:
+    if isinstance(packed, dict):
+        return [packed["all"]] * length
+    return packed
+
+
+def encode_segment(patient_id: str, reports: List[HotReport]) -> bytes:
+    """Compress reports (sorted by date) into one segment"""
+    series: Dict[str, Dict[str, List[Any]]] = {}
+    for index, (_, _, _, values) in enumerate(reports):
+        for biomarker, value, unit, status, confidence, ref_min, ref_max in values:
+            columns = series.setdefault(biomarker, {"i": [], "v": [], "u": [], "s": [], "c": [], "r": []})
+            columns["i"].append(index)
+            columns["v"].append(value)
+            columns["u"].append(unit)
+            columns["s"].append(status)
+            columns["c"].append(confidence)
+            columns["r"].append([ref_min, ref_max] if ref_min is not None and ref_max is not None else None)
+
+    document = {
+        "version": SEGMENT_VERSION,
+        "patient_id": patient_id,
+        "dates": [report[0] for report in reports],
+        "sources": _pack([report[1] for report in reports]),
+        "series": {
+            biomarker: {
+                "i": columns["i"],
+                "v": columns["v"],
+                **{key: _pack(columns[key]) for key in ("u", "s", "c", "r")},
+            }
+            for biomarker, columns in series.items()
+        },
+    }
+    return zlib.compress(json.dumps(document, separators=(",", ":")).encode("utf-8"), 9)
+
+
+def decode_segment(data: bytes) -> Dict[str, Any]:
+    document = json.loads(zlib.decompress(data))
+    if document.get("version") != SEGMENT_VERSION:
+        raise ValueError(f"Unsupported segment version: {document.get('version')}")
+    return document
+
+
+def segment_rows(document: Dict[str, Any]) -> Iterable[Tuple[str, str, str, float, str, Optional[str],
+                                                               Optional[float], Optional[float], Optional[float]]]:
+    """(report_date, source_file, biomarker, value, unit, status, confidence, ref_min, ref_max) per reading"""
+    dates = document["dates"]
+    sources = _unpack(document["sources"], len(dates))
+    for biomarker, columns in document["series"].items():
+        count = len(columns["i"])
+        units = _unpack(columns["u"], count)
+        statuses = _unpack(columns["s"], count)
+        confidences = _unpack(columns["c"], count)
+        ranges = _unpack(columns["r"], count)
+        for n, index in enumerate(columns["i"]):
+            ref_range = ranges[n] or (None, None)
+            yield (dates[index], sources[index], biomarker, columns["v"][n], units[n],
+                   statuses[n], confidences[n], ref_range[0], ref_range[1])
+
+
+def segment_reports(document: Dict[str, Any], segment_name: str,
+                    biomarkers: Optional[List[BiomarkerType]] = None) -> List[LabReport]:
+    """Rebuild LabReports from a decoded segment"""
+    wanted = {b.value for b in biomarkers} if biomarkers else None
+    dates = document["dates"]
+    sources = _unpack(document["sources"], len(dates))
+    per_report: List[Dict[BiomarkerType, BiomarkerValue]] = [{} for _ in dates]
+
+    for biomarker, columns in document["series"].items():
+        if wanted is not None and biomarker not in wanted:
+            continue
+        biomarker_type = BiomarkerType(biomarker)
+        count = len(columns["i"])
+        units = _unpack(columns["u"], count)
+        statuses = _unpack(columns["s"], count)
+        confidences = _unpack(columns["c"], count)
+        ranges = _unpack(columns["r"], count)
+        for n, index in enumerate(columns["i"]):
+            ref_range = ranges[n]
+            per_report[index][biomarker_type] = BiomarkerValue(
+                value=columns["v"][n],
+                unit=units[n],
+                reference_range={"min": ref_range[0], "max": ref_range[1]} if ref_range else None,
+                status=statuses[n],
+                confidence=confidences[n] or 0.0
+            )
+
+    return [
+        LabReport(
+            report_date=datetime.fromisoformat(date),
+            source_file=source,
+            biomarkers=biomarkers_by_type,
+            extraction_metadata={"tier": "cold", "segment": segment_name}
+        )
+        for date, source, biomarkers_by_type in zip(dates, sources, per_report)
+    ]
+
+
+def _write_atomic(path: Path, data: bytes) -> None:
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class ColdTier:
+    """Segment files and provenance archives under one directory"""
+
+    def __init__(self, root: str, cache_segments: int = 256):
+        self.root = Path(root)
+        self.segments_dir = self.root / "segments"
+        self.archive_dir = self.root / "archive"
+        self.cache_segments = cache_segments
+        self._cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+    def write(self, patient_id: str, reports: List[HotReport]) -> Tuple[str, str, int]:
+        """Write a segment and its provenance archive; returns (segment path, archive path, bytes)"""
+        data = encode_segment(patient_id, reports)
+        digest = hashlib.sha1(data).hexdigest()[:16]
+        first, last = reports[0][0][:10].replace("-", ""), reports[-1][0][:10].replace("-", "")
+        name = f"{first}-{last}-{digest}"
+
+        segment_dir = self.segments_dir / patient_id
+        archive_dir = self.archive_dir / patient_id
+        segment_dir.mkdir(parents=True, exist_ok=True)
+        archive_dir.mkdir(parents=True, exist_ok=True)
+
+        segment_path = segment_dir / f"{name}{SEGMENT_SUFFIX}"
+        archive_path = archive_dir / f"{name}{ARCHIVE_SUFFIX}"
+        if not segment_path.exists():
+            _write_atomic(segment_path, data)
+        if not archive_path.exists():
+            lines = "".join(
+                json.dumps({"report_date": date, "source_file": source,
+                            "extraction_metadata": json.loads(metadata or "{}")}, default=str) + "\n"
+                for date, source, metadata, _ in reports
+            )
+            _write_atomic(archive_path, gzip.compress(lines.encode("utf-8")))
+        return str(segment_path.relative_to(self.root)), str(archive_path.relative_to(self.root)), len(data)
+
+    def read(self, relative_path: str) -> Dict[str, Any]:
+        """Decoded segment, from the cache when possible"""
+        document = self._cache.get(relative_path)
+        if document is not None:
+            self._cache.move_to_end(relative_path)
+            return document
+        with open(self.root / relative_path, 'rb') as f:
+            document = decode_segment(f.read())
+        self._cache[relative_path] = document
+        if len(self._cache) > self.cache_segments:
+            self._cache.popitem(last=False)
+        return document
+
+    def read_provenance(self, relative_path: str) -> List[Dict[str, Any]]:
+        """Archived extraction metadata of one segment's reports"""
+        with gzip.open(self.root / relative_path, 'rt', encoding='utf-8') as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def remove_unreferenced(self, referenced: Iterable[str]) -> int:
+        """Delete segment/archive files no index row points at (left by an interrupted compaction)"""
+        keep = set(referenced)
+        removed = 0
+        for directory in (self.segments_dir, self.archive_dir):
+            if not directory.exists():
+                continue
+            for path in directory.rglob("*"):
+                if path.is_file() and str(path.relative_to(self.root)) not in keep:
+                    path.unlink()
+                    removed += 1
+        return removed
@@ -0,0 +1,261 @@
+"""
+Columnar Analytics Export
+=========================
+
+Streams processed biomarker readings as long-format rows (one row per
+patient x report x biomarker) into partitioned Parquet, Feather or CSV files
+for analysts. Rows are written in bounded-size row groups, so memory stays
+flat regardless of how many patients are exported.
+
+Parquet and Feather need ``pyarrow``; without it the exporter falls back to
+CSV. Under a memory budget all partition buffers are flushed and the row
+group size is halved whenever RSS is over the limit.
+
+Partitions follow the Hive layout: the partition column is not stored in the
+files but given by the directory name (``biomarker=Total%20Cholesterol/``,
+URL-encoded), which is how ``pyarrow.dataset`` and ``pandas.read_parquet``
+read it back. After writing, the exporter reads the whole dataset back and
+checks its row count and partition values.
+"""
+
+import csv
+import logging
+import os
+import shutil
+from urllib.parse import quote, unquote
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .models import PatientProfile
+from .memory_profile import MemoryBudget
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = [
+    "patient_id", "report_date", "biomarker", "value",
+    "unit", "status", "confidence", "source_file",
+]
+
+FORMATS = ("parquet", "feather", "csv")
+
+# Rows between memory budget checks, and the smallest row group it may shrink to
+BUDGET_CHECK_ROWS = 10_000
+MIN_ROW_GROUP_SIZE = 1_000
+
+Row = Tuple[str, datetime, str, float, str, Optional[str], Optional[float], str]
+
+
+def rows_from_profiles(patient_profiles: Iterable[PatientProfile]) -> Iterator[Row]:
+    """Long-format rows from patient profiles, one profile at a time"""
+    for patient_profile in patient_profiles:
+        for report in patient_profile.reports:
+            for biomarker_type, biomarker in report.biomarkers.items():
+                yield (
+                    patient_profile.patient_id, report.report_date, biomarker_type.value,
+                    biomarker.value, biomarker.unit.value, biomarker.status,
+                    biomarker.confidence, report.source_file,
+                )
+
+
+def rows_from_store(store) -> Iterator[Row]:
+    """Long-format rows streamed straight from a ReportStore cursor, then its cold segments
+
+    Rows come in storage order: the exporter buffers each partition
+    separately, so sorting in SQLite (a temporary B-tree over every reading)
+    would buy nothing.
+    """
+    cursor = store.conn.execute(
+        "SELECT v.patient_id, v.report_date, v.biomarker, v.value, v.unit, v.status, "
+        "v.confidence, r.source_file "
+        "FROM biomarker_values v JOIN reports r ON r.report_id = v.report_id"
+    )
+    for row in cursor:
+        yield (
+            row[0], datetime.fromisoformat(row[1]), row[2], row[3],
+            row[4], row[5], row[6], row[7],
+        )
+    for row in store.iter_cold_rows():
+        yield (row[0], datetime.fromisoformat(row[1]), *row[2:])
+
+
+def _without(values: Tuple, index: Optional[int]) -> Tuple:
+    return values if index is None else values[:index] + values[index + 1:]
+
+
+class _CsvPartitionWriter:
+    def __init__(self, path: str, drop: Optional[int] = None):
+        self._file = open(path, 'w', encoding='utf-8', newline='')
+        self._writer = csv.writer(self._file)
+        self._drop = drop
+        self._writer.writerow(_without(tuple(COLUMNS), drop))
+
+    def write(self, rows: List[Row]) -> None:
+        self._writer.writerows(
+            _without((r[0], r[1].isoformat(), *r[2:]), self._drop) for r in rows
+        )
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class _ArrowPartitionWriter:
+    def __init__(self, path: str, fmt: str, drop: Optional[int] = None):
+        import pyarrow as pa
+
+        self._pa = pa
+        self._drop = drop
+        self.schema = pa.schema(list(_without((
+            ("patient_id", pa.string()),
+            ("report_date", pa.timestamp("us")),
+            ("biomarker", pa.string()),
+            ("value", pa.float64()),
+            ("unit", pa.string()),
+            ("status", pa.string()),
+            ("confidence", pa.float64()),
+            ("source_file", pa.string()),
+        ), drop)))
+        if fmt == "parquet":
+            import pyarrow.parquet as pq
+            self._writer = pq.ParquetWriter(path, self.schema, compression="zstd")
+        else:
+            self._writer = pa.ipc.new_file(path, self.schema)
+
+    def write(self, rows: List[Row]) -> None:
+        # Drop tz info so mixed naive/aware dates fit one timestamp column
+        columns = list(zip(*rows))
+        columns[1] = [d.replace(tzinfo=None) for d in columns[1]]
+        columns = _without(tuple(columns), self._drop)
+        batch = self._pa.record_batch(
+            [self._pa.array(col, type=field.type) for col, field in zip(columns, self.schema)],
+            schema=self.schema
+        )
+        if hasattr(self._writer, "write_batch"):
+            self._writer.write_batch(batch)
+        else:
+            self._writer.write(batch)
+
+    def close(self) -> None:
+        self._writer.close()
+
+
+class ColumnarExporter:
+    """Writes long-format rows to Hive-style partitions (``biomarker=<name>/``)"""
+
+    def __init__(self, output_dir: str, fmt: str = "parquet",
+                 row_group_size: int = 50_000, partition_by: Optional[str] = "biomarker",
+                 memory_budget_mb: Optional[float] = None):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown export format: {fmt}")
+        if fmt != "csv":
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError:
+                logger.warning("pyarrow is not installed, falling back to CSV export")
+                fmt = "csv"
+
+        self.output_dir = output_dir
+        self.fmt = fmt
+        self.row_group_size = row_group_size
+        self.partition_by = partition_by
+        self.budget = MemoryBudget(memory_budget_mb) if memory_budget_mb else None
+        self._partition_index = COLUMNS.index(partition_by) if partition_by else None
+
+    def _partition_path(self, value: Optional[str]) -> str:
+        extension = {"parquet": "parquet", "feather": "feather", "csv": "csv"}[self.fmt]
+        if value is None:
+            directory = self.output_dir
+        else:
+            directory = os.path.join(self.output_dir, f"{self.partition_by}={quote(str(value), safe='')}")
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, f"part-0.{extension}")
+
+    def _open_writer(self, path: str):
+        if self.fmt == "csv":
+            return _CsvPartitionWriter(path, drop=self._partition_index)
+        return _ArrowPartitionWriter(path, self.fmt, drop=self._partition_index)
+
+    def _clear_partitions(self) -> None:
+        """Remove partition directories left by a previous export into the same directory"""
+        if not self.partition_by or not os.path.isdir(self.output_dir):
+            return
+        for name in os.listdir(self.output_dir):
+            path = os.path.join(self.output_dir, name)
+            if name.startswith(f"{self.partition_by}=") and os.path.isdir(path):
+                shutil.rmtree(path)
+
+    def read_back(self) -> Tuple[int, List[str]]:
+        """(row count, partition values) of the written dataset, as a reader sees it"""
+        if self.fmt != "csv":
+            import pyarrow.dataset as ds
+
+            dataset = ds.dataset(self.output_dir, format=self.fmt,
+                                 partitioning="hive" if self.partition_by else None)
+            if not self.partition_by:
+                return dataset.count_rows(), []
+            values = dataset.to_table(columns=[self.partition_by]).column(self.partition_by).unique()
+            return dataset.count_rows(), sorted(str(v) for v in values.to_pylist())
+
+        rows = 0
+        values = []
+        for root, _, files in os.walk(self.output_dir):
+            for name in files:
+                if not name.endswith(".csv"):
+                    continue
+                with open(os.path.join(root, name), 'r', encoding='utf-8', newline='') as f:
+                    rows += sum(1 for _ in csv.reader(f)) - 1
+                directory = os.path.basename(root)
+                if self.partition_by and directory.startswith(f"{self.partition_by}="):
+                    values.append(unquote(directory.split("=", 1)[1]))
+        return rows, sorted(values)
+
+    def verify(self, expected_rows: int, expected_values: Iterable[Optional[str]]) -> None:
+        """Read the dataset back and check it holds what was written"""
+        rows, values = self.read_back()
+        expected = sorted(str(v) for v in expected_values if v is not None) if self.partition_by else []
+        if rows != expected_rows or values != expected:
+            raise RuntimeError(
+                f"Export read-back mismatch in {self.output_dir}: {rows} rows in "
+                f"{len(values)} partition(s), expected {expected_rows} in {len(expected)}"
+            )
+
+    def export(self, rows: Iterable[Row], verify: bool = True) -> Dict[str, Any]:
+        """Stream rows to disk, flushing each partition every ``row_group_size`` rows"""
+        buffers: Dict[Optional[str], List[Row]] = {}
+        writers: Dict[Optional[str], Any] = {}
+        total = 0
+        self._clear_partitions()
+
+        def flush(key):
+            if key not in writers:
+                writers[key] = self._open_writer(self._partition_path(key))
+            writers[key].write(buffers[key])
+            buffers[key] = []
+
+        try:
+            for row in rows:
+                key = row[self._partition_index] if self._partition_index is not None else None
+                buffer = buffers.setdefault(key, [])
+                buffer.append(row)
+                total += 1
+                if len(buffer) >= self.row_group_size:
+                    flush(key)
+                if self.budget and total % BUDGET_CHECK_ROWS == 0 and self.budget.exceeded():
+                    # Spill every partition buffer and keep smaller groups from now on
+                    for buffered_key, buffered in buffers.items():
+                        if buffered:
+                            flush(buffered_key)
+                    self.row_group_size = max(MIN_ROW_GROUP_SIZE, self.row_group_size // 2)
+                    logger.warning(f"⚠️  Over the {self.budget.limit_mb:.0f} MB memory budget, "
+                                   f"row group size now {self.row_group_size}")
+
+            for key, buffer in buffers.items():
+                if buffer:
+                    flush(key)
+        finally:
+            for writer in writers.values():
+                writer.close()
+
+        if verify and writers:
+            self.verify(total, writers.keys())
+        logger.info(f"💾 Exported {total} rows to {len(writers)} {self.fmt} partition(s) in {self.output_dir}")
+        return {"rows": total, "partitions": len(writers), "format": self.fmt}
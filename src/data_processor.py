@@ -8,16 +8,19 @@ enhanced insights and trend analysis.
 
 import json
 import logging
+import os
 from datetime import datetime
 from typing import Dict, List, Optional, Tuple, Any
-import numpy as np
 from collections import defaultdict
 
 from .models import (
     PatientProfile, LabReport, BiomarkerType, BiomarkerValue, 
-    BiomarkerTrend, DashboardData
+    BiomarkerTrend, DashboardData, TrendSeries
 )
 from .extractor import BiomarkerExtractor
+from .downsampling import as_naive_utc, build_resolutions, select_series, DEFAULT_MAX_POINTS
+from .cohort_stats import CohortStatistics, percentile_rank
+from .memory_profile import MemoryProfiler
 
 logger = logging.getLogger(__name__)
 
@@ -25,8 +28,10 @@ logger = logging.getLogger(__name__)
 class BiomarkerDataProcessor:
     """Processes and analyzes biomarker data"""
     
-    def __init__(self):
-        self.extractor = BiomarkerExtractor()
+    def __init__(self, profiler: Optional[MemoryProfiler] = None,
+                 pdf_stats_path: Optional[str] = None):
+        self.profiler = profiler or MemoryProfiler(enabled=False)
+        self.extractor = BiomarkerExtractor(pdf_stats_path=pdf_stats_path, profiler=self.profiler)
         
     def load_and_process_data(self, json_paths: List[str]) -> PatientProfile:
         """Load and process multiple JSON data files"""
@@ -59,7 +64,7 @@ class BiomarkerDataProcessor:
                         report_date = datetime.now()
                     else:
                         try:
-                            report_date = datetime.fromisoformat(date_str.replace('Z', '+00:00'))
+                            report_date = as_naive_utc(datetime.fromisoformat(date_str.replace('Z', '+00:00')))
                         except:
                             report_date = datetime.now()
                     
@@ -80,7 +85,7 @@ class BiomarkerDataProcessor:
                                 )
                                 biomarkers[biomarker_type] = biomarker_value
                         except Exception as e:
-                            logger.warning(f"Error processing biomarker {biomarker_name}: {str(e)}")
+                            logger.warning("Error processing biomarker %s: %s", biomarker_name, e)
                     
                     # Create LabReport
                     lab_report = LabReport(
@@ -112,6 +117,26 @@ class BiomarkerDataProcessor:
         logger.info(f"✅ Processed {len(all_reports)} reports with {sum(len(r.biomarkers) for r in all_reports)} total biomarkers")
         return patient_profile
     
+    def load_from_store(self, store, patient_id: str,
+                        since: Optional[datetime] = None,
+                        biomarkers: Optional[List[BiomarkerType]] = None) -> PatientProfile:
+        """Load just the slice of a patient's history needed from a ReportStore
+
+        Recent reports come from the store's hot tier; compacted history is
+        merged in from its cold segments.
+        """
+        patient_profile = store.load_patient_profile(patient_id, since=since, biomarkers=biomarkers)
+        if patient_profile is None:
+            raise KeyError(f"Patient not found in store: {patient_id}")
+        
+        cold_reports = store.load_cold_reports(patient_id, since=since, biomarkers=biomarkers)
+        if cold_reports:
+            patient_profile.reports = sorted(cold_reports + patient_profile.reports, key=lambda r: r.report_date)
+        
+        logger.info(f"✅ Loaded {len(patient_profile.reports)} reports for {patient_id} from store "
+                    f"({len(cold_reports)} compacted)")
+        return patient_profile
+    
     def calculate_trends(self, patient_profile: PatientProfile) -> Dict[BiomarkerType, BiomarkerTrend]:
         """Calculate trends for each biomarker"""
         trends = {}
@@ -139,26 +164,41 @@ class BiomarkerDataProcessor:
             else:
                 change_percentage = 0.0
             
+            # Long histories ship only their downsampled levels; the API
+            # serves other ranges from the store
+            long_history = len(values) > DEFAULT_MAX_POINTS
+            
             # Create BiomarkerTrend
             trend = BiomarkerTrend(
                 biomarker=biomarker_type,
-                values=values,
-                dates=dates,
+                values=[] if long_history else values,
+                dates=[] if long_history else dates,
+                points=len(values),
                 trend_direction=trend_direction,
                 trend_strength=trend_strength,
                 latest_value=values[-1],
-                change_percentage=change_percentage
+                change_percentage=change_percentage,
+                resolutions=build_resolutions(dates, values)
             )
             
             trends[biomarker_type] = trend
         
         return trends
     
+    def get_trend_series(self, trend: BiomarkerTrend,
+                         start: Optional[datetime] = None,
+                         end: Optional[datetime] = None,
+                         max_points: int = DEFAULT_MAX_POINTS) -> TrendSeries:
+        """Chart series for a trend, resolution chosen by the requested date range"""
+        return select_series(trend, start=start, end=end, max_points=max_points)
+    
     def _calculate_trend_direction(self, values: List[float]) -> Tuple[str, float]:
         """Calculate trend direction and strength"""
         if len(values) < 2:
             return "stable", 0.0
         
+        import numpy as np  # imported lazily; only trend analysis needs it
+        
         # Calculate linear regression
         x = np.arange(len(values))
         y = np.array(values)
@@ -187,7 +227,7 @@ class BiomarkerDataProcessor:
         else:
             direction = "falling"
         
-        return direction, min(r_squared, 1.0)
+        return direction, max(0.0, min(r_squared, 1.0))
     
     def generate_summary_stats(self, patient_profile: PatientProfile) -> Dict[str, Any]:
         """Generate summary statistics"""
@@ -334,21 +374,37 @@ class BiomarkerDataProcessor:
         
         return recommendations.get(biomarker_type, {}).get(status, "Continue monitoring and consult healthcare provider.")
     
-    def create_dashboard_data(self, json_paths: List[str]) -> DashboardData:
+    def create_dashboard_data(self, json_paths: List[str],
+                              cohort_stats: Optional[Dict[str, Any]] = None) -> DashboardData:
         """Create complete dashboard data from JSON files"""
         logger.info("🚀 Creating dashboard data from JSON files")
         
         # Load and process data
-        patient_profile = self.load_and_process_data(json_paths)
+        with self.profiler.stage("convert"):
+            patient_profile = self.load_and_process_data(json_paths)
         
+        return self.build_dashboard_data(patient_profile, cohort_stats)
+    
+    def build_dashboard_data(self, patient_profile: PatientProfile,
+                             cohort_stats: Optional[Dict[str, Any]] = None) -> DashboardData:
+        """Create complete dashboard data for an already loaded patient profile
+
+        ``cohort_stats`` is an exported ``CohortStatistics`` table; when given,
+        the patient's latest values are ranked against their age/sex stratum.
+        """
         # Calculate trends
-        trends = self.calculate_trends(patient_profile)
+        with self.profiler.stage("trend"):
+            trends = self.calculate_trends(patient_profile)
         
         # Generate summary statistics
-        summary_stats = self.generate_summary_stats(patient_profile)
+        with self.profiler.stage("stats"):
+            summary_stats = self.generate_summary_stats(patient_profile)
+            if cohort_stats:
+                summary_stats["cohort_percentiles"] = self.cohort_percentiles(patient_profile, cohort_stats)
         
         # Generate alerts
-        alerts = self.generate_alerts(patient_profile, trends)
+        with self.profiler.stage("alerts"):
+            alerts = self.generate_alerts(patient_profile, trends)
         
         # Create DashboardData
         dashboard_data = DashboardData(
@@ -361,10 +417,51 @@ class BiomarkerDataProcessor:
         logger.info(f"✅ Dashboard data created: {len(trends)} trends, {len(alerts)} alerts")
         return dashboard_data
     
+    def compute_cohort_stats(self, patient_profiles: List[PatientProfile]) -> CohortStatistics:
+        """Build cohort statistics over a set of patient profiles"""
+        cohort = CohortStatistics()
+        with self.profiler.stage("stats"):
+            for patient_profile in patient_profiles:
+                cohort.add_profile(patient_profile)
+        return cohort
+    
+    def cohort_percentiles(self, patient_profile: PatientProfile,
+                           cohort_stats: Dict[str, Any]) -> Dict[str, Optional[float]]:
+        """Percentile of each latest biomarker value within the patient's stratum"""
+        latest = {}
+        for report in patient_profile.reports:
+            latest.update(report.biomarkers)
+        
+        return {
+            biomarker_type.value: percentile_rank(
+                cohort_stats, biomarker_type, biomarker.value,
+                age=patient_profile.age, gender=patient_profile.gender
+            )
+            for biomarker_type, biomarker in latest.items()
+        }
+    
+    def export_cohort_stats(self, cohort: CohortStatistics, output_path: str) -> Dict[str, Any]:
+        """Export cohort percentile tables alongside the dashboard data
+
+        Written to a temporary file and renamed into place, so the dashboard
+        never fetches a half-written table.
+        """
+        exported = cohort.export()
+        try:
+            tmp_path = f"{output_path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(exported, f, indent=2)
+            os.replace(tmp_path, output_path)
+            logger.info(f"💾 Cohort statistics exported to: {output_path}")
+        except Exception as e:
+            logger.error(f"❌ Error exporting cohort statistics: {str(e)}")
+            raise
+        return exported
+    
     def export_to_json(self, dashboard_data: DashboardData, output_path: str) -> None:
         """Export dashboard data to JSON format"""
         try:
-            with open(output_path, 'w', encoding='utf-8') as f:
+            with self.profiler.stage("export"), open(output_path, 'w', encoding='utf-8') as f:
                 json.dump(dashboard_data.dict(), f, indent=2, ensure_ascii=False, default=str)
             logger.info(f"💾 Dashboard data exported to: {output_path}")
         except Exception as e:
@@ -0,0 +1,142 @@
+"""
+Chart Series Downsampling
+=========================
+
+Downsampled series for long biomarker histories. Trends longer than a chart
+carry precomputed Largest-Triangle-Three-Buckets levels instead of their raw
+series, so the dashboard payload and render times stay bounded regardless of
+history length. ``select_series`` serves other ranges and budgets (the API's
+trend endpoint) from the raw series when the trend still has it, otherwise
+from its finest level; the API prefers the report store's raw readings.
+"""
+
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from .models import BiomarkerTrend, TrendSeries
+
+# Default point budget for a single chart (CHART_MAX_POINTS in app.js)
+DEFAULT_MAX_POINTS = 200
+
+# Target point counts precomputed for every trend longer than the target
+RESOLUTION_TARGETS = (50, DEFAULT_MAX_POINTS, 1000)
+
+
+def as_naive_utc(value: datetime) -> datetime:
+    """Convert an aware datetime to naive UTC; naive ones are taken as UTC already"""
+    if value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def lttb_indices(xs: Sequence[float], ys: Sequence[float], threshold: int) -> List[int]:
+    """Indices of the points kept by Largest-Triangle-Three-Buckets
+
+    Always keeps the first and last point and preserves visual peaks better
+    than uniform striding.
+    """
+    n = len(xs)
+    if threshold >= n or threshold < 3:
+        return list(range(n))
+
+    indices = [0]
+    bucket_size = (n - 2) / (threshold - 2)
+    a = 0
+
+    for i in range(threshold - 2):
+        # Average of the next bucket is the third triangle vertex
+        next_start = int((i + 1) * bucket_size) + 1
+        next_end = min(int((i + 2) * bucket_size) + 1, n)
+        if next_start >= next_end:
+            next_start, next_end = n - 1, n
+        avg_x = sum(xs[next_start:next_end]) / (next_end - next_start)
+        avg_y = sum(ys[next_start:next_end]) / (next_end - next_start)
+
+        start = int(i * bucket_size) + 1
+        end = int((i + 1) * bucket_size) + 1
+        ax, ay = xs[a], ys[a]
+
+        best_area = -1.0
+        best = start
+        for j in range(start, end):
+            area = abs((ax - avg_x) * (ys[j] - ay) - (ax - xs[j]) * (avg_y - ay))
+            if area > best_area:
+                best_area = area
+                best = j
+
+        indices.append(best)
+        a = best
+
+    indices.append(n - 1)
+    return indices
+
+
+def downsample(dates: List[datetime], values: List[float], threshold: int) -> Tuple[List[datetime], List[float]]:
+    """Downsample a dated series to at most ``threshold`` points"""
+    xs = [d.timestamp() for d in dates]
+    keep = lttb_indices(xs, values, threshold)
+    return [dates[i] for i in keep], [values[i] for i in keep]
+
+
+def build_resolutions(dates: List[datetime], values: List[float],
+                      targets: Sequence[int] = RESOLUTION_TARGETS) -> Dict[str, TrendSeries]:
+    """Precompute downsampled levels for every target smaller than the series"""
+    resolutions = {}
+    for target in targets:
+        if len(values) <= target:
+            continue
+        level_dates, level_values = downsample(dates, values, target)
+        resolutions[str(target)] = TrendSeries(method="lttb", dates=level_dates, values=level_values)
+    return resolutions
+
+
+def range_series(dates: List[datetime], values: List[float],
+                 start: Optional[datetime] = None,
+                 end: Optional[datetime] = None,
+                 max_points: int = DEFAULT_MAX_POINTS) -> TrendSeries:
+    """Slice a dated series to ``[start, end]`` and downsample it to ``max_points``"""
+    start = as_naive_utc(start) if start is not None else None
+    end = as_naive_utc(end) if end is not None else None
+
+    sliced_dates, sliced_values = [], []
+    for date, value in zip(dates, values):
+        moment = as_naive_utc(date)
+        if (start is None or moment >= start) and (end is None or moment <= end):
+            sliced_dates.append(date)
+            sliced_values.append(value)
+
+    if len(sliced_values) <= max_points:
+        return TrendSeries(method="raw", dates=sliced_dates, values=sliced_values)
+    sliced_dates, sliced_values = downsample(sliced_dates, sliced_values, max_points)
+    return TrendSeries(method="lttb", dates=sliced_dates, values=sliced_values)
+
+
+def select_series(trend: BiomarkerTrend,
+                  start: Optional[datetime] = None,
+                  end: Optional[datetime] = None,
+                  max_points: int = DEFAULT_MAX_POINTS) -> TrendSeries:
+    """Return the series to plot for a date range within a point budget
+
+    Full-range requests are served from the largest precomputed level that
+    fits; narrower ranges are sliced from the raw series (or, for trends
+    whose raw series was dropped, the finest level) and downsampled only if
+    the slice still exceeds the budget.
+    """
+    if trend.values:
+        base = TrendSeries(method="raw", dates=trend.dates, values=trend.values)
+    elif trend.resolutions:
+        base = trend.resolutions[str(max(int(size) for size in trend.resolutions))]
+    else:
+        return TrendSeries(method="raw")
+
+    if start is None and end is None:
+        if base.method == "raw" and len(base.values) <= max_points:
+            return base
+        fitting = [int(size) for size in trend.resolutions if int(size) <= max_points]
+        if fitting:
+            return trend.resolutions[str(max(fitting))]
+
+    series = range_series(base.dates, base.values, start=start, end=end, max_points=max_points)
+    if base.method != "raw":
+        series.method = base.method
+    return series
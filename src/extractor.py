@@ -13,11 +13,14 @@ import os
 from datetime import datetime
 from typing import Dict, List, Optional, Tuple, Any, Union
 from dataclasses import dataclass
-import fitz  # PyMuPDF
-import pdfplumber
-from dateutil import parser as date_parser
+
+# PDF backends (fitz/pdfplumber) and dateutil are imported on first use so that
+# JSON-only pipelines don't pay their import cost at startup.
 
 from .models import BiomarkerType, UnitType, BiomarkerValue, LabReport, PatientProfile
+from .pdf_backends import BackendSelector
+from .memory_profile import MemoryProfiler
+from .downsampling import as_naive_utc
 
 logger = logging.getLogger(__name__)
 
@@ -30,12 +33,46 @@ class ExtractionResult:
     confidence: float
     context: str
     pattern_used: str
+    reference_range: Optional[Dict[str, float]] = None
+
+
+@dataclass
+class TableRow:
+    """A table row rebuilt from PDF word geometry"""
+    page: int
+    y: float
+    cells: List[str]
+
+    @property
+    def text(self) -> str:
+        return " ".join(self.cells)
+
+
+# Extraction modes accepted by parse_pdf_report
+EXTRACTION_MODES = ("text", "table", "auto")
+
+# Report date patterns, tried in order
+DATE_PATTERNS = [
+    re.compile(r"(\d{4}-\d{2}-\d{2})"),  # ISO format
+    re.compile(r"(\d{1,2}[/-]\d{1,2}[/-]\d{2,4})"),  # DD/MM/YYYY or MM/DD/YYYY
+    re.compile(r"(\d{1,2}\s+(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)[a-z]*\s+\d{2,4})", re.IGNORECASE),  # DD Month YYYY
+    re.compile(r"((?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)[a-z]*\s+\d{1,2},?\s+\d{2,4})", re.IGNORECASE),  # Month DD, YYYY
+    re.compile(r"(\d{1,2}-\d{1,2}-\d{2,4})"),  # DD-MM-YYYY
+]
+FILENAME_DATE_PATTERN = re.compile(r"(\d{4}[-_]\d{2}[-_]\d{2})")
 
 
 class BiomarkerExtractor:
     """Advanced biomarker extraction with multiple strategies"""
     
-    def __init__(self):
+    def __init__(self, pdf_stats_path: Optional[str] = None,
+                 profiler: Optional[MemoryProfiler] = None):
+        # Per-stage memory accounting; disabled unless a profiler is passed in
+        self.profiler = profiler or MemoryProfiler(enabled=False)
+
+        # PDF text backends, ordered per document layout from historical timings
+        self.pdf_backends = BackendSelector(stats_path=pdf_stats_path)
+
         # Comprehensive biomarker patterns with multiple variations
         self.biomarker_patterns = {
             BiomarkerType.TOTAL_CHOLESTEROL: [
@@ -113,6 +150,12 @@ class BiomarkerExtractor:
             ]
         }
         
+        # Compiled once per extractor; pre-forked workers share them copy-on-write
+        self._compiled_patterns = {
+            biomarker_type: [re.compile(pattern, re.IGNORECASE) for pattern in patterns]
+            for biomarker_type, patterns in self.biomarker_patterns.items()
+        }
+        
         # Reference ranges for validation
         self.reference_ranges = {
             BiomarkerType.TOTAL_CHOLESTEROL: {"min": 125, "max": 200, "unit": UnitType.MG_DL},
@@ -141,6 +184,28 @@ class BiomarkerExtractor:
             "nmol/L": UnitType.NMOL_L,
             "pmol/L": UnitType.PMOL_L,
         }
+        self._unit_lookup = {k.lower(): v for k, v in self.unit_mappings.items()}
+
+        # Row label patterns for table mode (matched against the leading label cells)
+        self.row_label_patterns = {
+            BiomarkerType.LDL: re.compile(r"^(?:ldl|low\s+density\s+lipoprotein)\b", re.IGNORECASE),
+            BiomarkerType.HDL: re.compile(r"^(?:hdl|high\s+density\s+lipoprotein)\b", re.IGNORECASE),
+            BiomarkerType.TOTAL_CHOLESTEROL: re.compile(
+                r"^(?!.*\b(?:v?ldl|hdl)\b)(?:(?:serum\s+)?total\s+cholesterol|cholesterol[,\s]*(?:total)?)\b",
+                re.IGNORECASE
+            ),
+            BiomarkerType.TRIGLYCERIDES: re.compile(r"^(?:(?:serum\s+)?triglycerides?|tg)\b", re.IGNORECASE),
+            BiomarkerType.CREATININE: re.compile(r"^(?:serum\s+)?creatinine\b", re.IGNORECASE),
+            BiomarkerType.VITAMIN_D: re.compile(
+                r"^(?:25[-\s]?(?:oh|hydroxy)\s*)?vit(?:amin)?\s*d\d?\b", re.IGNORECASE
+            ),
+            BiomarkerType.VITAMIN_B12: re.compile(r"^(?:vit(?:amin)?\s*b\s*12|cobalamin)\b", re.IGNORECASE),
+            BiomarkerType.HBA1C: re.compile(r"^(?:hb\s*a1c|glycated\s+ha?emoglobin)\b", re.IGNORECASE),
+        }
+        self._number_cell = re.compile(r"^[<>]?\s*(\d+(?:\.\d+)?)\s*(?:[HL]|\*)?$", re.IGNORECASE)
+        self._range_cell = re.compile(
+            r"^(?:(\d+(?:\.\d+)?)\s*[-–]\s*(\d+(?:\.\d+)?)|([<>]=?)\s*(\d+(?:\.\d+)?))$"
+        )
 
     def load_json_data(self, json_path: str) -> Dict[str, Any]:
         """Load existing JSON data files"""
@@ -171,7 +236,7 @@ class BiomarkerExtractor:
                     report_date = datetime.now()
                 else:
                     try:
-                        report_date = datetime.fromisoformat(date_str.replace('Z', '+00:00'))
+                        report_date = as_naive_utc(datetime.fromisoformat(date_str.replace('Z', '+00:00')))
                     except:
                         report_date = datetime.now()
                 
@@ -239,9 +304,10 @@ class BiomarkerExtractor:
         }
         return mapping.get(legacy_name)
 
-    def _get_status(self, biomarker_type: BiomarkerType, value: float) -> str:
+    def _get_status(self, biomarker_type: BiomarkerType, value: float,
+                    ref_range: Optional[Dict[str, float]] = None) -> str:
         """Determine clinical status based on reference ranges"""
-        ref_range = self.reference_ranges[biomarker_type]
+        ref_range = ref_range or self.reference_ranges[biomarker_type]
         min_val, max_val = ref_range["min"], ref_range["max"]
         
         if value < min_val:
@@ -252,81 +318,172 @@ class BiomarkerExtractor:
             return "Normal"
 
     def extract_text_from_pdf(self, pdf_path: str) -> str:
-        """Extract text from PDF using multiple strategies"""
-        text_parts = []
-        
+        """Extract text from PDF using the best backend for its layout"""
+        text, _ = self.extract_text_from_pdf_with_info(pdf_path)
+        return text
+
+    def extract_text_from_pdf_with_info(self, pdf_path: str) -> Tuple[str, Dict[str, Any]]:
+        """Extract text from PDF and report which backends produced it"""
+        try:
+            return self.pdf_backends.extract_text(pdf_path)
+        except Exception as e:
+            logger.error("Error extracting text from %s: %s", pdf_path, e)
+            return "", {}
+
+    def extract_table_rows_from_pdf(self, pdf_path: str) -> List[TableRow]:
+        """Rebuild table rows from PyMuPDF word coordinates"""
+        import fitz  # PyMuPDF
+
+        rows = []
+
         try:
-            # Strategy 1: PyMuPDF (fitz)
             doc = fitz.open(pdf_path)
             for page_num in range(len(doc)):
                 page = doc.load_page(page_num)
-                text = page.get_text()
-                text_parts.append(text)
+                rows.extend(self._build_table_rows(page.get_text("words"), page_num))
             doc.close()
-            
-            # Strategy 2: pdfplumber (if PyMuPDF fails)
-            if not any(text_parts):
-                with pdfplumber.open(pdf_path) as pdf:
-                    for page in pdf.pages:
-                        text = page.extract_text()
-                        if text:
-                            text_parts.append(text)
-            
-            return " ".join(text_parts)
-            
         except Exception as e:
-            logger.error(f"Error extracting text from {pdf_path}: {str(e)}")
-            return ""
+            logger.error("Error extracting table rows from %s: %s", pdf_path, e)
+
+        return rows
+
+    def _build_table_rows(self, words: List[Tuple], page_num: int = 0) -> List[TableRow]:
+        """Group (x0, y0, x1, y1, word, ...) tuples into rows of cells"""
+        if not words:
+            return []
+
+        # Words whose vertical centres fall within half a line height share a row
+        heights = sorted(w[3] - w[1] for w in words)
+        tolerance = max(heights[len(heights) // 2] / 2, 1.0)
+
+        lines: List[List[Tuple]] = []
+        for word in sorted(words, key=lambda w: ((w[1] + w[3]) / 2, w[0])):
+            centre = (word[1] + word[3]) / 2
+            if lines and abs(centre - (lines[-1][0][1] + lines[-1][0][3]) / 2) <= tolerance:
+                lines[-1].append(word)
+            else:
+                lines.append([word])
+
+        rows = []
+        for line in lines:
+            line.sort(key=lambda w: w[0])
+            # A horizontal gap wider than ~1.5 characters starts a new cell
+            char_width = sum((w[2] - w[0]) / max(len(w[4]), 1) for w in line) / len(line)
+            cells = [[line[0][4]]]
+            for prev, word in zip(line, line[1:]):
+                if word[0] - prev[2] > char_width * 1.5:
+                    cells.append([word[4]])
+                else:
+                    cells[-1].append(word[4])
+            rows.append(TableRow(
+                page=page_num,
+                y=round(line[0][1], 1),
+                cells=[" ".join(cell) for cell in cells]
+            ))
+
+        return rows
+
+    def _parse_reference_range(self, biomarker_type: BiomarkerType, cell: str) -> Optional[Dict[str, float]]:
+        """Parse a printed reference range cell such as '40 - 60' or '< 200'"""
+        match = self._range_cell.match(cell.strip())
+        if not match:
+            return None
+        if match.group(1):
+            return {"min": float(match.group(1)), "max": float(match.group(2))}
+        bound = float(match.group(4))
+        if match.group(3).startswith("<"):
+            return {"min": 0.0, "max": bound}
+        # Open-ended ranges keep the default upper limit so the range stays JSON-safe
+        return {"min": bound, "max": max(bound, self.reference_ranges[biomarker_type]["max"])}
+
+    def extract_biomarker_from_rows(self, rows: List[TableRow],
+                                    biomarker_type: BiomarkerType) -> Optional[ExtractionResult]:
+        """Extract a single biomarker by matching row labels and reading its cells"""
+        label_pattern = self.row_label_patterns[biomarker_type]
+
+        for row in rows:
+            if not row.cells or not label_pattern.match(row.cells[0]):
+                continue
+
+            value = None
+            unit = None
+            ref_range = None
+            for cell in row.cells[1:]:
+                if value is None:
+                    number = self._number_cell.match(cell)
+                    if number:
+                        value = float(number.group(1))
+                        continue
+                if unit is None and cell.lower() in self._unit_lookup:
+                    unit = self._unit_lookup[cell.lower()]
+                    continue
+                if ref_range is None:
+                    ref_range = self._parse_reference_range(biomarker_type, cell)
+
+            if value is None or not self._validate_value(biomarker_type, value):
+                continue
+
+            # Row hits read the value from a dedicated cell; an explicit unit raises confidence further
+            return ExtractionResult(
+                value=value,
+                unit=unit or self.reference_ranges[biomarker_type]["unit"],
+                confidence=1.0 if unit else 0.9,
+                context=row.text,
+                pattern_used=f"table_row:{label_pattern.pattern}",
+                reference_range=ref_range
+            )
+
+        return None
+
+    def _date_from_text(self, text: str) -> Optional[datetime]:
+        """First parseable report date in ``text``, or None"""
+        for pattern in DATE_PATTERNS:
+            matches = pattern.findall(text)
+            for match in matches:
+                try:
+                    # Try multiple date formats
+                    for fmt in ["%Y-%m-%d", "%d/%m/%Y", "%m/%d/%Y", "%d-%m-%Y", "%m-%d-%Y"]:
+                        try:
+                            return datetime.strptime(match.strip(), fmt)
+                        except ValueError:
+                            continue
+                    
+                    # Try dateutil parser as fallback
+                    from dateutil import parser as date_parser
+                    return date_parser.parse(match.strip())
+                except:
+                    continue
+        return None
 
     def extract_date(self, text: str, filename: str = "") -> datetime:
         """Extract and parse date from text with multiple strategies"""
         try:
             # Strategy 1: Look for date patterns in text
-            date_patterns = [
-                r"(\d{4}-\d{2}-\d{2})",  # ISO format
-                r"(\d{1,2}[/-]\d{1,2}[/-]\d{2,4})",  # DD/MM/YYYY or MM/DD/YYYY
-                r"(\d{1,2}\s+(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)[a-z]*\s+\d{2,4})",  # DD Month YYYY
-                r"((?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)[a-z]*\s+\d{1,2},?\s+\d{2,4})",  # Month DD, YYYY
-                r"(\d{1,2}-\d{1,2}-\d{2,4})",  # DD-MM-YYYY
-            ]
-            
-            for pattern in date_patterns:
-                matches = re.findall(pattern, text, re.IGNORECASE)
-                for match in matches:
-                    try:
-                        # Try multiple date formats
-                        for fmt in ["%Y-%m-%d", "%d/%m/%Y", "%m/%d/%Y", "%d-%m-%Y", "%m-%d-%Y"]:
-                            try:
-                                return datetime.strptime(match.strip(), fmt)
-                            except ValueError:
-                                continue
-                        
-                        # Try dateutil parser as fallback
-                        return date_parser.parse(match.strip())
-                    except:
-                        continue
+            date = self._date_from_text(text)
+            if date is not None:
+                return date
             
             # Strategy 2: Extract from filename
             if filename:
-                date_match = re.search(r"(\d{4}[-_]\d{2}[-_]\d{2})", filename)
+                date_match = FILENAME_DATE_PATTERN.search(filename)
                 if date_match:
                     return datetime.strptime(date_match.group(1), "%Y-%m-%d")
             
             # Strategy 3: Default to current date
-            logger.warning(f"No date found, using current date")
+            logger.warning("No date found, using current date")
             return datetime.now()
             
         except Exception as e:
-            logger.error(f"Error extracting date: {str(e)}")
+            logger.error("Error extracting date: %s", e)
             return datetime.now()
 
     def extract_biomarker(self, text: str, biomarker_type: BiomarkerType) -> Optional[ExtractionResult]:
         """Extract a single biomarker with confidence scoring"""
-        patterns = self.biomarker_patterns.get(biomarker_type, [])
+        patterns = self._compiled_patterns.get(biomarker_type, [])
         
         for i, pattern in enumerate(patterns):
             try:
-                match = re.search(pattern, text, re.IGNORECASE)
+                match = pattern.search(text)
                 if match:
                     # Extract value and unit
                     value = float(match.group(1))
@@ -356,11 +513,11 @@ class BiomarkerExtractor:
                             unit=unit,
                             confidence=confidence,
                             context=context,
-                            pattern_used=pattern
+                            pattern_used=pattern.pattern
                         )
                     
             except (ValueError, IndexError) as e:
-                logger.debug(f"Pattern {i} failed for {biomarker_type}: {str(e)}")
+                logger.debug("Pattern %d failed for %s: %s", i, biomarker_type, e)
                 continue
         
         return None
@@ -381,41 +538,109 @@ class BiomarkerExtractor:
         min_val, max_val = ranges.get(biomarker_type, (0, float('inf')))
         return min_val <= value <= max_val
 
-    def extract_all_biomarkers(self, text: str) -> Dict[BiomarkerType, BiomarkerValue]:
-        """Extract all biomarkers from text"""
+    def extract_all_biomarkers(self, text: str,
+                               rows: Optional[List[TableRow]] = None,
+                               only: Optional[List[BiomarkerType]] = None) -> Dict[BiomarkerType, BiomarkerValue]:
+        """Extract all biomarkers (or ``only`` these) from table rows (when given) and/or text"""
         results = {}
         
-        for biomarker_type in BiomarkerType:
-            extraction_result = self.extract_biomarker(text, biomarker_type)
+        for biomarker_type in only if only is not None else BiomarkerType:
+            extraction_result = None
+            if rows:
+                extraction_result = self.extract_biomarker_from_rows(rows, biomarker_type)
+            if not extraction_result and text:
+                extraction_result = self.extract_biomarker(text, biomarker_type)
             if extraction_result:
-                # Get reference range
-                ref_range = self.reference_ranges[biomarker_type]
+                # Prefer the lab's printed reference range over the defaults
+                ref_range = extraction_result.reference_range or self.reference_ranges[biomarker_type]
+                ref_range = {"min": ref_range["min"], "max": ref_range["max"]}
                 
                 # Create BiomarkerValue object
                 biomarker_value = BiomarkerValue(
                     value=extraction_result.value,
                     unit=extraction_result.unit,
-                    reference_range={"min": ref_range["min"], "max": ref_range["max"]},
-                    status=self._get_status(biomarker_type, extraction_result.value),
+                    reference_range=ref_range,
+                    status=self._get_status(biomarker_type, extraction_result.value, ref_range),
                     confidence=extraction_result.confidence
                 )
                 
                 results[biomarker_type] = biomarker_value
-                logger.info(f"✅ {biomarker_type.value}: {extraction_result.value} {extraction_result.unit.value} (confidence: {extraction_result.confidence:.2f})")
+                logger.debug("✅ %s: %s %s (confidence: %.2f)", biomarker_type.value,
+                             extraction_result.value, extraction_result.unit.value, extraction_result.confidence)
             else:
-                logger.warning(f"❌ {biomarker_type.value}: Not found")
+                logger.debug("❌ %s: Not found", biomarker_type.value)
         
         return results
 
-    def parse_pdf_report(self, pdf_path: str) -> LabReport:
-        """Parse a single PDF report"""
-        logger.info(f"📄 Processing: {pdf_path}")
+    def parse_input_file(self, path: str, patient_name: str = "Unknown",
+                         pdf_mode: str = "auto") -> PatientProfile:
+        """Parse one input file (legacy JSON or PDF report) into a partial profile
+
+        JSON files carry their own patient; PDF reports are attributed to
+        ``patient_name``. Every report is tagged with the input it came from.
+        """
+        filename = os.path.basename(path)
+
+        if path.lower().endswith(".json"):
+            with self.profiler.stage("convert"):
+                data = self.load_json_data(path)
+                if not data:
+                    raise ValueError(f"No data loaded from {path}")
+                profile = self.convert_legacy_to_patient_profile(data)
+        else:
+            with self.profiler.stage("extract"):
+                report = self.parse_pdf_report(path, mode=pdf_mode)
+            if "error" in report.extraction_metadata:
+                raise ValueError(report.extraction_metadata["error"])
+            profile = PatientProfile(
+                patient_id=patient_name.replace(" ", "_").upper(),
+                name=patient_name,
+                reports=[report]
+            )
+
+        for report in profile.reports:
+            if report.source_file == "Unknown":
+                report.source_file = filename
+            report.extraction_metadata["ingested_from"] = filename
+        return profile
+
+    def parse_pdf_report(self, pdf_path: str, mode: str = "text") -> LabReport:
+        """Parse a single PDF report
+
+        ``mode`` selects the extraction path: ``"text"`` runs the regexes over the
+        flattened page text, ``"table"`` matches biomarkers against rows rebuilt
+        from word geometry, and ``"auto"`` tries table rows first and runs the text
+        backend only when the rows miss biomarkers (matching just those) or
+        carry no report date.
+        """
+        if mode not in EXTRACTION_MODES:
+            raise ValueError(f"Unknown extraction mode: {mode}")
+
+        logger.debug("📄 Processing: %s (mode: %s)", pdf_path, mode)
         
         try:
-            # Extract text
-            text = self.extract_text_from_pdf(pdf_path)
+            # Extract text and/or table rows
+            rows = self.extract_table_rows_from_pdf(pdf_path) if mode != "text" else []
+            backend_info = {}
+            if mode == "text":
+                text, backend_info = self.extract_text_from_pdf_with_info(pdf_path)
+                biomarkers = self.extract_all_biomarkers(text) if text.strip() else {}
+                date = None
+            else:
+                text = "\n".join(row.text for row in rows)
+                biomarkers = self.extract_all_biomarkers("", rows)
+                date = self._date_from_text(text)
+                missed = [bm for bm in BiomarkerType if bm not in biomarkers]
+                # Auto mode runs the text backend only when the rows left something out
+                if mode == "auto" and (missed or date is None):
+                    full_text, backend_info = self.extract_text_from_pdf_with_info(pdf_path)
+                    if full_text.strip():
+                        text = full_text
+                        if missed:
+                            biomarkers.update(self.extract_all_biomarkers(text, only=missed))
+                            biomarkers = {bm: biomarkers[bm] for bm in BiomarkerType if bm in biomarkers}
             if not text.strip():
-                logger.error(f"Empty text extracted from {pdf_path}")
+                logger.error("Empty text extracted from %s", pdf_path)
                 return LabReport(
                     report_date=datetime.now(),
                     source_file=pdf_path,
@@ -424,20 +649,26 @@ class BiomarkerExtractor:
                 )
             
             # Extract date
-            date = self.extract_date(text, os.path.basename(pdf_path))
-            logger.info(f"📅 Date extracted: {date}")
-            
-            # Extract biomarkers
-            biomarkers = self.extract_all_biomarkers(text)
+            if date is None:
+                date = self.extract_date(text, os.path.basename(pdf_path))
             
             # Create extraction metadata
             metadata = {
+                "extraction_mode": mode,
+                "table_rows": len(rows),
                 "text_length": len(text),
                 "biomarkers_found": len(biomarkers),
                 "extraction_timestamp": datetime.now().isoformat(),
-                "patterns_used": {bm.value: biomarkers[bm].confidence for bm in biomarkers}
+                "patterns_used": {bm.value: biomarkers[bm].confidence for bm in biomarkers},
+                **backend_info
             }
             
+            # One summary record per report rather than one line per biomarker
+            missing = [bm.value for bm in BiomarkerType if bm not in biomarkers]
+            logger.info("📄 %s: %d/%d biomarkers, dated %s (mode: %s)%s",
+                        os.path.basename(pdf_path), len(biomarkers), len(BiomarkerType),
+                        date.date(), mode, f", missing: {', '.join(missing)}" if missing else "")
+            
             return LabReport(
                 report_date=date,
                 source_file=os.path.basename(pdf_path),
@@ -446,14 +677,11 @@ class BiomarkerExtractor:
             )
             
         except Exception as e:
-            logger.error(f"Error processing {pdf_path}: {str(e)}")
+            logger.error("Error processing %s: %s", pdf_path, e)
             return LabReport(
                 report_date=datetime.now(),
                 source_file=pdf_path,
                 biomarkers={},
                 extraction_metadata={"error": str(e)}
             )
-
-
-# Import os at the top level
-import os 
\ No newline at end of file
+ 
\ No newline at end of file
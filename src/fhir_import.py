@@ -0,0 +1,387 @@
+"""
+FHIR Bulk NDJSON Importer
+=========================
+
+Imports FHIR ``Observation`` resources from bulk-data NDJSON exports. Lines
+are streamed, LOINC codes are mapped to ``BiomarkerType`` through a
+precomputed table, values are converted to the units used by the reference
+ranges, and observations are batched into one ``LabReport`` per patient and
+date. Observations in a unit with no known conversion, or without a usable
+date, are skipped and counted rather than stored under the wrong unit, as
+are malformed records (null or mistyped fields, non-numeric or negative
+values); partial FHIR dates ("2023", "2023-05") fall on the first day of
+the period.
+When importing into a store, reports for the same patient and date that
+come from different chunks are merged into one. Large files are split into newline-aligned byte ranges that are parsed
+in worker processes with a bounded number of ranges in flight, so memory
+stays flat regardless of file size. Under a memory budget the range size
+and the number of ranges in flight are halved whenever RSS is over the
+limit.
+"""
+
+import json
+import logging
+import math
+import os
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from .models import BiomarkerType, BiomarkerValue, LabReport
+from .memory_profile import MemoryBudget
+
+logger = logging.getLogger(__name__)
+
+LOINC_SYSTEM = "http://loinc.org"
+
+# Smallest byte range the memory budget may shrink chunks to
+MIN_CHUNK_BYTES = 256 * 1024
+
+# LOINC code -> biomarker
+LOINC_TO_BIOMARKER: Dict[str, BiomarkerType] = {
+    "2093-3": BiomarkerType.TOTAL_CHOLESTEROL,
+    "14647-2": BiomarkerType.TOTAL_CHOLESTEROL,
+    "13457-7": BiomarkerType.LDL,
+    "2089-1": BiomarkerType.LDL,
+    "18262-6": BiomarkerType.LDL,
+    "22748-8": BiomarkerType.LDL,
+    "2085-9": BiomarkerType.HDL,
+    "14646-4": BiomarkerType.HDL,
+    "2571-8": BiomarkerType.TRIGLYCERIDES,
+    "14927-8": BiomarkerType.TRIGLYCERIDES,
+    "2160-0": BiomarkerType.CREATININE,
+    "38483-4": BiomarkerType.CREATININE,
+    "14682-9": BiomarkerType.CREATININE,
+    "1989-3": BiomarkerType.VITAMIN_D,
+    "62292-8": BiomarkerType.VITAMIN_D,
+    "14635-7": BiomarkerType.VITAMIN_D,
+    "2132-9": BiomarkerType.VITAMIN_B12,
+    "14685-2": BiomarkerType.VITAMIN_B12,
+    "4548-4": BiomarkerType.HBA1C,
+    "17856-6": BiomarkerType.HBA1C,
+    "59261-8": BiomarkerType.HBA1C,
+}
+
+# (biomarker, lower-cased UCUM unit) -> (factor, offset) into the canonical unit
+UNIT_CONVERSIONS: Dict[Tuple[BiomarkerType, str], Tuple[float, float]] = {
+    (BiomarkerType.TOTAL_CHOLESTEROL, "mmol/l"): (38.67, 0.0),
+    (BiomarkerType.LDL, "mmol/l"): (38.67, 0.0),
+    (BiomarkerType.HDL, "mmol/l"): (38.67, 0.0),
+    (BiomarkerType.TRIGLYCERIDES, "mmol/l"): (88.57, 0.0),
+    (BiomarkerType.CREATININE, "umol/l"): (1 / 88.4, 0.0),
+    (BiomarkerType.CREATININE, "µmol/l"): (1 / 88.4, 0.0),
+    (BiomarkerType.CREATININE, "μmol/l"): (1 / 88.4, 0.0),
+    (BiomarkerType.VITAMIN_D, "nmol/l"): (1 / 2.496, 0.0),
+    (BiomarkerType.VITAMIN_B12, "pmol/l"): (1.355, 0.0),
+    (BiomarkerType.HBA1C, "mmol/mol"): (0.09148, 2.152),
+}
+
+# Lower-cased UCUM codes of the units the reference ranges are expressed in
+CANONICAL_UNITS: Dict[BiomarkerType, Tuple[str, ...]] = {
+    BiomarkerType.TOTAL_CHOLESTEROL: ("mg/dl",),
+    BiomarkerType.LDL: ("mg/dl",),
+    BiomarkerType.HDL: ("mg/dl",),
+    BiomarkerType.TRIGLYCERIDES: ("mg/dl",),
+    BiomarkerType.CREATININE: ("mg/dl",),
+    BiomarkerType.VITAMIN_D: ("ng/ml",),
+    BiomarkerType.VITAMIN_B12: ("pg/ml",),
+    BiomarkerType.HBA1C: ("%",),
+}
+
+# Observation statuses worth importing
+ACCEPTED_STATUSES = {"final", "amended", "corrected", "preliminary"}
+
+# (patient_id, day, biomarker value, value, ref_min, ref_max, loinc code)
+Observation = Tuple[str, str, str, float, Optional[float], Optional[float], str]
+
+
+def observation_day(when: str) -> Optional[str]:
+    """YYYY-MM-DD of a FHIR date/dateTime; partial dates use the first day of the period"""
+    day = when[:10]
+    if len(day) == 4:
+        day += "-01-01"
+    elif len(day) == 7:
+        day += "-01"
+    try:
+        datetime.strptime(day, "%Y-%m-%d")
+    except ValueError:
+        return None
+    return day
+
+
+def _mapping(value) -> Dict:
+    """``value`` if it is a JSON object, otherwise an empty one (null or mistyped fields)"""
+    return value if isinstance(value, dict) else {}
+
+
+def _number(value) -> Optional[float]:
+    """``value`` as a finite float, or None if it is not a JSON number"""
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    value = float(value)
+    return value if math.isfinite(value) else None
+
+
+def _record(rejected: Optional[Dict[str, int]], reason: str) -> None:
+    if rejected is not None:
+        rejected[reason] = rejected.get(reason, 0) + 1
+
+
+def parse_observation(resource: Dict, rejected: Optional[Dict[str, int]] = None) -> Optional[Observation]:
+    """Reduce one Observation resource to a compact tuple, or None to skip it
+
+    Skips worth reporting (unmapped units, unusable dates, malformed or
+    out-of-range values) are counted in ``rejected`` by reason.
+    """
+    def reject(reason: str) -> None:
+        _record(rejected, reason)
+
+    if not isinstance(resource, dict) or resource.get("resourceType") != "Observation":
+        return None
+    if resource.get("status", "final") not in ACCEPTED_STATUSES:
+        return None
+
+    biomarker_type = None
+    loinc_code = None
+    codings = _mapping(resource.get("code")).get("coding")
+    if not isinstance(codings, list):
+        reject("Observation without a code")
+        return None
+    for coding in codings:
+        coding = _mapping(coding)
+        if coding.get("system") == LOINC_SYSTEM and coding.get("code") in LOINC_TO_BIOMARKER:
+            loinc_code = coding["code"]
+            biomarker_type = LOINC_TO_BIOMARKER[loinc_code]
+            break
+    if biomarker_type is None:
+        return None
+
+    quantity = _mapping(resource.get("valueQuantity"))
+    if quantity.get("value") is None:
+        reject(f"{biomarker_type.value} without a valueQuantity")
+        return None
+    raw_value = _number(quantity.get("value"))
+    if raw_value is None:
+        reject(f"{biomarker_type.value} with non-numeric value")
+        return None
+    unit = quantity.get("code") or quantity.get("unit") or ""
+    unit = unit.lower() if isinstance(unit, str) else ""
+    if unit in CANONICAL_UNITS[biomarker_type]:
+        factor, offset = 1.0, 0.0
+    elif (biomarker_type, unit) in UNIT_CONVERSIONS:
+        factor, offset = UNIT_CONVERSIONS[(biomarker_type, unit)]
+    else:
+        reject(f"{biomarker_type.value} in unmapped unit '{unit or 'none'}'")
+        return None
+
+    value = round(raw_value * factor + offset, 3)
+    if value < 0:
+        reject(f"negative {biomarker_type.value} value")
+        return None
+
+    reference = _mapping(resource.get("subject")).get("reference")
+    patient_id = reference.split("/")[-1] if isinstance(reference, str) else ""
+    when = (
+        resource.get("effectiveDateTime")
+        or _mapping(resource.get("effectivePeriod")).get("start")
+        or resource.get("issued")
+    )
+    if not patient_id:
+        reject(f"{biomarker_type.value} without a patient reference")
+        return None
+    if not when:
+        reject(f"{biomarker_type.value} without a date")
+        return None
+    day = observation_day(when) if isinstance(when, str) else None
+    if day is None:
+        reject(f"unparseable date '{when}'")
+        return None
+
+    ref_min = ref_max = None
+    ref_ranges = resource.get("referenceRange")
+    for ref_range in ref_ranges[:1] if isinstance(ref_ranges, list) else []:
+        low = _number(_mapping(_mapping(ref_range).get("low")).get("value"))
+        high = _number(_mapping(_mapping(ref_range).get("high")).get("value"))
+        if low is not None:
+            ref_min = low * factor + offset
+        if high is not None:
+            ref_max = high * factor + offset
+
+    return (
+        patient_id, day, biomarker_type.value, value,
+        ref_min, ref_max, loinc_code,
+    )
+
+
+def parse_byte_range(path: str, start: int, end: int) -> Tuple[List[Observation], Dict[str, int]]:
+    """Parse the NDJSON lines that begin inside [start, end) of a file
+
+    Runs in worker processes; a line straddling ``end`` belongs to this range.
+    Returns the observations and the rejected-observation counts by reason.
+    """
+    observations = []
+    rejected: Dict[str, int] = {}
+    with open(path, 'rb') as f:
+        if start:
+            f.seek(start - 1)
+            # Skip the partial line unless the range starts exactly at a line start
+            if f.read(1) != b"\n":
+                f.readline()
+        while f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            # Cheap substring filter before paying for json.loads
+            if b'"Observation"' not in line or b"loinc.org" not in line:
+                continue
+            try:
+                resource = json.loads(line.decode("utf-8"))
+            except ValueError:
+                _record(rejected, "line that is not valid JSON")
+                continue
+            try:
+                observation = parse_observation(resource, rejected)
+            except (AttributeError, KeyError, TypeError, ValueError) as e:
+                # A shape the checks above do not anticipate; skip the record, not the file
+                _record(rejected, f"malformed Observation ({type(e).__name__})")
+                continue
+            if observation:
+                observations.append(observation)
+    return observations, rejected
+
+
+class FhirNdjsonImporter:
+    """Streams FHIR Observation NDJSON into per-patient, per-date LabReports"""
+
+    def __init__(self, extractor=None, workers: int = 1, chunk_bytes: int = 8 * 1024 * 1024,
+                 memory_budget_mb: Optional[float] = None):
+        if extractor is None:
+            from .extractor import BiomarkerExtractor
+            extractor = BiomarkerExtractor()
+        self.extractor = extractor
+        self.workers = max(1, workers)
+        self.chunk_bytes = chunk_bytes
+        self.budget = MemoryBudget(memory_budget_mb) if memory_budget_mb else None
+        # Ranges in flight per worker; the memory budget may lower this to one in total
+        self.window = self.workers * 2
+        self.rejected: Dict[str, int] = {}
+
+    def _over_budget(self) -> bool:
+        """Shrink chunk size and in-flight window when RSS is over the budget"""
+        if not self.budget or not self.budget.exceeded():
+            return False
+        self.chunk_bytes = max(MIN_CHUNK_BYTES, self.chunk_bytes // 2)
+        self.window = max(1, self.window // 2)
+        logger.warning(f"⚠️  Over the {self.budget.limit_mb:.0f} MB memory budget, "
+                       f"using {self.chunk_bytes // 1024} KB chunks with {self.window} in flight")
+        return True
+
+    def _byte_ranges(self, path: str) -> Iterator[Tuple[int, int]]:
+        """Consecutive ranges of the current ``chunk_bytes``, which may shrink between ranges"""
+        size = os.path.getsize(path)
+        start = 0
+        while start < size:
+            end = min(start + self.chunk_bytes, size)
+            yield start, end
+            start = end
+
+    def _collect(self, parsed: Tuple[List[Observation], Dict[str, int]]) -> List[Observation]:
+        observations, rejected = parsed
+        for reason, count in rejected.items():
+            self.rejected[reason] = self.rejected.get(reason, 0) + count
+        return observations
+
+    def _iter_chunks(self, path: str) -> Iterator[List[Observation]]:
+        ranges = self._byte_ranges(path)
+        if self.workers == 1:
+            for start, end in ranges:
+                yield self._collect(parse_byte_range(path, start, end))
+                self._over_budget()
+            return
+
+        # Keep at most two ranges per worker in flight to bound memory
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            pending = []
+            for start, end in ranges:
+                pending.append(pool.submit(parse_byte_range, path, start, end))
+                while len(pending) >= self.window:
+                    yield self._collect(pending.pop(0).result())
+                    self._over_budget()
+            for future in pending:
+                yield self._collect(future.result())
+
+    def _build_reports(self, observations: List[Observation], source_file: str) -> Dict[str, List[LabReport]]:
+        """Group one chunk of observations into LabReports per patient and date"""
+        grouped: Dict[Tuple[str, str], Dict[BiomarkerType, BiomarkerValue]] = defaultdict(dict)
+        codes: Dict[Tuple[str, str], List[str]] = defaultdict(list)
+
+        for patient_id, day, biomarker_name, value, ref_min, ref_max, loinc_code in observations:
+            biomarker_type = BiomarkerType(biomarker_name)
+            default_range = self.extractor.reference_ranges[biomarker_type]
+            ref_range = {
+                "min": ref_min if ref_min is not None else default_range["min"],
+                "max": ref_max if ref_max is not None else default_range["max"],
+            }
+            try:
+                biomarker_value = BiomarkerValue(
+                    value=value,
+                    unit=default_range["unit"],
+                    reference_range=ref_range,
+                    status=self.extractor._get_status(biomarker_type, value, ref_range),
+                    confidence=1.0
+                )
+            except ValueError:
+                # Pydantic validation errors are ValueErrors; one bad value skips one observation
+                _record(self.rejected, f"invalid {biomarker_name} value")
+                continue
+            grouped[(patient_id, day)][biomarker_type] = biomarker_value
+            codes[(patient_id, day)].append(loinc_code)
+
+        reports: Dict[str, List[LabReport]] = defaultdict(list)
+        for (patient_id, day), biomarkers in grouped.items():
+            reports[patient_id].append(LabReport(
+                report_date=datetime.fromisoformat(day),
+                source_file=source_file,
+                biomarkers=biomarkers,
+                extraction_metadata={"source": "fhir", "loinc_codes": codes[(patient_id, day)]}
+            ))
+        return reports
+
+    def iter_batches(self, path: str) -> Iterator[Dict[str, List[LabReport]]]:
+        """Yield {patient_id: [LabReport, ...]} for each parsed chunk of the file
+
+        Observations are grouped within a chunk; a patient/date whose lines
+        straddle two chunks yields a report in each batch, which
+        ``import_to_store`` merges.
+        """
+        source_file = os.path.basename(path)
+        for observations in self._iter_chunks(path):
+            if observations:
+                yield self._build_reports(observations, source_file)
+
+    def import_to_store(self, path: str, store) -> Dict[str, int]:
+        """Import a whole NDJSON file into a ReportStore, one transaction per chunk
+
+        Reports for a patient and date already stored from this file (an
+        earlier chunk, or an earlier import) are merged rather than duplicated.
+        """
+        totals = {"reports": 0, "patients": 0, "rejected": 0}
+        patients = set()
+        self.rejected = {}
+        for batch in self.iter_batches(path):
+            store.add_report_batch(batch, merge=True)
+            patients.update(batch)
+        totals["patients"] = len(patients)
+        totals["reports"] = sum(
+            store.conn.execute(
+                "SELECT COUNT(*) FROM reports WHERE patient_id = ? AND source_file = ?",
+                (patient_id, os.path.basename(path))
+            ).fetchone()[0]
+            for patient_id in patients
+        )
+        totals["rejected"] = sum(self.rejected.values())
+        for reason, count in sorted(self.rejected.items(), key=lambda item: -item[1]):
+            logger.warning(f"⚠️  Skipped {count} observation(s): {reason}")
+        logger.info(f"✅ Imported {totals['reports']} reports for {totals['patients']} patients from {path}")
+        return totals
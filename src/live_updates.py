@@ -0,0 +1,269 @@
+"""
+Live Dashboard Updates
+======================
+
+Turns successive dashboard computations into per-patient change events and
+fans them out to Server-Sent Events subscribers.
+
+``diff_dashboards`` compares two exported ``DashboardData`` documents and
+emits only what changed: added or removed reports, changed trends, raised or
+cleared alerts, and summary or profile changes. ``LiveUpdateHub`` keeps the
+last document per patient, encodes each event as an SSE frame exactly once,
+and hands the same bytes to every subscriber of that patient, so hundreds of
+open dashboards cost one diff and one encode per change. A short replay
+buffer lets reconnecting clients catch up from ``Last-Event-ID``. Event ids
+are ``<epoch>-<sequence>`` with an epoch fixed when the hub starts, so an id
+from before a server restart (or one the hub never issued) is recognised as
+unknown and answered with a ``resync`` instead of silently replaying nothing.
+"""
+
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+from pathlib import Path
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+ALL_PATIENTS = "*"
+HEARTBEAT = b": keep-alive\n\n"
+# Sent when a client fell too far behind to be patched; it refetches the dashboard
+RESYNC = b"event: resync\ndata: {}\n\n"
+
+
+def _report_key(report: Dict[str, Any]) -> Tuple[str, str]:
+    return str(report.get("report_date")), str(report.get("source_file"))
+
+
+def _alert_key(alert: Dict[str, Any]) -> str:
+    return json.dumps(alert, sort_keys=True, default=str)
+
+
+def _report_payload(report: Dict[str, Any]) -> Dict[str, Any]:
+    # Extraction metadata can carry the raw source document; clients never use it
+    return {k: v for k, v in report.items() if k != "extraction_metadata"}
+
+
+def diff_dashboards(old: Optional[Dict[str, Any]], new: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Change events that turn dashboard document ``old`` into ``new``"""
+    old = old or {}
+    events: List[Dict[str, Any]] = []
+
+    old_profile = old.get("patient_profile") or {}
+    new_profile = new.get("patient_profile") or {}
+    details = ("name", "age", "gender")
+    if any(old_profile.get(k) != new_profile.get(k) for k in details):
+        events.append({"type": "profile_changed", "data": {k: new_profile.get(k) for k in details}})
+
+    old_reports = {_report_key(r): r for r in old_profile.get("reports", [])}
+    new_reports = {_report_key(r): r for r in new_profile.get("reports", [])}
+    for key, report in old_reports.items():
+        if key not in new_reports:
+            events.append({"type": "report_removed",
+                           "data": {"report_date": key[0], "source_file": key[1]}})
+    for key, report in new_reports.items():
+        if key not in old_reports or old_reports[key].get("biomarkers") != report.get("biomarkers"):
+            events.append({"type": "report_added", "data": {"report": _report_payload(report)}})
+
+    old_trends = old.get("trends") or {}
+    new_trends = new.get("trends") or {}
+    for biomarker in old_trends:
+        if biomarker not in new_trends:
+            events.append({"type": "trend_removed", "data": {"biomarker": biomarker}})
+    for biomarker, trend in new_trends.items():
+        if old_trends.get(biomarker) != trend:
+            events.append({"type": "trend_changed", "data": {"biomarker": biomarker, "trend": trend}})
+
+    old_alerts = {_alert_key(a): a for a in old.get("alerts") or []}
+    new_alerts = {_alert_key(a): a for a in new.get("alerts") or []}
+    for key, alert in old_alerts.items():
+        if key not in new_alerts:
+            events.append({"type": "alert_cleared", "data": {"alert": alert}})
+    for key, alert in new_alerts.items():
+        if key not in old_alerts:
+            events.append({"type": "alert_added", "data": {"alert": alert}})
+
+    if old.get("summary_stats") != new.get("summary_stats"):
+        events.append({"type": "summary_changed", "data": {"summary_stats": new.get("summary_stats")}})
+
+    return events
+
+
+class Subscriber:
+    """One open event stream; receives pre-encoded SSE frames"""
+
+    def __init__(self, patient_id: str, max_queue: int):
+        self.patient_id = patient_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+
+    def offer(self, frame: bytes) -> None:
+        try:
+            self.queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            # Too slow to keep up: drop the backlog and make the client refetch
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC)
+
+
+class LiveUpdateHub:
+    """Per-patient dashboard state and SSE fan-out for one server process"""
+
+    def __init__(self, replay_size: int = 1000, max_queue: int = 256,
+                 heartbeat_seconds: float = 15.0):
+        self.max_queue = max_queue
+        self.heartbeat_seconds = heartbeat_seconds
+        self.dashboards: Dict[str, Dict[str, Any]] = {}
+        self._subscribers: Dict[str, Set[Subscriber]] = {}
+        self._replay: Deque[Tuple[int, str, bytes]] = deque(maxlen=replay_size)
+        # Prefix of every event id; changes with each server start
+        self.epoch = str(int(time.time() * 1000))
+        self._next_id = 1
+        # path -> (size, mtime_ns) of watched dashboard files
+        self._file_signatures: Dict[str, Tuple[int, int]] = {}
+
+    # ------------------------------------------------------------------
+    # Publishing
+    # ------------------------------------------------------------------
+
+    def update(self, dashboard: Dict[str, Any], broadcast: bool = True) -> List[Dict[str, Any]]:
+        """Store a freshly computed dashboard document and broadcast its diff
+
+        A patient seen for the first time yields a single ``patient_added``
+        event; clients fetch the full document for it.
+        """
+        patient_id = dashboard["patient_profile"]["patient_id"]
+        previous = self.dashboards.get(patient_id)
+        self.dashboards[patient_id] = dashboard
+        if not broadcast:
+            return []
+        if previous is None:
+            events = [{"type": "patient_added", "data": {"name": dashboard["patient_profile"].get("name")}}]
+        else:
+            events = diff_dashboards(previous, dashboard)
+        for event in events:
+            self._broadcast(patient_id, event)
+        if events:
+            logger.info(f"📡 {patient_id}: {len(events)} change event(s) to "
+                        f"{self.subscriber_count(patient_id)} subscriber(s)")
+        return events
+
+    def _broadcast(self, patient_id: str, event: Dict[str, Any]) -> None:
+        event_id = self._next_id
+        self._next_id += 1
+        payload = json.dumps({"patient_id": patient_id, **event["data"]}, default=str)
+        frame = f"id: {self.epoch}-{event_id}\nevent: {event['type']}\ndata: {payload}\n\n".encode("utf-8")
+        self._replay.append((event_id, patient_id, frame))
+        for key in (patient_id, ALL_PATIENTS):
+            for subscriber in self._subscribers.get(key, ()):
+                subscriber.offer(frame)
+
+    # ------------------------------------------------------------------
+    # Subscribing
+    # ------------------------------------------------------------------
+
+    def subscriber_count(self, patient_id: Optional[str] = None) -> int:
+        if patient_id is None:
+            return sum(len(s) for s in self._subscribers.values())
+        return len(self._subscribers.get(patient_id, ())) + len(self._subscribers.get(ALL_PATIENTS, ()))
+
+    def _sequence(self, last_event_id: str) -> Optional[int]:
+        """Sequence number of an id this hub issued, or None if it is unknown"""
+        epoch, _, sequence = last_event_id.partition("-")
+        if epoch != self.epoch or not sequence.isdigit() or int(sequence) >= self._next_id:
+            return None
+        return int(sequence)
+
+    def subscribe(self, patient_id: str = ALL_PATIENTS, last_event_id: Optional[str] = None) -> Subscriber:
+        """Register a stream, replaying events missed since ``last_event_id``
+
+        An id from another server run (or otherwise unknown) gets a resync.
+        """
+        subscriber = Subscriber(patient_id, self.max_queue)
+        self._subscribers.setdefault(patient_id, set()).add(subscriber)
+        if last_event_id:
+            last_sequence = self._sequence(last_event_id)
+            if last_sequence is None or (self._replay and self._replay[0][0] > last_sequence + 1):
+                # Unknown id, or the gap is older than the replay buffer
+                subscriber.offer(RESYNC)
+            else:
+                for event_id, event_patient, frame in self._replay:
+                    if event_id > last_sequence and patient_id in (event_patient, ALL_PATIENTS):
+                        subscriber.offer(frame)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        subscribers = self._subscribers.get(subscriber.patient_id)
+        if subscribers:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self._subscribers[subscriber.patient_id]
+
+    async def heartbeat(self) -> None:
+        """Keep idle connections open through proxies with one shared comment frame"""
+        while True:
+            await asyncio.sleep(self.heartbeat_seconds)
+            for subscribers in self._subscribers.values():
+                for subscriber in subscribers:
+                    subscriber.offer(HEARTBEAT)
+
+    # ------------------------------------------------------------------
+    # Watching exported dashboard files
+    # ------------------------------------------------------------------
+
+    def _changed_files(self, paths: List[Path]) -> List[Path]:
+        changed = []
+        for path in paths:
+            candidates = sorted(path.glob("*.json")) if path.is_dir() else [path]
+            for candidate in candidates:
+                # Hidden files are state (e.g. the watcher's .cohort_state.json)
+                if candidate.name.startswith("."):
+                    continue
+                try:
+                    stat = candidate.stat()
+                except OSError:
+                    continue
+                signature = (stat.st_size, stat.st_mtime_ns)
+                if self._file_signatures.get(str(candidate)) != signature:
+                    self._file_signatures[str(candidate)] = signature
+                    changed.append(candidate)
+        return changed
+
+    @staticmethod
+    def _read_dashboard(path: Path) -> Tuple[bool, Optional[Dict[str, Any]]]:
+        """(file was complete, dashboard document or None for other JSON)"""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            # Caught mid-write; the next scan sees the finished file
+            return False, None
+        if not isinstance(data, dict) or "patient_profile" not in data:
+            return True, None
+        return True, data
+
+    async def load_files(self, paths: List[Path], broadcast: bool = True) -> int:
+        """Scan dashboard files once and broadcast diffs for any that changed"""
+        loaded = 0
+        for path in self._changed_files(paths):
+            complete, dashboard = await asyncio.to_thread(self._read_dashboard, path)
+            if not complete:
+                self._file_signatures.pop(str(path), None)
+                continue
+            if dashboard is None:
+                # Other JSON (e.g. cohort_stats.json); skipped until it changes
+                continue
+            self.update(dashboard, broadcast=broadcast)
+            loaded += 1
+        return loaded
+
+    async def load_files_from(self, paths: List[str], broadcast: bool = True) -> int:
+        return await self.load_files([Path(p) for p in paths], broadcast=broadcast)
+
+    async def watch_files(self, paths: List[str], interval: float = 1.0) -> None:
+        """Poll exported dashboard files (e.g. the watcher's output directory)"""
+        while True:
+            await self.load_files_from(paths)
+            await asyncio.sleep(interval)
@@ -0,0 +1,530 @@
+"""
+Dashboard API Load Testing
+==========================
+
+Offline load generator for the dashboard API. ``generate_cohort`` fills a
+report store with a deterministic synthetic cohort, ``LocalServer`` starts
+``main.py serve`` on that store on a free local port, and ``run_load``
+drives it with concurrent virtual users over plain asyncio HTTP/1.1
+keep-alive connections (no client library needed).
+
+Each user repeatedly picks an operation from a weighted mix:
+
+    dashboard   GET  /api/patients/{id}/dashboard
+    range       GET  /api/patients/{id}/biomarkers/{name}?since=...
+    cohort      GET  /api/biomarkers/{name}?min_value=...&since=...
+    upload      POST /api/patients/{id}/reports
+
+Patients are drawn with a skew towards a small set of "hot" patients, as
+on a real ward. The report holds throughput, latency percentiles and error
+rates per operation and per time interval; ``check_regression`` turns it
+into a release gate against an absolute p99 limit or a saved baseline.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import quote, urlencode
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MIX = {"dashboard": 70, "range": 15, "cohort": 5, "upload": 10}
+
+# Fraction of requests aimed at the hot patients, and the size of that set
+HOT_FRACTION = 0.8
+HOT_PATIENTS = 0.05
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+# ----------------------------------------------------------------------
+# Synthetic cohort
+# ----------------------------------------------------------------------
+
+def _synthetic_value(rng: random.Random, ref_min: float, ref_max: float, drift: float) -> float:
+    """A reading around the reference range; roughly one in five falls outside it"""
+    span = (ref_max - ref_min) or ref_max or 1.0
+    centre = (ref_min + ref_max) / 2 if ref_min else ref_max * 0.6
+    value = rng.gauss(centre + drift * span, span / 3.5)
+    return round(max(value, 0.01), 2)
+
+
+def synthetic_report(rng: random.Random, extractor, report_date: datetime,
+                     drift: float = 0.0, source_file: str = "synthetic") -> Dict[str, Any]:
+    """One lab report in the legacy upload format"""
+    biomarkers = {}
+    for biomarker_type, ref_range in extractor.reference_ranges.items():
+        # Not every panel measures everything
+        if rng.random() < 0.85:
+            biomarkers[biomarker_type.value] = _synthetic_value(rng, ref_range["min"], ref_range["max"], drift)
+    return {
+        "report_date": report_date.isoformat(),
+        "source_file": source_file,
+        "biomarkers": biomarkers,
+    }
+
+
+def generate_cohort(db_path: str, patients: int = 200, reports_per_patient: int = 12,
+                    seed: int = 7) -> List[str]:
+    """Write a deterministic synthetic cohort to a report store and return its patient ids"""
+    from .extractor import BiomarkerExtractor
+    from .store import ReportStore
+
+    rng = random.Random(seed)
+    extractor = BiomarkerExtractor()
+    end = datetime(2025, 1, 1)
+    patient_ids = []
+
+    with ReportStore(db_path) as store:
+        for index in range(patients):
+            name = f"Synthetic Patient {index:05d}"
+            drift = rng.uniform(-0.3, 0.3)
+            reports = [
+                synthetic_report(
+                    rng, extractor,
+                    end - timedelta(days=30 * (reports_per_patient - n) + rng.randint(0, 20)),
+                    drift=drift * n / reports_per_patient,
+                    source_file=f"synthetic_{index:05d}_{n:03d}.pdf"
+                )
+                for n in range(reports_per_patient)
+            ]
+            profile = extractor.convert_legacy_to_patient_profile({
+                "patient": name,
+                "age": rng.randint(18, 90),
+                "gender": rng.choice(["Male", "Female"]),
+                "reports": reports,
+            })
+            store.save_patient_profile(profile)
+            patient_ids.append(profile.patient_id)
+
+    logger.info(f"🧪 Synthetic cohort: {patients} patients x {reports_per_patient} reports in {db_path}")
+    return patient_ids
+
+
+# ----------------------------------------------------------------------
+# Local server
+# ----------------------------------------------------------------------
+
+def free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class LocalServer:
+    """``main.py serve`` on a report store, in a child process on a free port"""
+
+    def __init__(self, db_path: str, watch_dir: str, port: Optional[int] = None,
+                 startup_timeout: float = 30.0):
+        self.db_path = db_path
+        self.watch_dir = watch_dir
+        self.port = port or free_port()
+        self.startup_timeout = startup_timeout
+        self.process: Optional[subprocess.Popen] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self) -> None:
+        main_py = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "main.py")
+        self.process = subprocess.Popen(
+            [sys.executable, main_py, "serve", "--port", str(self.port),
+             "--db", self.db_path, "--watch", self.watch_dir],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        deadline = time.monotonic() + self.startup_timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"Server exited during startup (code {self.process.returncode})")
+            try:
+                status, _ = asyncio.run(_get_once("127.0.0.1", self.port, "/api/patients"))
+                if status == 200:
+                    logger.info(f"🚦 Server ready on {self.base_url}")
+                    return
+            except OSError:
+                pass
+            time.sleep(0.1)
+        self.stop()
+        raise RuntimeError(f"Server did not start within {self.startup_timeout:.0f}s")
+
+    def stop(self) -> None:
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        self.process = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+# ----------------------------------------------------------------------
+# Minimal HTTP/1.1 client
+# ----------------------------------------------------------------------
+
+class HttpConnection:
+    """One keep-alive HTTP/1.1 connection; reconnects after errors"""
+
+    def __init__(self, host: str, port: int, timeout: float = 30.0):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+
+    async def request(self, method: str, path: str, body: Optional[bytes] = None) -> Tuple[int, bytes]:
+        try:
+            return await asyncio.wait_for(self._request(method, path, body), self.timeout)
+        except BaseException:
+            await self.close()
+            raise
+
+    async def _request(self, method: str, path: str, body: Optional[bytes]) -> Tuple[int, bytes]:
+        if self._writer is None:
+            self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        head = f"{method} {path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\n"
+        if body is not None:
+            head += f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+        self._writer.write(head.encode("ascii") + b"\r\n" + (body or b""))
+        await self._writer.drain()
+
+        status_line = await self._reader.readline()
+        if not status_line:
+            raise ConnectionError("Connection closed by server")
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await self._reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await self._reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    await self._reader.readline()
+                    break
+                chunks.append(await self._reader.readexactly(size))
+                await self._reader.readline()
+            payload = b"".join(chunks)
+        else:
+            payload = await self._reader.readexactly(int(headers.get("content-length", 0)))
+
+        if headers.get("connection", "").lower() == "close":
+            await self.close()
+        return status, payload
+
+    async def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except OSError:
+                pass
+        self._reader = self._writer = None
+
+
+async def _get_once(host: str, port: int, path: str) -> Tuple[int, bytes]:
+    connection = HttpConnection(host, port, timeout=5.0)
+    try:
+        return await connection.request("GET", path)
+    finally:
+        await connection.close()
+
+
+# ----------------------------------------------------------------------
+# Measurement
+# ----------------------------------------------------------------------
+
+def percentile(sorted_values: List[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, int(-(-pct * len(sorted_values) // 100)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(latencies_ms: List[float], errors: int, seconds: float) -> Dict[str, Any]:
+    """Throughput, error rate and latency percentiles of one set of requests"""
+    ordered = sorted(latencies_ms)
+    requests = len(ordered) + errors
+    summary = {
+        "requests": requests,
+        "errors": errors,
+        "error_rate": round(errors / requests, 4) if requests else 0.0,
+        "throughput_rps": round(requests / seconds, 1) if seconds else 0.0,
+        "mean_ms": round(sum(ordered) / len(ordered), 2) if ordered else None,
+        "max_ms": round(ordered[-1], 2) if ordered else None,
+    }
+    for pct in PERCENTILES:
+        value = percentile(ordered, pct)
+        summary[f"p{pct}_ms"] = round(value, 2) if value is not None else None
+    return summary
+
+
+@dataclass
+class Sample:
+    """One finished request"""
+    operation: str
+    started: float
+    latency_ms: float
+    ok: bool
+
+
+@dataclass
+class LoadResults:
+    """All samples of a run, with the time the measured window began"""
+    started: float
+    samples: List[Sample] = field(default_factory=list)
+    error_messages: Dict[str, int] = field(default_factory=dict)
+
+    def record(self, operation: str, started: float, ok: bool, error: Optional[str] = None) -> None:
+        self.samples.append(Sample(operation, started, (time.perf_counter() - started) * 1000, ok))
+        if error:
+            self.error_messages[error] = self.error_messages.get(error, 0) + 1
+
+    def report(self, duration: float, interval: float) -> Dict[str, Any]:
+        def split(samples: List[Sample]) -> Tuple[List[float], int]:
+            return [s.latency_ms for s in samples if s.ok], sum(1 for s in samples if not s.ok)
+
+        by_operation: Dict[str, List[Sample]] = {}
+        for sample in self.samples:
+            by_operation.setdefault(sample.operation, []).append(sample)
+
+        buckets: Dict[int, List[Sample]] = {}
+        for sample in self.samples:
+            buckets.setdefault(int((sample.started - self.started) // interval), []).append(sample)
+
+        return {
+            "overall": summarize(*split(self.samples), duration),
+            "operations": {
+                operation: summarize(*split(samples), duration)
+                for operation, samples in sorted(by_operation.items())
+            },
+            "intervals": [
+                {"t": round(index * interval, 1), **summarize(*split(buckets[index]), interval)}
+                for index in sorted(buckets)
+            ],
+            "error_messages": dict(sorted(self.error_messages.items(), key=lambda item: -item[1])[:10]),
+        }
+
+
+# ----------------------------------------------------------------------
+# Load generation
+# ----------------------------------------------------------------------
+
+def parse_mix(spec: Optional[str]) -> Dict[str, float]:
+    """Parse ``dashboard=70,range=20,upload=10`` into operation weights"""
+    if not spec:
+        return dict(DEFAULT_MIX)
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in DEFAULT_MIX:
+            raise ValueError(f"Unknown operation '{name}' (expected one of {', '.join(DEFAULT_MIX)})")
+        mix[name] = float(weight)
+    if sum(mix.values()) <= 0:
+        raise ValueError("Operation mix has no positive weights")
+    return mix
+
+
+class VirtualUser:
+    """One simulated client issuing requests back to back on its own connection"""
+
+    def __init__(self, index: int, host: str, port: int, patient_ids: List[str],
+                 mix: Dict[str, float], seed: int, extractor, think_ms: float = 0.0):
+        self.rng = random.Random(seed * 1_000_003 + index)
+        self.connection = HttpConnection(host, port)
+        self.patient_ids = patient_ids
+        self.hot = patient_ids[:max(1, int(len(patient_ids) * HOT_PATIENTS))]
+        self.operations = list(mix)
+        self.weights = [mix[name] for name in self.operations]
+        self.extractor = extractor
+        self.think_ms = think_ms
+        self._upload_day = 0
+
+    def _patient(self) -> str:
+        pool = self.hot if self.rng.random() < HOT_FRACTION else self.patient_ids
+        return quote(self.rng.choice(pool), safe="")
+
+    def _biomarker(self):
+        return self.rng.choice(list(self.extractor.reference_ranges))
+
+    def _request(self, operation: str) -> Tuple[str, str, Optional[bytes]]:
+        if operation == "dashboard":
+            return "GET", f"/api/patients/{self._patient()}/dashboard", None
+        if operation == "range":
+            since = datetime(2025, 1, 1) - timedelta(days=self.rng.choice((90, 180, 365)))
+            query = urlencode({"since": since.date().isoformat()})
+            biomarker = quote(self._biomarker().value, safe="")
+            return "GET", f"/api/patients/{self._patient()}/biomarkers/{biomarker}?{query}", None
+        if operation == "cohort":
+            biomarker = self._biomarker()
+            ref_range = self.extractor.reference_ranges[biomarker]
+            query = urlencode({"min_value": ref_range["max"], "since": "2024-10-01", "limit": 100})
+            return "GET", f"/api/biomarkers/{quote(biomarker.value, safe='')}?{query}", None
+        # Uploads land after the synthetic history, one day apart per user
+        self._upload_day += 1
+        report = synthetic_report(
+            self.rng, self.extractor, datetime(2025, 1, 1) + timedelta(days=self._upload_day),
+            source_file=f"loadtest_upload_{self._upload_day}.pdf"
+        )
+        return "POST", f"/api/patients/{self._patient()}/reports", json.dumps(report).encode("utf-8")
+
+    async def run(self, results: LoadResults, stop_at: float, measure_from: float) -> None:
+        try:
+            while time.perf_counter() < stop_at:
+                operation = self.rng.choices(self.operations, self.weights)[0]
+                method, path, body = self._request(operation)
+                started = time.perf_counter()
+                try:
+                    status, _ = await self.connection.request(method, path, body)
+                    ok = 200 <= status < 300
+                    error = None if ok else f"{operation}: HTTP {status}"
+                except (OSError, asyncio.TimeoutError, ConnectionError, ValueError) as e:
+                    ok, error = False, f"{operation}: {type(e).__name__}"
+                if started >= measure_from:
+                    results.record(operation, started, ok, error)
+                if self.think_ms:
+                    await asyncio.sleep(self.rng.expovariate(1000.0 / self.think_ms))
+        finally:
+            await self.connection.close()
+
+
+async def run_load(base_url: str, patient_ids: List[str], users: int = 20, duration: float = 30.0,
+                   warmup: float = 3.0, mix: Optional[Dict[str, float]] = None, seed: int = 7,
+                   interval: float = 5.0, think_ms: float = 0.0) -> Dict[str, Any]:
+    """Run ``users`` concurrent virtual users for ``warmup + duration`` seconds
+
+    Requests started during the warm-up are not measured.
+    """
+    host_port = base_url.split("://", 1)[-1].rstrip("/")
+    host, _, port = host_port.partition(":")
+    mix = mix or dict(DEFAULT_MIX)
+    from .extractor import BiomarkerExtractor
+    extractor = BiomarkerExtractor()
+
+    virtual_users = [
+        VirtualUser(index, host, int(port or 80), patient_ids, mix, seed, extractor, think_ms)
+        for index in range(users)
+    ]
+    now = time.perf_counter()
+    measure_from = now + warmup
+    results = LoadResults(started=measure_from)
+    logger.info(f"🚦 {users} users for {duration:.0f}s (+{warmup:.0f}s warm-up) against {base_url}")
+    await asyncio.gather(*(user.run(results, measure_from + duration, measure_from) for user in virtual_users))
+
+    report = results.report(duration, interval)
+    report["config"] = {
+        "users": users, "duration_s": duration, "warmup_s": warmup, "mix": mix,
+        "seed": seed, "think_ms": think_ms, "patients": len(patient_ids),
+    }
+    return report
+
+
+def run_local(workdir: str, patients: int = 200, reports_per_patient: int = 12,
+              **load_options) -> Dict[str, Any]:
+    """Generate a synthetic cohort in ``workdir``, serve it locally and load test it"""
+    os.makedirs(workdir, exist_ok=True)
+    db_path = os.path.join(workdir, "loadtest.db")
+    watch_dir = os.path.join(workdir, "dashboards")
+    os.makedirs(watch_dir, exist_ok=True)
+    # Start from a fresh cohort so uploads from earlier runs do not skew results
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+    patient_ids = generate_cohort(db_path, patients, reports_per_patient, seed=load_options.get("seed", 7))
+
+    with LocalServer(db_path, watch_dir) as server:
+        report = asyncio.run(run_load(server.base_url, patient_ids, **load_options))
+    report["config"]["reports_per_patient"] = reports_per_patient
+    return report
+
+
+# ----------------------------------------------------------------------
+# Reporting and gating
+# ----------------------------------------------------------------------
+
+def format_report(report: Dict[str, Any]) -> str:
+    """Human readable tables of a load test report"""
+    lines = [f"{'operation':<12}{'requests':>10}{'rps':>9}{'err %':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"]
+
+    def row(name: str, s: Dict[str, Any]) -> str:
+        def ms(value):
+            return f"{value:>9.1f}" if value is not None else f"{'-':>9}"
+        return (f"{name:<12}{s['requests']:>10}{s['throughput_rps']:>9.1f}{s['error_rate'] * 100:>8.2f}"
+                f"{ms(s['p50_ms'])}{ms(s['p95_ms'])}{ms(s['p99_ms'])}")
+
+    for operation, summary in report["operations"].items():
+        lines.append(row(operation, summary))
+    lines.append(row("all", report["overall"]))
+    lines.append("")
+    lines.append("over time:")
+    for bucket in report["intervals"]:
+        lines.append(row(f"  t={bucket['t']:g}s", bucket))
+    for message, count in report["error_messages"].items():
+        lines.append(f"  ✗ {count} x {message}")
+    return "\n".join(lines)
+
+
+def check_regression(report: Dict[str, Any], max_p99_ms: Optional[float] = None,
+                     max_error_rate: Optional[float] = None,
+                     baseline: Optional[Dict[str, Any]] = None,
+                     tolerance: float = 0.10) -> List[str]:
+    """Return a list of gate violations (empty when the run passes)
+
+    With a ``baseline`` report, every operation's p99 may exceed the
+    baseline's by at most ``tolerance`` (a fraction).
+    """
+    problems = []
+    overall = report["overall"]
+    if overall["requests"] == 0:
+        return ["no requests completed"]
+
+    if max_p99_ms is not None and (overall["p99_ms"] or 0) > max_p99_ms:
+        problems.append(f"overall p99 {overall['p99_ms']:.1f} ms exceeds {max_p99_ms:.1f} ms")
+    if max_error_rate is not None and overall["error_rate"] > max_error_rate:
+        problems.append(f"error rate {overall['error_rate']:.2%} exceeds {max_error_rate:.2%}")
+
+    if baseline:
+        compared = [("overall", overall, baseline.get("overall", {}))]
+        compared += [
+            (operation, summary, baseline.get("operations", {}).get(operation, {}))
+            for operation, summary in report["operations"].items()
+        ]
+        for name, current, previous in compared:
+            if current.get("p99_ms") is None or not previous.get("p99_ms"):
+                continue
+            limit = previous["p99_ms"] * (1 + tolerance)
+            if current["p99_ms"] > limit:
+                problems.append(f"{name} p99 {current['p99_ms']:.1f} ms regressed from "
+                                f"{previous['p99_ms']:.1f} ms (limit {limit:.1f} ms)")
+    return problems
+
+
+def save_report(report: Dict[str, Any], path: str) -> None:
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"💾 Load test report written to: {path}")
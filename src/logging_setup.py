@@ -0,0 +1,154 @@
+"""
+Logging Setup
+=============
+
+Non-blocking logging for batch and daemon runs. Records are put on an
+in-memory queue by a ``QueueHandler`` and written to the log file and stderr
+by a background ``QueueListener`` thread, so extraction loops never wait on
+disk or terminal I/O. Identical repeated records are rate-limited.
+
+Worker processes do not inherit the listener thread. They log to a
+``multiprocessing`` queue from ``worker_log_queue()`` instead, which a second
+listener in the parent drains into the same handlers; the pool initializer
+installs it with ``configure_worker_logging()``.
+"""
+
+import atexit
+import logging
+import logging.handlers
+import multiprocessing
+import queue
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_handlers: List[logging.Handler] = []
+_worker_queue: Any = None
+_worker_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class RateLimitFilter(logging.Filter):
+    """Drop repeats of an identical record within ``interval`` seconds
+
+    Records are identical when logger, level, message template and arguments
+    match. The next record let through after suppression is annotated with
+    the number of repeats that were dropped.
+    """
+
+    def __init__(self, interval: float = 10.0, min_level: int = logging.WARNING):
+        super().__init__()
+        self.interval = interval
+        self.min_level = min_level
+        self._seen: Dict[Tuple, Tuple[float, int]] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < self.min_level:
+            return True
+
+        try:
+            key = (record.name, record.levelno, record.msg, record.args)
+            hash(key)
+        except TypeError:
+            key = (record.name, record.levelno, record.msg, repr(record.args))
+
+        now = time.monotonic()
+        with self._lock:
+            last_emitted, suppressed = self._seen.get(key, (0.0, 0))
+            if now - last_emitted < self.interval:
+                self._seen[key] = (last_emitted, suppressed + 1)
+                return False
+            self._seen[key] = (now, 0)
+            if len(self._seen) > 10000:
+                self._seen.clear()
+
+        if suppressed:
+            record.msg = f"{record.msg} (repeated {suppressed} more times)"
+        return True
+
+
+def configure_logging(log_file: Optional[str] = 'app.log',
+                      level: int = logging.INFO,
+                      rate_limit_seconds: float = 10.0) -> None:
+    """Route root logging through a background writer thread"""
+    global _listener, _handlers
+    if _listener is not None:
+        return
+
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers = [logging.StreamHandler()]
+    if log_file:
+        handlers.insert(0, logging.FileHandler(log_file))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue: queue.Queue = queue.Queue(-1)
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(RateLimitFilter(interval=rate_limit_seconds))
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(queue_handler)
+
+    _handlers = handlers
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def worker_log_queue(context: Any = None) -> Any:
+    """Queue for worker process records, drained by the parent's writer
+
+    Returns None when logging was not configured in this process; workers
+    then keep the default handlers.
+    """
+    global _worker_queue, _worker_listener
+    if _listener is None:
+        return None
+    if _worker_queue is None:
+        _worker_queue = (context or multiprocessing).Queue(-1)
+        _worker_listener = logging.handlers.QueueListener(_worker_queue, *_handlers,
+                                                          respect_handler_level=True)
+        _worker_listener.start()
+    return _worker_queue
+
+
+def configure_worker_logging(log_queue: Any, level: int = logging.INFO,
+                             rate_limit_seconds: float = 10.0) -> None:
+    """Send a worker process's records to the parent through ``log_queue``
+
+    Replaces the handler inherited on fork, whose in-memory queue nobody
+    reads in the child.
+    """
+    global _listener, _worker_queue, _worker_listener
+    # The parent's listener threads do not exist in this process
+    _listener = _worker_listener = None
+    _worker_queue = None
+    if log_queue is None:
+        return
+
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(RateLimitFilter(interval=rate_limit_seconds))
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(queue_handler)
+
+
+def shutdown_logging() -> None:
+    """Flush queued records and stop the background writers"""
+    global _listener, _worker_queue, _worker_listener
+    if _worker_listener is not None:
+        _worker_listener.stop()
+        _worker_listener = None
+        _worker_queue = None
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,296 @@
+"""
+Memory Profiling
+================
+
+Per-stage memory accounting for the processing pipeline. A
+``MemoryProfiler`` wraps each pipeline stage (extract, convert, trend,
+stats, alerts, export) and records the peak RSS during the stage, the
+``tracemalloc`` peak and net allocation, and the top allocating source
+lines of that stage. The RSS peak comes from a background thread sampling
+RSS every ``sample_interval`` seconds while a stage runs, raised to the
+process's ``ru_maxrss`` when that grew during the stage (so a spike between
+two samples that set a new process high is still counted). Top allocators come from
+``tracemalloc`` snapshots, which are expensive once large libraries are
+loaded, so they are only taken on the first ``snapshot_calls`` calls of
+each stage. A disabled profiler costs one attribute check per stage.
+
+Where neither ``/proc`` nor the POSIX-only ``resource`` module is available,
+RSS figures are reported as 0 and only the ``tracemalloc`` figures are
+meaningful.
+
+All figures are for the profiled process. When stages run in worker
+processes (``batch --workers`` > 1, parallel FHIR parsing) the callers add a
+note to the report and, where the pool reports them, per-worker peaks.
+
+``MemoryBudget`` is the companion used by the batch paths: it compares the
+current RSS against a configured limit so callers can flush buffers or
+shrink their batch size before the process outgrows its container.
+``release_memory`` returns what can be given back without losing work
+(garbage, MuPDF's object store, free heap pages) and reports how much RSS
+that actually freed.
+"""
+
+import ctypes
+import ctypes.util
+import gc
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+STAGES = ("extract", "convert", "trend", "stats", "alerts", "export")
+
+_MB = 1024 * 1024
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def current_rss_mb() -> float:
+    """Resident set size of this process right now, in MB"""
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE / _MB
+    except (OSError, IndexError, ValueError):
+        return peak_rss_mb()
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process so far, in MB (0 if unknown)"""
+    if resource is None:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    return peak / _MB if sys.platform == "darwin" else peak / 1024
+
+
+class _RssSampler(threading.Thread):
+    """Daemon thread tracking the highest RSS seen since the last ``reset``"""
+
+    def __init__(self, interval: float):
+        super().__init__(name="rss-sampler", daemon=True)
+        self.interval = interval
+        self.peak_mb = 0.0
+        self._done = threading.Event()
+
+    def reset(self) -> None:
+        self.peak_mb = current_rss_mb()
+
+    def run(self) -> None:
+        while not self._done.wait(self.interval):
+            rss = current_rss_mb()
+            if rss > self.peak_mb:
+                self.peak_mb = rss
+
+    def stop(self) -> None:
+        self._done.set()
+
+
+def release_memory() -> float:
+    """Collect garbage, empty MuPDF's store and trim the C heap; returns the MB of RSS freed
+
+    MuPDF is only touched if a PDF backend already imported it. Trimming
+    uses glibc's ``malloc_trim`` and is skipped on other C libraries.
+    """
+    before = current_rss_mb()
+    gc.collect()
+    fitz = sys.modules.get("fitz") or sys.modules.get("pymupdf")
+    if fitz is not None:
+        try:
+            fitz.TOOLS.store_shrink(100)
+        except Exception as e:
+            logger.debug("Could not shrink the MuPDF store: %s", e)
+    libc_name = ctypes.util.find_library("c") if sys.platform.startswith("linux") else None
+    if libc_name:
+        try:
+            ctypes.CDLL(libc_name).malloc_trim(0)
+        except (OSError, AttributeError):
+            pass
+    return max(0.0, before - current_rss_mb())
+
+
+@dataclass
+class StageMemory:
+    """Memory accounting for one pipeline stage, accumulated over its calls"""
+    name: str
+    calls: int = 0
+    seconds: float = 0.0
+    traced_peak_mb: float = 0.0
+    net_allocated_mb: float = 0.0
+    rss_peak_mb: float = 0.0
+    rss_growth_mb: float = 0.0
+    allocators: Dict[str, float] = field(default_factory=dict)
+
+    def top_allocators(self, n: int) -> List[Dict[str, Any]]:
+        ranked = sorted(self.allocators.items(), key=lambda item: item[1], reverse=True)[:n]
+        return [{"location": location, "mb": round(size, 3)} for location, size in ranked]
+
+
+class MemoryProfiler:
+    """Records memory use per pipeline stage; a no-op unless ``enabled``"""
+
+    def __init__(self, enabled: bool = True, top_n: int = 5, snapshot_calls: int = 1,
+                 sample_interval: float = 0.01):
+        self.enabled = enabled
+        self.top_n = top_n
+        self.snapshot_calls = snapshot_calls
+        self.sample_interval = sample_interval
+        self.stages: Dict[str, StageMemory] = {}
+        # Work done outside this process, recorded by the callers that fan out
+        self.workers: List[Dict[str, Any]] = []
+        self.notes: List[str] = []
+        self._active: Optional[str] = None
+        self._sampler: Optional[_RssSampler] = None
+
+    def start(self) -> None:
+        if not self.enabled:
+            return
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if self._sampler is None:
+            self._sampler = _RssSampler(self.sample_interval)
+            self._sampler.start()
+
+    def stop(self) -> None:
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        if self._sampler is not None:
+            self._sampler.stop()
+            self._sampler = None
+
+    def note(self, text: str) -> None:
+        """Add a remark to the report, e.g. that a stage ran in worker processes"""
+        if self.enabled and text not in self.notes:
+            self.notes.append(text)
+
+    def record_workers(self, rows: List[Dict[str, Any]]) -> None:
+        """Keep per-worker figures (pid, tasks, rss_peak_mb) reported by a process pool"""
+        if self.enabled:
+            self.workers = [dict(row) for row in rows]
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Account the memory used inside the block to stage ``name``
+
+        Stages do not nest: a stage opened inside another is counted as
+        part of the outer one.
+        """
+        if not self.enabled or self._active is not None:
+            yield
+            return
+
+        self.start()
+        self._active = name
+        stats = self.stages.setdefault(name, StageMemory(name))
+        sample = self.top_n and stats.calls < self.snapshot_calls
+        before = tracemalloc.take_snapshot() if sample else None
+        traced_before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        rss_before = current_rss_mb()
+        maxrss_before = peak_rss_mb()
+        self._sampler.reset()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            traced_after, traced_peak = tracemalloc.get_traced_memory()
+            rss_after = current_rss_mb()
+            rss_peak = max(rss_before, rss_after, self._sampler.peak_mb)
+            maxrss_after = peak_rss_mb()
+            if maxrss_after > maxrss_before:
+                # The process high-water mark was raised inside this stage
+                rss_peak = max(rss_peak, maxrss_after)
+
+            stats.calls += 1
+            stats.seconds += elapsed
+            stats.traced_peak_mb = max(stats.traced_peak_mb, (traced_peak - traced_before) / _MB)
+            stats.net_allocated_mb += (traced_after - traced_before) / _MB
+            stats.rss_peak_mb = max(stats.rss_peak_mb, rss_peak)
+            stats.rss_growth_mb += max(0.0, rss_after - rss_before)
+
+            if before is not None:
+                after = tracemalloc.take_snapshot().filter_traces([
+                    tracemalloc.Filter(False, tracemalloc.__file__),
+                    tracemalloc.Filter(False, __file__),
+                ])
+                for diff in after.compare_to(before, "lineno")[:self.top_n * 4]:
+                    if diff.size_diff <= 0:
+                        continue
+                    frame = diff.traceback[0]
+                    location = f"{frame.filename}:{frame.lineno}"
+                    stats.allocators[location] = stats.allocators.get(location, 0.0) + diff.size_diff / _MB
+            self._active = None
+
+    def report(self) -> Dict[str, Any]:
+        """Per-stage summary in pipeline order, followed by any other stages"""
+        order = [s for s in STAGES if s in self.stages] + [s for s in self.stages if s not in STAGES]
+        return {
+            "peak_rss_mb": round(max([peak_rss_mb()] + [s.rss_peak_mb for s in self.stages.values()]), 1),
+            "notes": list(self.notes),
+            "workers": self.workers,
+            "stages": [
+                {
+                    "stage": name,
+                    "calls": self.stages[name].calls,
+                    "seconds": round(self.stages[name].seconds, 3),
+                    "traced_peak_mb": round(self.stages[name].traced_peak_mb, 3),
+                    "net_allocated_mb": round(self.stages[name].net_allocated_mb, 3),
+                    "rss_peak_mb": round(self.stages[name].rss_peak_mb, 1),
+                    "rss_growth_mb": round(self.stages[name].rss_growth_mb, 1),
+                    "top_allocators": self.stages[name].top_allocators(self.top_n),
+                }
+                for name in order
+            ],
+        }
+
+    def format_report(self) -> str:
+        """Human readable table of the per-stage report"""
+        report = self.report()
+        lines = [
+            f"{'stage':<10}{'calls':>7}{'time s':>9}{'peak MB':>10}{'net MB':>10}{'RSS MB':>10}",
+        ]
+        for stage in report["stages"]:
+            lines.append(
+                f"{stage['stage']:<10}{stage['calls']:>7}{stage['seconds']:>9.2f}"
+                f"{stage['traced_peak_mb']:>10.2f}{stage['net_allocated_mb']:>10.2f}{stage['rss_peak_mb']:>10.1f}"
+            )
+            for allocator in stage["top_allocators"]:
+                lines.append(f"    {allocator['mb']:>8.3f} MB  {allocator['location']}")
+        lines.append(f"peak RSS: {report['peak_rss_mb']:.1f} MB")
+        for worker in report["workers"]:
+            lines.append(f"worker {worker['pid']}: {worker['tasks']} tasks, peak RSS {worker['rss_peak_mb']:.1f} MB")
+        for note in report["notes"]:
+            lines.append(f"note: {note}")
+        return "\n".join(lines)
+
+    def save(self, path: str) -> None:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.report(), f, indent=2)
+        logger.info(f"💾 Memory profile written to: {path}")
+
+
+class MemoryBudget:
+    """Soft RSS limit that batch loops poll to decide when to flush or shrink"""
+
+    def __init__(self, limit_mb: float):
+        self.limit_mb = limit_mb
+        self.exceeded_count = 0
+
+    def exceeded(self) -> bool:
+        """True when the process is over the budget"""
+        if current_rss_mb() <= self.limit_mb:
+            return False
+        self.exceeded_count += 1
+        return True
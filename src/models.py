@@ -100,15 +100,31 @@ class ExtractionResponse(BaseModel):
     errors: List[str] = Field(default_factory=list, description="Any errors encountered")
 
 
+class TrendSeries(BaseModel):
+    """A (possibly downsampled) series of trend points for charting"""
+    method: str = Field("raw", description="Downsampling method: raw, lttb")
+    dates: List[datetime] = Field(default_factory=list, description="Point dates")
+    values: List[float] = Field(default_factory=list, description="Point values")
+
+    class Config:
+        json_encoders = {
+            datetime: lambda v: v.isoformat()
+        }
+
+
 class BiomarkerTrend(BaseModel):
     """Biomarker trend analysis"""
     biomarker: BiomarkerType = Field(..., description="Biomarker type")
-    values: List[float] = Field(..., description="Historical values")
+    values: List[float] = Field(..., description="Historical values (empty when only resolutions are kept)")
     dates: List[datetime] = Field(..., description="Corresponding dates")
+    points: int = Field(0, ge=0, description="Number of readings in the full history")
     trend_direction: str = Field(..., description="Trend: rising, falling, stable")
     trend_strength: float = Field(..., ge=0.0, le=1.0, description="Trend strength")
     latest_value: float = Field(..., description="Most recent value")
     change_percentage: float = Field(..., description="Percentage change from first to last")
+    resolutions: Dict[str, TrendSeries] = Field(
+        default_factory=dict, description="Downsampled series keyed by target point count"
+    )
 
     class Config:
         json_encoders = {
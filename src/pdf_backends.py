@@ -0,0 +1,360 @@
+"""
+Pluggable PDF Text Backends
+===========================
+
+Registry of PDF text extraction backends plus a selection policy that learns,
+per lab document layout (keyed by the PDF producer metadata), which backend
+is fastest while still yielding text, and falls back page by page.
+
+With ``autosave`` the stats are written back every ``SAVE_EVERY_DOCUMENTS``
+documents or ``SAVE_EVERY_SECONDS`` seconds; owners call ``save_stats()``
+once more when they finish. Saving adds the increments recorded since the
+last save to whatever the stats file holds by then, under an exclusive lock
+on a ``.lock`` file next to it, so threads and processes can share one file.
+Pre-forked workers instead hand their increments (``drain_updates``) to
+the parent, which merges and saves them.
+"""
+
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, asdict
+from typing import Dict, List, Optional, Tuple, Any, Type
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows; threads are still serialized
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Backend name -> class, populated by @register_backend
+BACKENDS: Dict[str, Type["PdfBackend"]] = {}
+
+# Order used for layouts without any history
+DEFAULT_ORDER = ["pymupdf", "pdfplumber", "pdfplumber_table"]
+
+# A backend must have produced text for at least this share of pages to be preferred
+MIN_SUCCESS_RATE = 0.8
+
+# Autosave interval
+SAVE_EVERY_DOCUMENTS = 50
+SAVE_EVERY_SECONDS = 30.0
+
+
+def register_backend(cls: Type["PdfBackend"]) -> Type["PdfBackend"]:
+    """Class decorator adding a backend to the registry"""
+    BACKENDS[cls.name] = cls
+    return cls
+
+
+class PdfBackend:
+    """Base class for PDF text backends"""
+    name = ""
+
+    def extract_pages(self, pdf_path: str, page_numbers: Optional[List[int]] = None,
+                      document: Any = None) -> Dict[int, str]:
+        """Return {page_number: text} for the requested pages (all pages when None)
+
+        ``document`` is the file already opened with PyMuPDF, if it could be;
+        backends built on PyMuPDF use it instead of opening the file again.
+        """
+        raise NotImplementedError
+
+
+@register_backend
+class PyMuPDFBackend(PdfBackend):
+    """Fast text extraction with PyMuPDF"""
+    name = "pymupdf"
+
+    def extract_pages(self, pdf_path, page_numbers=None, document=None):
+        import fitz  # PyMuPDF
+
+        if document is not None:
+            return self._pages(document, page_numbers)
+        with fitz.open(pdf_path) as doc:
+            return self._pages(doc, page_numbers)
+
+    @staticmethod
+    def _pages(doc, page_numbers):
+        return {
+            page_num: doc.load_page(page_num).get_text()
+            for page_num in (page_numbers if page_numbers is not None else range(len(doc)))
+        }
+
+
+@register_backend
+class PdfplumberBackend(PdfBackend):
+    """Layout-aware text extraction with pdfplumber (slower)"""
+    name = "pdfplumber"
+
+    def extract_pages(self, pdf_path, page_numbers=None, document=None):
+        import pdfplumber
+
+        pages = {}
+        with pdfplumber.open(pdf_path) as pdf:
+            for page_num in page_numbers if page_numbers is not None else range(len(pdf.pages)):
+                pages[page_num] = pdf.pages[page_num].extract_text() or ""
+        return pages
+
+
+@register_backend
+class PdfplumberTableBackend(PdfBackend):
+    """pdfplumber table detection, emitting one line per table row"""
+    name = "pdfplumber_table"
+
+    def extract_pages(self, pdf_path, page_numbers=None, document=None):
+        import pdfplumber
+
+        pages = {}
+        with pdfplumber.open(pdf_path) as pdf:
+            for page_num in page_numbers if page_numbers is not None else range(len(pdf.pages)):
+                lines = []
+                for table in pdf.pages[page_num].extract_tables():
+                    for row in table:
+                        lines.append(" ".join(cell.strip() for cell in row if cell))
+                pages[page_num] = "\n".join(lines)
+        return pages
+
+
+def open_document(pdf_path: str) -> Any:
+    """The file opened with PyMuPDF, or None if it cannot be"""
+    try:
+        import fitz  # PyMuPDF
+
+        return fitz.open(pdf_path)
+    except Exception:
+        return None
+
+
+def read_producer(pdf_path: str, document: Any = None) -> str:
+    """Return the PDF producer/creator metadata used as the layout key
+
+    Reads it from ``document`` (an open PyMuPDF document) when given.
+    """
+    try:
+        if document is not None:
+            metadata = document.metadata or {}
+        else:
+            import fitz  # PyMuPDF
+
+            with fitz.open(pdf_path) as doc:
+                metadata = doc.metadata or {}
+    except Exception:
+        try:
+            import pdfplumber
+
+            with pdfplumber.open(pdf_path) as pdf:
+                metadata = {k.lower(): v for k, v in (pdf.metadata or {}).items()}
+        except Exception:
+            metadata = {}
+
+    producer = (metadata.get("producer") or metadata.get("creator") or "").strip()
+    return producer or "unknown"
+
+
+@dataclass
+class BackendStats:
+    """Running timing and success counts for one backend on one layout"""
+    pages: int = 0
+    successes: int = 0
+    seconds: float = 0.0
+
+    @property
+    def success_rate(self) -> float:
+        return self.successes / self.pages if self.pages else 0.0
+
+    @property
+    def seconds_per_page(self) -> float:
+        return self.seconds / self.pages if self.pages else float("inf")
+
+
+def _add_stats(target: Dict[str, Dict[str, BackendStats]],
+               updates: Dict[str, Dict[str, BackendStats]]) -> None:
+    for layout, backends in updates.items():
+        for name, increment in backends.items():
+            stats = target.setdefault(layout, {}).setdefault(name, BackendStats())
+            stats.pages += increment.pages
+            stats.successes += increment.successes
+            stats.seconds += increment.seconds
+
+
+class BackendSelector:
+    """Chooses and runs PDF backends using per-layout historical stats"""
+
+    def __init__(self, stats_path: Optional[str] = None, backends: Optional[List[str]] = None,
+                 autosave: bool = True):
+        self.stats_path = stats_path
+        self.autosave = autosave
+        self.backend_names = backends or [name for name in DEFAULT_ORDER if name in BACKENDS]
+        self._instances = {name: BACKENDS[name]() for name in self.backend_names}
+        self._stats: Dict[str, Dict[str, BackendStats]] = {}
+        # Increments not yet written to (or handed on towards) the stats file
+        self._unsaved: Dict[str, Dict[str, BackendStats]] = {}
+        self._lock = threading.Lock()
+        # Serializes saves from this process; the file lock covers other processes
+        self._save_lock = threading.Lock()
+        self._documents_since_save = 0
+        self._last_save = time.monotonic()
+        if stats_path and os.path.exists(stats_path):
+            try:
+                self._stats = self._read_stats_file()
+            except ValueError as e:
+                logger.error(f"❌ Error loading PDF backend stats from {self.stats_path}: {str(e)}")
+
+    def _read_stats_file(self) -> Dict[str, Dict[str, BackendStats]]:
+        """Stats in the file ({} if there is none); ValueError if it is unreadable"""
+        try:
+            with open(self.stats_path, 'r', encoding='utf-8') as f:
+                raw = json.load(f)
+            return {
+                layout: {name: BackendStats(**values) for name, values in backends.items()}
+                for layout, backends in raw.items()
+            }
+        except FileNotFoundError:
+            return {}
+        except (ValueError, TypeError, AttributeError) as e:
+            raise ValueError(str(e))
+
+    def save_stats(self) -> None:
+        """Add the unsaved increments to the stats file so the policy survives restarts"""
+        if not self.stats_path:
+            return
+        directory = os.path.dirname(os.path.abspath(self.stats_path))
+        with self._save_lock, open(f"{self.stats_path}.lock", 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            updates = self.drain_updates()
+            self._documents_since_save = 0
+            self._last_save = time.monotonic()
+            if not updates:
+                return
+            try:
+                stored = self._read_stats_file()
+                _add_stats(stored, updates)
+            except ValueError as e:
+                # Keep the unreadable file for inspection and fall back to the
+                # history this process holds (loaded at start plus its own runs)
+                backup = f"{self.stats_path}.corrupt-{int(time.time())}"
+                os.replace(self.stats_path, backup)
+                logger.error(f"❌ Unreadable PDF backend stats {self.stats_path} ({str(e)}), "
+                             f"moved to {backup}")
+                with self._lock:
+                    stored = {layout: {name: BackendStats(**asdict(stats)) for name, stats in backends.items()}
+                              for layout, backends in self._stats.items()}
+                    for layout, backends in self._unsaved.items():
+                        for name, increment in backends.items():
+                            stats = stored[layout][name]
+                            stats.pages -= increment.pages
+                            stats.successes -= increment.successes
+                            stats.seconds -= increment.seconds
+            raw = {
+                layout: {name: asdict(stats) for name, stats in backends.items()}
+                for layout, backends in stored.items()
+            }
+            with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=directory, delete=False,
+                                             prefix=os.path.basename(self.stats_path), suffix=".tmp") as f:
+                json.dump(raw, f, indent=2)
+            os.replace(f.name, self.stats_path)
+            # Pick up what other processes saved, plus anything recorded meanwhile
+            with self._lock:
+                self._stats = stored
+                _add_stats(self._stats, self._unsaved)
+
+    def _maybe_save(self) -> None:
+        self._documents_since_save += 1
+        if (self._documents_since_save >= SAVE_EVERY_DOCUMENTS
+                or time.monotonic() - self._last_save >= SAVE_EVERY_SECONDS):
+            try:
+                self.save_stats()
+            except OSError as e:
+                logger.error(f"❌ Error saving PDF backend stats to {self.stats_path}: {str(e)}")
+
+    def drain_updates(self) -> Dict[str, Dict[str, BackendStats]]:
+        """Take the increments recorded since the last save or drain"""
+        with self._lock:
+            updates, self._unsaved = self._unsaved, {}
+        return updates
+
+    def merge_updates(self, updates: Dict[str, Dict[str, BackendStats]]) -> None:
+        """Fold in increments drained from another (worker) selector"""
+        with self._lock:
+            _add_stats(self._stats, updates)
+            _add_stats(self._unsaved, updates)
+
+    def stats(self, layout: str) -> Dict[str, BackendStats]:
+        with self._lock:
+            return dict(self._stats.get(layout, {}))
+
+    def order_for(self, layout: str) -> List[str]:
+        """Backends to try for a layout: proven-fast first, untried next, unreliable last"""
+        history = self.stats(layout)
+
+        def rank(name: str) -> Tuple[int, float, int]:
+            stats = history.get(name)
+            default_pos = self.backend_names.index(name)
+            if stats is None or not stats.pages:
+                return (1, 0.0, default_pos)
+            if stats.success_rate >= MIN_SUCCESS_RATE:
+                return (0, stats.seconds_per_page, default_pos)
+            return (2, -stats.success_rate, default_pos)
+
+        return sorted(self.backend_names, key=rank)
+
+    def _record(self, layout: str, name: str, pages: Dict[int, str], seconds: float) -> None:
+        increment = BackendStats(
+            pages=len(pages),
+            successes=sum(1 for text in pages.values() if text.strip()),
+            seconds=seconds
+        )
+        with self._lock:
+            _add_stats(self._stats, {layout: {name: increment}})
+            _add_stats(self._unsaved, {layout: {name: increment}})
+
+    def extract_text(self, pdf_path: str) -> Tuple[str, Dict[str, Any]]:
+        """Extract text, falling back to the next backend only for empty pages"""
+        # Opened once for the layout key and reused by the PyMuPDF backend
+        document = open_document(pdf_path)
+        pages: Dict[int, str] = {}
+        pending: Optional[List[int]] = None
+        used: Dict[str, int] = {}
+        timings: Dict[str, float] = {}
+
+        try:
+            layout = read_producer(pdf_path, document)
+            for name in self.order_for(layout):
+                started = time.perf_counter()
+                try:
+                    result = self._instances[name].extract_pages(pdf_path, pending, document=document)
+                except Exception as e:
+                    logger.warning(f"PDF backend {name} failed on {pdf_path}: {str(e)}")
+                    continue
+                elapsed = time.perf_counter() - started
+                self._record(layout, name, result, elapsed)
+                timings[name] = round(elapsed, 4)
+
+                for page_num, text in result.items():
+                    if text.strip():
+                        pages[page_num] = text
+                        used[name] = used.get(name, 0) + 1
+                pending = [page_num for page_num in result if not result[page_num].strip()]
+                if not pending:
+                    break
+        finally:
+            if document is not None:
+                document.close()
+
+        if self.autosave and self.stats_path:
+            self._maybe_save()
+
+        text = " ".join(pages[page_num] for page_num in sorted(pages))
+        info = {
+            "pdf_producer": layout,
+            "pdf_backends": used,
+            "pdf_backend_seconds": timings,
+            "empty_pages": pending or [],
+        }
+        return text, info
@@ -0,0 +1,77 @@
+"""
+Startup Budget Check
+====================
+
+Measures package import cost with ``python -X importtime`` in a fresh
+interpreter and verifies that heavy optional backends stay out of the
+import graph of the JSON-only code paths. Each check imports the module
+once, cold; modules the interpreter loads at startup (``site`` and friends)
+are not counted.
+"""
+
+import os
+import subprocess
+import sys
+from typing import Dict, List, Optional, Tuple
+
+# Modules that must only be imported on first use
+HEAVY_MODULES = ("fitz", "pymupdf", "pdfplumber", "numpy", "pandas", "dateutil")
+
+# Default budget for importing the JSON rebuild path, in milliseconds
+DEFAULT_BUDGET_MS = 300.0
+
+# Written to stderr between interpreter startup and the measured import
+_IMPORT_MARKER = "startup-budget: measuring"
+
+
+def measure_import_time(module: str = "src.data_processor") -> Tuple[float, Dict[str, float]]:
+    """Import ``module`` in a child interpreter and return (total_ms, {module: cumulative_ms})"""
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    code = f"import sys; sys.stderr.write({_IMPORT_MARKER!r} + '\\n'); sys.stderr.flush(); import {module}"
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=project_root,
+        capture_output=True,
+        text=True,
+        check=True
+    )
+
+    cumulative = {}
+    total_ms = 0.0
+    lines = result.stderr.splitlines()
+    if _IMPORT_MARKER in lines:
+        # Skip what the interpreter imported before running the command
+        lines = lines[lines.index(_IMPORT_MARKER) + 1:]
+    for line in lines:
+        # Format: "import time: self [us] | cumulative | imported package"
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line[len("import time:"):].split("|")
+        cumulative[name.strip()] = int(cumulative_us) / 1000.0
+        # Top-level entries (one leading space) add up to the whole import
+        if not name.startswith("  "):
+            total_ms += int(cumulative_us) / 1000.0
+
+    return total_ms, cumulative
+
+
+def check_startup_budget(module: str = "src.data_processor",
+                         budget_ms: float = DEFAULT_BUDGET_MS,
+                         measurement: Optional[Tuple[float, Dict[str, float]]] = None) -> List[str]:
+    """Return a list of budget violations (empty when within budget)
+
+    ``measurement`` is a result of ``measure_import_time`` to check instead
+    of importing the module again.
+    """
+    total_ms, cumulative = measurement or measure_import_time(module)
+    problems = []
+
+    if total_ms > budget_ms:
+        problems.append(f"import {module} took {total_ms:.1f} ms (budget {budget_ms:.0f} ms)")
+
+    for name in cumulative:
+        if name.split(".")[0] in HEAVY_MODULES:
+            problems.append(f"import {module} eagerly loads heavy module '{name}'")
+            break
+
+    return problems
@@ -0,0 +1,544 @@
+"""
+SQLite Report Store
+===================
+
+Persists patient profiles, lab reports and individual biomarker values in a
+local SQLite database so that cohort queries ("all HbA1c > 6.5 in the last
+90 days") are answered from indexes instead of by walking every profile.
+
+Storage is tiered. Reports live in the mutable hot tables until ``compact``
+moves those older than a cutoff into the cold tier (see ``cold_tier``).
+The cold tier holds immutable compressed per-patient segments, and each
+segment's raw extraction metadata goes to a separate archive. The
+``segments`` table indexes them by patient and date range.
+``load_patient_profile`` reads the hot tier only. ``load_cold_reports``
+returns the compacted history, which ``BiomarkerDataProcessor`` merges in
+at read time, so the hot tables and indexes grow with recent activity
+rather than total history. ``query_values`` consults only the segments
+whose date range overlaps the query.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+from datetime import datetime
+from typing import Dict, List, Optional, Any, Iterable, Iterator, Set, Tuple
+
+from .models import PatientProfile, LabReport, BiomarkerType, BiomarkerValue
+
+logger = logging.getLogger(__name__)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS patients (
+    patient_id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    age INTEGER,
+    gender TEXT,
+    created_at TEXT,
+    updated_at TEXT
+);
+
+CREATE TABLE IF NOT EXISTS reports (
+    report_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    patient_id TEXT NOT NULL REFERENCES patients(patient_id) ON DELETE CASCADE,
+    report_date TEXT NOT NULL,
+    source_file TEXT NOT NULL,
+    extraction_metadata TEXT
+);
+
+CREATE TABLE IF NOT EXISTS biomarker_values (
+    report_id INTEGER NOT NULL REFERENCES reports(report_id) ON DELETE CASCADE,
+    patient_id TEXT NOT NULL,
+    report_date TEXT NOT NULL,
+    biomarker TEXT NOT NULL,
+    value REAL NOT NULL,
+    unit TEXT NOT NULL,
+    status TEXT,
+    confidence REAL,
+    ref_min REAL,
+    ref_max REAL,
+    PRIMARY KEY (report_id, biomarker)
+);
+
+CREATE INDEX IF NOT EXISTS idx_reports_patient_date ON reports(patient_id, report_date);
+CREATE INDEX IF NOT EXISTS idx_values_patient ON biomarker_values(patient_id, biomarker, report_date);
+CREATE INDEX IF NOT EXISTS idx_values_biomarker_date ON biomarker_values(biomarker, report_date, value);
+CREATE INDEX IF NOT EXISTS idx_values_date ON biomarker_values(report_date);
+
+CREATE TABLE IF NOT EXISTS segments (
+    segment_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    patient_id TEXT NOT NULL REFERENCES patients(patient_id) ON DELETE CASCADE,
+    first_date TEXT NOT NULL,
+    last_date TEXT NOT NULL,
+    reports INTEGER NOT NULL,
+    readings INTEGER NOT NULL,
+    path TEXT NOT NULL UNIQUE,
+    archive_path TEXT NOT NULL,
+    bytes INTEGER NOT NULL,
+    created_at TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_segments_patient ON segments(patient_id, first_date, last_date);
+CREATE INDEX IF NOT EXISTS idx_segments_dates ON segments(last_date, first_date);
+"""
+
+
+class ReportStore:
+    """SQLite-backed store for lab reports and biomarker values"""
+
+    def __init__(self, db_path: str, cold_dir: Optional[str] = None):
+        self.db_path = db_path
+        # Cold segments live next to the database unless placed elsewhere
+        self.cold_dir = cold_dir or (f"{db_path}.cold" if db_path != ":memory:" else None)
+        self._cold = None
+        self.conn = sqlite3.connect(db_path)
+        self.conn.row_factory = sqlite3.Row
+        # WAL lets readers (dashboard queries) run while an ingest is writing
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        self.conn.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ------------------------------------------------------------------
+    # Writes
+    # ------------------------------------------------------------------
+
+    def save_patient_profile(self, patient_profile: PatientProfile, replace: bool = True) -> int:
+        """Write a profile and its reports in one transaction
+
+        With ``replace`` the patient's previously stored reports are dropped
+        first, so re-running a rebuild does not duplicate rows.
+        """
+        with self.conn:
+            self.conn.execute(
+                """
+                INSERT INTO patients (patient_id, name, age, gender, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(patient_id) DO UPDATE SET
+                    name = excluded.name,
+                    age = COALESCE(excluded.age, patients.age),
+                    gender = COALESCE(excluded.gender, patients.gender),
+                    updated_at = excluded.updated_at
+                """,
+                (
+                    patient_profile.patient_id,
+                    patient_profile.name,
+                    patient_profile.age,
+                    patient_profile.gender,
+                    patient_profile.created_at.isoformat(),
+                    patient_profile.updated_at.isoformat(),
+                )
+            )
+            reports = patient_profile.reports
+            if replace:
+                self.conn.execute("DELETE FROM reports WHERE patient_id = ?", (patient_profile.patient_id,))
+                # Compacted reports are final; keep them out of the hot tier
+                compacted = self._cold_report_keys(patient_profile.patient_id)
+                if compacted:
+                    reports = [r for r in reports
+                               if (r.report_date.isoformat(), r.source_file) not in compacted]
+            count = self._insert_reports(patient_profile.patient_id, reports)
+
+        logger.info(f"💾 Stored {count} reports for {patient_profile.patient_id} in {self.db_path}")
+        return count
+
+    def add_reports(self, patient_id: str, reports: Iterable[LabReport]) -> int:
+        """Append reports for an existing patient in one transaction"""
+        with self.conn:
+            return self._insert_reports(patient_id, reports)
+
+    def add_report_batch(self, reports_by_patient: Dict[str, List[LabReport]], merge: bool = False) -> int:
+        """Append reports for many patients in one transaction
+
+        Patients not yet in the store are created with their id as name.
+        With ``merge`` a report whose patient, date and source file match a
+        stored report is folded into it instead of being added again, so a
+        date split across several batches ends up as one report.
+        """
+        now = datetime.now().isoformat()
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO patients (patient_id, name, created_at, updated_at) VALUES (?, ?, ?, ?)",
+                [(patient_id, patient_id, now, now) for patient_id in reports_by_patient]
+            )
+            return sum(
+                self._insert_reports(patient_id, reports, merge=merge)
+                for patient_id, reports in reports_by_patient.items()
+            )
+
+    def _existing_report(self, patient_id: str, report_date: str, source_file: str,
+                         metadata: Dict[str, Any]) -> Optional[int]:
+        """Id of a stored report with the same patient, date and source, with metadata merged in"""
+        row = self.conn.execute(
+            "SELECT report_id, extraction_metadata FROM reports "
+            "WHERE patient_id = ? AND report_date = ? AND source_file = ? ORDER BY report_id LIMIT 1",
+            (patient_id, report_date, source_file)
+        ).fetchone()
+        if row is None:
+            return None
+        merged = json.loads(row["extraction_metadata"] or "{}")
+        for key, value in metadata.items():
+            if isinstance(value, list) and isinstance(merged.get(key), list):
+                merged[key] = merged[key] + [v for v in value if v not in merged[key]]
+            else:
+                merged.setdefault(key, value)
+        self.conn.execute(
+            "UPDATE reports SET extraction_metadata = ? WHERE report_id = ?",
+            (json.dumps(merged, default=str), row["report_id"])
+        )
+        return row["report_id"]
+
+    def _insert_reports(self, patient_id: str, reports: Iterable[LabReport], merge: bool = False) -> int:
+        count = 0
+        value_rows = []
+        for report in reports:
+            report_date = report.report_date.isoformat()
+            report_id = None
+            if merge:
+                report_id = self._existing_report(patient_id, report_date, report.source_file,
+                                                  report.extraction_metadata)
+            if report_id is None:
+                cursor = self.conn.execute(
+                    "INSERT INTO reports (patient_id, report_date, source_file, extraction_metadata) "
+                    "VALUES (?, ?, ?, ?)",
+                    (patient_id, report_date, report.source_file,
+                     json.dumps(report.extraction_metadata, default=str))
+                )
+                report_id = cursor.lastrowid
+            for biomarker_type, biomarker in report.biomarkers.items():
+                ref_range = biomarker.reference_range or {}
+                value_rows.append((
+                    report_id, patient_id, report_date, biomarker_type.value,
+                    biomarker.value, biomarker.unit.value, biomarker.status,
+                    biomarker.confidence, ref_range.get("min"), ref_range.get("max")
+                ))
+            count += 1
+
+        # A merged report may already hold a value for the biomarker; the newer reading wins
+        insert = "INSERT OR REPLACE" if merge else "INSERT"
+        self.conn.executemany(
+            f"{insert} INTO biomarker_values (report_id, patient_id, report_date, biomarker, value, "
+            "unit, status, confidence, ref_min, ref_max) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            value_rows
+        )
+        return count
+
+    # ------------------------------------------------------------------
+    # Queries
+    # ------------------------------------------------------------------
+
+    def patient_ids(self) -> List[str]:
+        """List all stored patient identifiers"""
+        return [row[0] for row in self.conn.execute("SELECT patient_id FROM patients ORDER BY patient_id")]
+
+    def report_keys(self) -> Dict[str, Set[Tuple[str, str]]]:
+        """(report_date, source_file) of every hot-tier report, per patient"""
+        keys: Dict[str, Set[Tuple[str, str]]] = {}
+        for patient_id, report_date, source_file in self.conn.execute(
+            "SELECT patient_id, report_date, source_file FROM reports"
+        ):
+            keys.setdefault(patient_id, set()).add((report_date, source_file))
+        return keys
+
+    def query_values(self, biomarker: BiomarkerType,
+                     min_value: Optional[float] = None,
+                     max_value: Optional[float] = None,
+                     since: Optional[datetime] = None,
+                     until: Optional[datetime] = None,
+                     patient_id: Optional[str] = None,
+                     status: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Return biomarker readings matching the filters, ordered by date
+
+        Example: ``query_values(BiomarkerType.HBA1C, min_value=6.5,
+        since=datetime.now() - timedelta(days=90))``.
+        """
+        clauses = ["biomarker = ?"]
+        params: List[Any] = [biomarker.value]
+        if patient_id is not None:
+            clauses.append("patient_id = ?")
+            params.append(patient_id)
+        if since is not None:
+            clauses.append("report_date >= ?")
+            params.append(since.isoformat())
+        if until is not None:
+            clauses.append("report_date <= ?")
+            params.append(until.isoformat())
+        if min_value is not None:
+            clauses.append("value > ?")
+            params.append(min_value)
+        if max_value is not None:
+            clauses.append("value < ?")
+            params.append(max_value)
+        if status is not None:
+            clauses.append("status = ?")
+            params.append(status)
+
+        sql = (
+            "SELECT patient_id, report_date, biomarker, value, unit, status, confidence, ref_min, ref_max "
+            f"FROM biomarker_values WHERE {' AND '.join(clauses)} ORDER BY report_date"
+        )
+        rows = [dict(row) for row in self.conn.execute(sql, params)]
+
+        cold_rows = self._query_cold_values(biomarker, min_value, max_value, since, until, patient_id, status)
+        if cold_rows:
+            rows = sorted(cold_rows + rows, key=lambda row: row["report_date"])
+        return rows
+
+    def _query_cold_values(self, biomarker: BiomarkerType,
+                           min_value: Optional[float], max_value: Optional[float],
+                           since: Optional[datetime], until: Optional[datetime],
+                           patient_id: Optional[str], status: Optional[str]) -> List[Dict[str, Any]]:
+        """``query_values`` over the segments whose date range overlaps the query"""
+        if self.cold_dir is None:
+            return []
+        from .cold_tier import segment_rows
+
+        since_key = since.isoformat() if since is not None else None
+        until_key = until.isoformat() if until is not None else None
+        rows = []
+        for segment_patient, path in self._segments(patient_id, since, until):
+            document = self.cold.read(path)
+            if biomarker.value not in document["series"]:
+                continue
+            for date, _, name, value, unit, value_status, confidence, ref_min, ref_max in segment_rows(document):
+                if name != biomarker.value:
+                    continue
+                if ((since_key is not None and date < since_key) or (until_key is not None and date > until_key)
+                        or (min_value is not None and not value > min_value)
+                        or (max_value is not None and not value < max_value)
+                        or (status is not None and value_status != status)):
+                    continue
+                rows.append({
+                    "patient_id": segment_patient, "report_date": date, "biomarker": name,
+                    "value": value, "unit": unit, "status": value_status, "confidence": confidence,
+                    "ref_min": ref_min, "ref_max": ref_max,
+                })
+        return rows
+
+    def load_patient_profile(self, patient_id: str,
+                             since: Optional[datetime] = None,
+                             biomarkers: Optional[List[BiomarkerType]] = None) -> Optional[PatientProfile]:
+        """Rebuild a PatientProfile from the hot tier, optionally limited to a date window and biomarker subset"""
+        patient = self.conn.execute(
+            "SELECT * FROM patients WHERE patient_id = ?", (patient_id,)
+        ).fetchone()
+        if patient is None:
+            return None
+
+        report_sql = "SELECT * FROM reports WHERE patient_id = ?"
+        params: List[Any] = [patient_id]
+        if since is not None:
+            report_sql += " AND report_date >= ?"
+            params.append(since.isoformat())
+        report_sql += " ORDER BY report_date"
+        report_rows = self.conn.execute(report_sql, params).fetchall()
+
+        value_sql = "SELECT * FROM biomarker_values WHERE patient_id = ?"
+        value_params: List[Any] = [patient_id]
+        if since is not None:
+            value_sql += " AND report_date >= ?"
+            value_params.append(since.isoformat())
+        if biomarkers:
+            value_sql += f" AND biomarker IN ({', '.join('?' for _ in biomarkers)})"
+            value_params.extend(b.value for b in biomarkers)
+
+        values_by_report: Dict[int, Dict[BiomarkerType, BiomarkerValue]] = {}
+        for row in self.conn.execute(value_sql, value_params):
+            ref_range = None
+            if row["ref_min"] is not None and row["ref_max"] is not None:
+                ref_range = {"min": row["ref_min"], "max": row["ref_max"]}
+            values_by_report.setdefault(row["report_id"], {})[BiomarkerType(row["biomarker"])] = BiomarkerValue(
+                value=row["value"],
+                unit=row["unit"],
+                reference_range=ref_range,
+                status=row["status"],
+                confidence=row["confidence"] or 0.0
+            )
+
+        reports = [
+            LabReport(
+                report_date=datetime.fromisoformat(row["report_date"]),
+                source_file=row["source_file"],
+                biomarkers=values_by_report.get(row["report_id"], {}),
+                extraction_metadata=json.loads(row["extraction_metadata"] or "{}")
+            )
+            for row in report_rows
+        ]
+
+        return PatientProfile(
+            patient_id=patient["patient_id"],
+            name=patient["name"],
+            age=patient["age"],
+            gender=patient["gender"],
+            reports=reports,
+            created_at=datetime.fromisoformat(patient["created_at"]),
+            updated_at=datetime.fromisoformat(patient["updated_at"])
+        )
+
+    # ------------------------------------------------------------------
+    # Cold tier
+    # ------------------------------------------------------------------
+
+    @property
+    def cold(self):
+        if self._cold is None:
+            if self.cold_dir is None:
+                raise ValueError("This report store has no cold tier directory")
+            from .cold_tier import ColdTier
+            self._cold = ColdTier(self.cold_dir)
+        return self._cold
+
+    def _segments(self, patient_id: Optional[str] = None,
+                  since: Optional[datetime] = None,
+                  until: Optional[datetime] = None) -> List[Tuple[str, str]]:
+        """(patient_id, path) of the segments overlapping a date range"""
+        clauses, params = [], []
+        if patient_id is not None:
+            clauses.append("patient_id = ?")
+            params.append(patient_id)
+        if since is not None:
+            clauses.append("last_date >= ?")
+            params.append(since.isoformat())
+        if until is not None:
+            clauses.append("first_date <= ?")
+            params.append(until.isoformat())
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        return [tuple(row) for row in self.conn.execute(
+            f"SELECT patient_id, path FROM segments{where} ORDER BY patient_id, first_date", params
+        )]
+
+    def _cold_report_keys(self, patient_id: str) -> Set[Tuple[str, str]]:
+        from .cold_tier import segment_rows
+        return {
+            (row[0], row[1])
+            for _, path in self._segments(patient_id)
+            for row in segment_rows(self.cold.read(path))
+        }
+
+    def compact(self, before: datetime, patient_ids: Optional[List[str]] = None) -> Dict[str, int]:
+        """Move hot reports dated before ``before`` into cold segments
+
+        Each patient's eligible reports become one new segment. Files are
+        written first and the hot rows are deleted in the same transaction
+        that indexes the segment, so an interrupted compaction leaves the
+        reports in the hot tier (and at worst unreferenced files, removed
+        by the next compaction).
+        """
+        totals = {"patients": 0, "segments": 0, "reports": 0, "readings": 0, "bytes": 0, "orphans_removed": 0}
+        if self.cold_dir is None:
+            return totals
+        totals["orphans_removed"] = self.cold.remove_unreferenced(
+            path for row in self.conn.execute("SELECT path, archive_path FROM segments") for path in row
+        )
+
+        cutoff = before.isoformat()
+        candidates = patient_ids or [row[0] for row in self.conn.execute(
+            "SELECT DISTINCT patient_id FROM reports WHERE report_date < ?", (cutoff,)
+        )]
+        for patient_id in candidates:
+            report_rows = self.conn.execute(
+                "SELECT report_id, report_date, source_file, extraction_metadata FROM reports "
+                "WHERE patient_id = ? AND report_date < ? ORDER BY report_date, report_id",
+                (patient_id, cutoff)
+            ).fetchall()
+            if not report_rows:
+                continue
+            values: Dict[int, List[Tuple]] = {}
+            for row in self.conn.execute(
+                "SELECT v.report_id, v.biomarker, v.value, v.unit, v.status, v.confidence, v.ref_min, v.ref_max "
+                "FROM biomarker_values v JOIN reports r ON r.report_id = v.report_id "
+                "WHERE r.patient_id = ? AND r.report_date < ?", (patient_id, cutoff)
+            ):
+                values.setdefault(row[0], []).append(tuple(row[1:]))
+
+            reports = [
+                (row["report_date"], row["source_file"], row["extraction_metadata"], values.get(row["report_id"], []))
+                for row in report_rows
+            ]
+            path, archive_path, size = self.cold.write(patient_id, reports)
+            readings = sum(len(r[3]) for r in reports)
+            with self.conn:
+                self.conn.execute(
+                    "INSERT OR IGNORE INTO segments (patient_id, first_date, last_date, reports, readings, "
+                    "path, archive_path, bytes, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (patient_id, reports[0][0], reports[-1][0], len(reports), readings,
+                     path, archive_path, size, datetime.now().isoformat())
+                )
+                self.conn.executemany(
+                    "DELETE FROM reports WHERE report_id = ?", [(row["report_id"],) for row in report_rows]
+                )
+            totals["patients"] += 1
+            totals["segments"] += 1
+            totals["reports"] += len(reports)
+            totals["readings"] += readings
+            totals["bytes"] += size
+
+        logger.info(f"🧊 Compacted {totals['reports']} reports of {totals['patients']} patients "
+                    f"into {totals['segments']} segments ({totals['bytes'] / 1024:.1f} KB)")
+        return totals
+
+    def load_cold_reports(self, patient_id: str,
+                          since: Optional[datetime] = None,
+                          biomarkers: Optional[List[BiomarkerType]] = None) -> List[LabReport]:
+        """A patient's compacted reports, optionally limited like ``load_patient_profile``"""
+        if self.cold_dir is None:
+            return []
+        from .cold_tier import segment_reports
+
+        reports = []
+        for _, path in self._segments(patient_id, since=since):
+            reports.extend(segment_reports(self.cold.read(path), os.path.basename(path), biomarkers))
+        if since is not None:
+            reports = [r for r in reports if r.report_date.isoformat() >= since.isoformat()]
+        return reports
+
+    def load_provenance(self, patient_id: str) -> List[Dict[str, Any]]:
+        """Archived extraction metadata of a patient's compacted reports"""
+        return [
+            entry
+            for (archive_path,) in self.conn.execute(
+                "SELECT archive_path FROM segments WHERE patient_id = ? ORDER BY first_date", (patient_id,)
+            )
+            for entry in self.cold.read_provenance(archive_path)
+        ]
+
+    def iter_cold_rows(self) -> Iterator[Tuple]:
+        """(patient_id, report_date, biomarker, value, unit, status, confidence, source_file) of every cold reading"""
+        if self.cold_dir is None:
+            return
+        from .cold_tier import segment_rows
+
+        for patient_id, path in self._segments():
+            for date, source, biomarker, value, unit, status, confidence, _, _ in segment_rows(self.cold.read(path)):
+                yield patient_id, date, biomarker, value, unit, status, confidence, source
+
+    def tier_stats(self) -> Dict[str, Any]:
+        """Report and reading counts per tier, plus on-disk sizes"""
+        hot_reports = self.conn.execute("SELECT COUNT(*) FROM reports").fetchone()[0]
+        hot_readings = self.conn.execute("SELECT COUNT(*) FROM biomarker_values").fetchone()[0]
+        cold = self.conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(reports), 0), COALESCE(SUM(readings), 0), COALESCE(SUM(bytes), 0) "
+            "FROM segments"
+        ).fetchone()
+        page_size = self.conn.execute("PRAGMA page_size").fetchone()[0]
+        pages = self.conn.execute("PRAGMA page_count").fetchone()[0]
+        return {
+            "hot_reports": hot_reports,
+            "hot_readings": hot_readings,
+            "hot_db_bytes": page_size * pages,
+            "segments": cold[0],
+            "cold_reports": cold[1],
+            "cold_readings": cold[2],
+            "cold_segment_bytes": cold[3],
+        }
@@ -0,0 +1,411 @@
+"""
+Inbox Watcher for Continuous Ingestion
+======================================
+
+Long-running ingestion daemon that watches an inbox directory for new PDF
+reports and legacy JSON exports, feeds them through ``BiomarkerExtractor``
+and rewrites the dashboard output of only the patients they affect.
+
+PDFs are assigned to a patient by the name of the inbox sub-folder they are
+dropped into (``inbox/<patient>/report.pdf``); JSON files carry the patient
+in their ``"patient"`` field.
+
+Ingestions run on a small thread pool, but PDF extraction is serialized:
+PyMuPDF is not thread-safe and the extractor (with its backend stats) is
+shared. JSON parsing, merging and exports still overlap.
+
+Cohort sketches cannot forget values, so an input dropped again under the
+same file name replaces its reports in the patient's dashboard but is only
+counted in the cohort statistics the first time.
+"""
+
+import asyncio
+import ctypes
+import ctypes.util
+import json
+import logging
+import os
+import shutil
+import struct
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+from .models import PatientProfile
+from .data_processor import BiomarkerDataProcessor
+from .cohort_stats import CohortStatistics
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_SUFFIXES = (".pdf", ".json")
+QUEUE_FILE = ".ingest_queue.json"
+PROCESSED_DIR = "processed"
+FAILED_DIR = "failed"
+COHORT_STATE_FILE = ".cohort_state.json"
+
+
+def _write_json_atomic(path: Path, data) -> None:
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+class _Inotify:
+    """Minimal ctypes binding to Linux inotify, used only as a wake-up signal"""
+
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+    _EVENT_HEADER = struct.Struct("iIII")
+
+    def __init__(self):
+        libc_name = ctypes.util.find_library("c")
+        if not libc_name:
+            raise OSError("libc not found")
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self._libc, "inotify_init1"):
+            raise OSError("inotify is not available on this platform")
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._watched = set()
+
+    def watch(self, directory: Path) -> None:
+        """Add a watch on a directory (repeated calls are no-ops)"""
+        key = str(directory)
+        if key in self._watched:
+            return
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(key), self.WATCH_MASK)
+        if wd < 0:
+            logger.warning(f"Could not watch {key}: errno {ctypes.get_errno()}")
+            return
+        self._watched.add(key)
+
+    def drain(self) -> int:
+        """Consume pending events and return how many were read"""
+        count = 0
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return count
+            offset = 0
+            while offset < len(data):
+                _, _, _, name_len = self._EVENT_HEADER.unpack_from(data, offset)
+                offset += self._EVENT_HEADER.size + name_len
+                count += 1
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class IngestionDaemon:
+    """Watches an inbox directory and incrementally ingests new lab data"""
+
+    def __init__(self, inbox_dir: str, output_dir: str,
+                 web_output: Optional[str] = None,
+                 cohort_output: Optional[str] = None,
+                 max_workers: int = 2,
+                 debounce_seconds: float = 2.0,
+                 poll_interval: float = 1.0,
+                 pdf_mode: str = "auto",
+                 use_inotify: bool = True,
+                 pdf_stats_path: Optional[str] = None):
+        self.inbox_dir = Path(inbox_dir)
+        self.output_dir = Path(output_dir)
+        self.web_output = Path(web_output) if web_output else None
+        self.cohort_output = Path(cohort_output) if cohort_output else None
+        self.max_workers = max_workers
+        self.debounce_seconds = debounce_seconds
+        self.poll_interval = poll_interval
+        self.pdf_mode = pdf_mode
+        self.use_inotify = use_inotify
+
+        self.processor = BiomarkerDataProcessor(pdf_stats_path=pdf_stats_path)
+        # One PDF extraction at a time (PyMuPDF is not thread-safe)
+        self._pdf_lock = threading.Lock()
+        self.queue_path = self.inbox_dir / QUEUE_FILE
+
+        # Cohort sketches are updated incrementally with each ingested report
+        self.cohort_state_path = self.output_dir / COHORT_STATE_FILE
+        self.cohort = CohortStatistics()
+        # patient id -> input file names already folded into the sketches
+        self._cohort_sources: Dict[str, Set[str]] = defaultdict(set)
+        self._cohort_export: Dict = {}
+        self._cohort_lock = threading.Lock()
+
+        # path -> (size, mtime_ns, time the signature last changed)
+        self._candidates: Dict[str, Tuple[int, int, float]] = {}
+        self._pending: List[str] = []
+        self._patient_locks: Dict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+        self._wakeup: Optional[asyncio.Event] = None
+        self._inotify: Optional[_Inotify] = None
+        self._stopping = False
+
+    # ------------------------------------------------------------------
+    # Persisted queue
+    # ------------------------------------------------------------------
+
+    def _load_queue(self) -> List[str]:
+        """Load queued paths left over from a previous run"""
+        if not self.queue_path.exists():
+            return []
+        try:
+            with open(self.queue_path, 'r', encoding='utf-8') as f:
+                paths = json.load(f)
+            return [p for p in paths if Path(p).exists()]
+        except Exception as e:
+            logger.error(f"❌ Error loading ingestion queue {self.queue_path}: {str(e)}")
+            return []
+
+    def _save_queue(self) -> None:
+        """Atomically persist the pending queue"""
+        _write_json_atomic(self.queue_path, self._pending)
+
+    # ------------------------------------------------------------------
+    # Scanning and debouncing
+    # ------------------------------------------------------------------
+
+    def _iter_inbox(self):
+        """Yield candidate input files and sub-directories in the inbox"""
+        skip = {PROCESSED_DIR, FAILED_DIR}
+        for root, dirs, files in os.walk(self.inbox_dir):
+            dirs[:] = [d for d in dirs if d not in skip and not d.startswith(".")]
+            yield Path(root), None
+            for name in files:
+                if name.startswith(".") or not name.lower().endswith(SUPPORTED_SUFFIXES):
+                    continue
+                yield Path(root), Path(root) / name
+
+    def scan(self, now: Optional[float] = None) -> List[str]:
+        """Return files whose size and mtime have been stable for the debounce window"""
+        now = time.monotonic() if now is None else now
+        ready = []
+        seen = set()
+
+        for directory, path in self._iter_inbox():
+            if path is None:
+                if self._inotify:
+                    self._inotify.watch(directory)
+                continue
+            key = str(path)
+            if key in self._pending:
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            seen.add(key)
+
+            previous = self._candidates.get(key)
+            if previous and previous[:2] == (stat.st_size, stat.st_mtime_ns):
+                if now - previous[2] >= self.debounce_seconds:
+                    ready.append(key)
+                    del self._candidates[key]
+            else:
+                self._candidates[key] = (stat.st_size, stat.st_mtime_ns, now)
+
+        # Forget files that disappeared before they settled
+        for key in list(self._candidates):
+            if key not in seen:
+                del self._candidates[key]
+
+        return ready
+
+    # ------------------------------------------------------------------
+    # Processing
+    # ------------------------------------------------------------------
+
+    def _load_input(self, path: Path) -> PatientProfile:
+        """Parse one inbox file into a (partial) patient profile"""
+        patient = path.parent.name if path.parent != self.inbox_dir else "Unknown"
+        if path.suffix.lower() == ".pdf":
+            with self._pdf_lock:
+                return self.processor.extractor.parse_input_file(str(path), patient, pdf_mode=self.pdf_mode)
+        return self.processor.extractor.parse_input_file(str(path), patient, pdf_mode=self.pdf_mode)
+
+    def _patient_output_path(self, patient_id: str) -> Path:
+        return self.output_dir / f"{patient_id}.json"
+
+    def _update_patient(self, incoming: PatientProfile) -> None:
+        """Merge new reports into the patient's stored profile and re-export it"""
+        output_path = self._patient_output_path(incoming.patient_id)
+        profile = incoming
+
+        if output_path.exists():
+            with open(output_path, 'r', encoding='utf-8') as f:
+                stored = PatientProfile.parse_obj(json.load(f)["patient_profile"])
+
+            # Re-ingesting the same input replaces the reports it produced before
+            sources = {r.extraction_metadata.get("ingested_from") for r in incoming.reports}
+            reports = [
+                r for r in stored.reports
+                if r.extraction_metadata.get("ingested_from") not in sources
+            ]
+            reports.extend(incoming.reports)
+            profile = PatientProfile(
+                patient_id=stored.patient_id,
+                name=stored.name,
+                age=incoming.age if incoming.age is not None else stored.age,
+                gender=incoming.gender or stored.gender,
+                reports=reports,
+                created_at=stored.created_at,
+                updated_at=datetime.now()
+            )
+
+        profile.reports.sort(key=lambda r: r.report_date)
+        cohort_stats = self._update_cohort(incoming)
+        dashboard_data = self.processor.build_dashboard_data(profile, cohort_stats)
+        self.processor.export_to_json(dashboard_data, str(output_path))
+        if self.web_output:
+            self.processor.export_to_json(dashboard_data, str(self.web_output))
+
+    def _load_cohort(self) -> None:
+        if not self.cohort_state_path.exists():
+            return
+        try:
+            with open(self.cohort_state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            self.cohort = CohortStatistics.from_dict(state)
+            for patient_id, sources in state.get("ingested", {}).items():
+                self._cohort_sources[patient_id] = set(sources)
+            self._cohort_export = self.cohort.export()
+        except Exception as e:
+            logger.error(f"❌ Error loading cohort state {self.cohort_state_path}: {str(e)}")
+
+    def _update_cohort(self, incoming: PatientProfile) -> Dict:
+        """Fold first-seen reports into the cohort sketches and re-export the tables"""
+        with self._cohort_lock:
+            seen = self._cohort_sources[incoming.patient_id]
+            reports = [
+                r for r in incoming.reports
+                if r.extraction_metadata.get("ingested_from") not in seen
+            ]
+            if not reports:
+                return self._cohort_export
+
+            for report in reports:
+                self.cohort.add_report(report, incoming.age, incoming.gender)
+                seen.add(report.extraction_metadata.get("ingested_from"))
+            state = self.cohort.to_dict()
+            state["ingested"] = {patient_id: sorted(sources)
+                                 for patient_id, sources in self._cohort_sources.items()}
+            _write_json_atomic(self.cohort_state_path, state)
+            if self.cohort_output:
+                self._cohort_export = self.processor.export_cohort_stats(self.cohort, str(self.cohort_output))
+            else:
+                self._cohort_export = self.cohort.export()
+            return self._cohort_export
+
+    def _archive(self, path: Path, subdir: str) -> None:
+        """Move a handled input out of the watched area"""
+        target_dir = self.inbox_dir / subdir / path.parent.relative_to(self.inbox_dir)
+        target_dir.mkdir(parents=True, exist_ok=True)
+        shutil.move(str(path), str(target_dir / path.name))
+
+    async def _worker(self, queue: asyncio.Queue, executor: ThreadPoolExecutor) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            key = await queue.get()
+            path = Path(key)
+            started = time.perf_counter()
+            try:
+                profile = await loop.run_in_executor(executor, self._load_input, path)
+                # Updates to one patient are serialized; different patients run concurrently
+                async with self._patient_locks[profile.patient_id]:
+                    await loop.run_in_executor(executor, self._update_patient, profile)
+                await loop.run_in_executor(executor, self._archive, path, PROCESSED_DIR)
+                logger.info(f"✅ Ingested {path.name} for {profile.patient_id} "
+                            f"in {time.perf_counter() - started:.2f}s")
+            except Exception as e:
+                logger.error(f"❌ Error ingesting {path}: {str(e)}")
+                if path.exists():
+                    await loop.run_in_executor(executor, self._archive, path, FAILED_DIR)
+            finally:
+                if key in self._pending:
+                    self._pending.remove(key)
+                    self._save_queue()
+                queue.task_done()
+
+    # ------------------------------------------------------------------
+    # Main loop
+    # ------------------------------------------------------------------
+
+    def _enqueue(self, queue: asyncio.Queue, paths: List[str]) -> None:
+        for key in paths:
+            self._pending.append(key)
+            queue.put_nowait(key)
+        if paths:
+            self._save_queue()
+            logger.info(f"📥 Queued {len(paths)} file(s) for ingestion")
+
+    def stop(self) -> None:
+        """Ask the daemon to exit after the current scan"""
+        self._stopping = True
+        if self._wakeup:
+            self._wakeup.set()
+
+    async def run(self) -> None:
+        """Watch the inbox until stopped"""
+        self.inbox_dir.mkdir(parents=True, exist_ok=True)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self._load_cohort()
+        loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+
+        if self.use_inotify:
+            try:
+                self._inotify = _Inotify()
+                loop.add_reader(self._inotify.fd, self._on_inotify)
+            except OSError as e:
+                logger.warning(f"inotify unavailable ({str(e)}), falling back to polling")
+                self._inotify = None
+        logger.info(f"👀 Watching {self.inbox_dir} "
+                    f"({'inotify' if self._inotify else 'polling'}, {self.max_workers} workers)")
+
+        queue: asyncio.Queue = asyncio.Queue()
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        workers = [
+            asyncio.create_task(self._worker(queue, executor))
+            for _ in range(self.max_workers)
+        ]
+
+        # Resume work queued before a restart
+        self._enqueue(queue, [p for p in self._load_queue() if p not in self._pending])
+
+        try:
+            while not self._stopping:
+                self._enqueue(queue, self.scan())
+
+                # With inotify we sleep until an event arrives, but still re-check
+                # unsettled files once the debounce window has elapsed
+                if self._inotify and not self._candidates:
+                    timeout = None
+                elif self._inotify:
+                    timeout = self.debounce_seconds
+                else:
+                    timeout = self.poll_interval
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            await queue.join()
+            for worker in workers:
+                worker.cancel()
+            executor.shutdown(wait=True)
+            self.processor.extractor.pdf_backends.save_stats()
+            if self._inotify:
+                loop.remove_reader(self._inotify.fd)
+                self._inotify.close()
+
+    def _on_inotify(self) -> None:
+        if self._inotify.drain():
+            self._wakeup.set()
@@ -0,0 +1,466 @@
+"""
+Sharded Work Queue
+==================
+
+Spreads batch extraction over any number of worker processes or hosts that
+share one queue directory (a local disk for workers on one box, or a network
+file system for several nodes).
+
+``WorkQueue.create`` partitions the inputs by a stable hash of the patient
+into ``shards``. It then cuts each shard into work items of at most
+``item_size`` inputs, keeping one patient's inputs together (a patient
+with more inputs than that gets an item of its own). The queue
+directory holds one JSON file per item, and its location is the item's
+state:
+
+    pending/<item>.json          waiting to be claimed
+    leased/<item>~<owner>.json   claimed by ``owner``
+    done/<item>.json             results are in ``results/<item>/``
+    failed/<item>.json           gave up after ``max_attempts`` leases
+
+A worker claims an item by renaming it from ``pending/`` to ``leased/``.
+Rename is atomic, so exactly one claimant wins. While it works, a
+heartbeat thread renews the lease by touching the leased file. Any worker
+that finds a lease not renewed for ``lease_seconds`` moves the item back to
+``pending/`` (or to ``failed/``), so a killed worker or a lost node only
+delays its items. Item results are written before the item is marked done
+and are replaced as a whole, so an item that ran twice leaves one result.
+
+``merge_results`` folds the per-item results into per-patient dashboards.
+It combines the per-item cohort aggregates with ``CohortStatistics.merge``,
+so the merged percentile tables match a single-process run over the same
+inputs.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from .batch_jobs import expand_inputs, merge_patient_profiles, _write_json_atomic
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = "queue.json"
+STATES = ("pending", "leased", "done", "failed")
+OWNER_SEPARATOR = "~"
+
+
+def patient_shard(patient: str, shards: int) -> int:
+    """Stable shard of a patient, identical on every host and interpreter"""
+    digest = hashlib.sha1(patient.strip().lower().encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % shards
+
+
+def default_owner() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class WorkQueue:
+    """A queue directory shared by a coordinator and its workers"""
+
+    def __init__(self, queue_dir: str):
+        self.root = Path(queue_dir)
+        self.manifest_path = self.root / MANIFEST_FILE
+        self.results_dir = self.root / "results"
+        self.tmp_dir = self.root / "tmp"
+        self.reaping_dir = self.root / "reaping"
+        self._manifest: Optional[Dict[str, Any]] = None
+
+    def _dir(self, state: str) -> Path:
+        return self.root / state
+
+    @property
+    def manifest(self) -> Dict[str, Any]:
+        if self._manifest is None:
+            if not self.manifest_path.exists():
+                raise FileNotFoundError(f"No work queue in {self.root} (run `queue init` first)")
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                self._manifest = json.load(f)
+        return self._manifest
+
+    @property
+    def lease_seconds(self) -> float:
+        return self.manifest["lease_seconds"]
+
+    # ------------------------------------------------------------------
+    # Creating
+    # ------------------------------------------------------------------
+
+    @classmethod
+    def create(cls, queue_dir: str, inputs: List[str], shards: int = 8, item_size: int = 50,
+               lease_seconds: float = 300.0, max_attempts: int = 3,
+               pdf_mode: str = "auto") -> "WorkQueue":
+        """Partition ``inputs`` into work items in a fresh queue directory"""
+        queue = cls(queue_dir)
+        if queue.manifest_path.exists():
+            raise FileExistsError(f"Work queue already exists in {queue_dir}")
+        for directory in [queue._dir(state) for state in STATES] + [
+                queue.results_dir, queue.tmp_dir, queue.reaping_dir]:
+            directory.mkdir(parents=True, exist_ok=True)
+
+        by_shard: Dict[int, Dict[str, List[Tuple[str, str]]]] = {}
+        for path, patient in expand_inputs(inputs):
+            by_shard.setdefault(patient_shard(patient, shards), {}).setdefault(patient, []).append(
+                (os.path.abspath(path), patient)
+            )
+
+        items = 0
+        for shard in sorted(by_shard):
+            chunk: List[Tuple[str, str]] = []
+            for patient in sorted(by_shard[shard]):
+                patient_inputs = by_shard[shard][patient]
+                if chunk and len(chunk) + len(patient_inputs) > item_size:
+                    queue._add_item(shard, items, chunk)
+                    items += 1
+                    chunk = []
+                chunk.extend(patient_inputs)
+            if chunk:
+                queue._add_item(shard, items, chunk)
+                items += 1
+
+        _write_json_atomic(queue.manifest_path, {
+            "version": 1,
+            "created_at": datetime.now().isoformat(),
+            "shards": shards,
+            "items": items,
+            "inputs": sum(len(p) for patients in by_shard.values() for p in patients.values()),
+            "lease_seconds": lease_seconds,
+            "max_attempts": max_attempts,
+            "pdf_mode": pdf_mode,
+        })
+        logger.info(f"🗂️  Work queue {queue_dir}: {items} items over {len(by_shard)} of {shards} shards")
+        return queue
+
+    def _add_item(self, shard: int, index: int, inputs: List[Tuple[str, str]]) -> None:
+        item_id = f"s{shard:04d}-{index:06d}"
+        self._write_item(self._dir("pending") / f"{item_id}.json", {
+            "item_id": item_id,
+            "shard": shard,
+            "attempts": 0,
+            "inputs": inputs,
+        })
+
+    def _write_item(self, path: Path, item: Dict[str, Any]) -> None:
+        # Write next to the queue so the final rename stays on one file system
+        tmp_path = self.tmp_dir / f"{path.name}.{default_owner()}"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(item, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _read_item(path: Path) -> Dict[str, Any]:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    # ------------------------------------------------------------------
+    # Leasing
+    # ------------------------------------------------------------------
+
+    def claim(self, owner: str) -> Optional[Tuple[Dict[str, Any], Path]]:
+        """Lease the next pending item, or None when nothing is pending"""
+        for path in sorted(self._dir("pending").glob("*.json")):
+            leased = self._dir("leased") / f"{path.stem}{OWNER_SEPARATOR}{owner}.json"
+            try:
+                os.rename(path, leased)
+            except FileNotFoundError:
+                # Another worker got there first
+                continue
+            os.utime(leased)
+            return self._read_item(leased), leased
+        return None
+
+    @staticmethod
+    def renew(lease: Path) -> bool:
+        """Extend a lease; False if it expired and was taken away"""
+        try:
+            os.utime(lease)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def complete(self, lease: Path) -> bool:
+        """Mark a leased item done; False if the lease was lost meanwhile"""
+        item_id = lease.stem.split(OWNER_SEPARATOR)[0]
+        try:
+            os.rename(lease, self._dir("done") / f"{item_id}.json")
+            return True
+        except FileNotFoundError:
+            return False
+
+    def release(self, lease: Path) -> None:
+        """Hand an item back unprocessed (e.g. on shutdown) without using up an attempt"""
+        item_id = lease.stem.split(OWNER_SEPARATOR)[0]
+        try:
+            os.rename(lease, self._dir("pending") / f"{item_id}.json")
+        except FileNotFoundError:
+            pass
+
+    def _lease_age(self, path: Path) -> Optional[float]:
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            return None
+        # rename updates ctime and renewals update both, so the later one is the last sign of life
+        return time.time() - max(stat.st_mtime, stat.st_ctime)
+
+    def reap(self, owner: str) -> int:
+        """Re-queue items whose lease expired; returns how many were moved"""
+        reaped = 0
+        expired = [
+            path for path in list(self._dir("leased").glob("*.json")) + list(self.reaping_dir.glob("*.json"))
+            if (self._lease_age(path) or 0) > self.lease_seconds
+        ]
+        for path in expired:
+            item_id = path.stem.split(OWNER_SEPARATOR)[0]
+            reaping = self.reaping_dir / f"{item_id}{OWNER_SEPARATOR}{owner}.json"
+            try:
+                os.rename(path, reaping)
+            except FileNotFoundError:
+                continue
+            item = self._read_item(reaping)
+            item["attempts"] = item.get("attempts", 0) + 1
+            previous_owner = path.stem.partition(OWNER_SEPARATOR)[2] or "unknown"
+            if item["attempts"] >= self.manifest["max_attempts"]:
+                self._write_item(self._dir("failed") / f"{item_id}.json", item)
+                logger.error(f"❌ Work item {item_id} failed after {item['attempts']} expired leases")
+            else:
+                self._write_item(self._dir("pending") / f"{item_id}.json", item)
+                logger.warning(f"⚠️  Lease on {item_id} held by {previous_owner} expired, re-queued "
+                               f"(attempt {item['attempts'] + 1})")
+            reaping.unlink()
+            reaped += 1
+        return reaped
+
+    def counts(self) -> Dict[str, int]:
+        counts = {state: len(list(self._dir(state).glob("*.json"))) for state in STATES}
+        counts["leased"] += len(list(self.reaping_dir.glob("*.json")))
+        return counts
+
+    def status(self) -> Dict[str, Any]:
+        """Item counts per state and the current lease holders"""
+        leases = []
+        for path in sorted(self._dir("leased").glob("*.json")):
+            item_id, _, owner = path.stem.partition(OWNER_SEPARATOR)
+            age = self._lease_age(path)
+            if age is not None:
+                leases.append({"item_id": item_id, "owner": owner, "age_seconds": round(age, 1)})
+        return {"items": self.manifest["items"], **self.counts(), "leases": leases}
+
+    # ------------------------------------------------------------------
+    # Results
+    # ------------------------------------------------------------------
+
+    def write_results(self, item_id: str, profiles: Dict[str, Any], cohort: Dict[str, Any],
+                      failures: Dict[str, str], owner: str) -> None:
+        """Replace an item's result directory as a whole"""
+        staging = self.tmp_dir / f"{item_id}{OWNER_SEPARATOR}{owner}"
+        if staging.exists():
+            shutil.rmtree(staging)
+        staging.mkdir(parents=True)
+        for patient_id, profile in profiles.items():
+            _write_json_atomic(staging / f"{patient_id}.json", profile)
+        _write_json_atomic(staging / "summary.json", {
+            "item_id": item_id,
+            "owner": owner,
+            "finished_at": datetime.now().isoformat(),
+            "patients": sorted(profiles),
+            "failures": failures,
+            "cohort": cohort,
+        })
+
+        target = self.results_dir / item_id
+        if target.exists():
+            # A previous lease holder finished after all; its results are equivalent
+            shutil.rmtree(target, ignore_errors=True)
+        os.rename(staging, target)
+
+
+class _LeaseHeartbeat(threading.Thread):
+    """Renews one lease in the background until stopped"""
+
+    def __init__(self, lease: Path, interval: float):
+        super().__init__(daemon=True)
+        self.lease = lease
+        self.interval = interval
+        self.lost = False
+        self._stopped = threading.Event()
+
+    def run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            if not WorkQueue.renew(self.lease):
+                self.lost = True
+                return
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self.join()
+
+
+class QueueWorker:
+    """Claims work items and extracts them until the queue is drained"""
+
+    def __init__(self, queue_dir: str, owner: Optional[str] = None, poll_interval: float = 2.0,
+                 pdf_stats_path: Optional[str] = None):
+        from .data_processor import BiomarkerDataProcessor
+
+        self.queue = WorkQueue(queue_dir)
+        self.owner = owner or default_owner()
+        self.poll_interval = poll_interval
+        self.processor = BiomarkerDataProcessor(pdf_stats_path=pdf_stats_path)
+        self.items_done = 0
+        self.inputs_done = 0
+        self._stop_signal: Optional[int] = None
+
+    def _request_stop(self, signum, frame) -> None:
+        logger.info(f"🛑 Worker {self.owner} received signal {signum}, releasing its lease")
+        self._stop_signal = signum
+
+    def process_item(self, item: Dict[str, Any], lease: Path) -> bool:
+        """Extract one item's inputs and publish its results; False if abandoned"""
+        from .cohort_stats import CohortStatistics
+
+        heartbeat = _LeaseHeartbeat(lease, max(0.5, self.queue.lease_seconds / 3))
+        heartbeat.start()
+        profiles: Dict[str, List] = {}
+        failures: Dict[str, str] = {}
+        cohort = CohortStatistics()
+        try:
+            for path, patient in item["inputs"]:
+                if self._stop_signal is not None or heartbeat.lost:
+                    break
+                try:
+                    profile = self.processor.extractor.parse_input_file(
+                        path, patient, pdf_mode=self.queue.manifest["pdf_mode"]
+                    )
+                except Exception as e:
+                    logger.error(f"❌ Failed to process {path}: {e}")
+                    failures[path] = str(e)
+                    continue
+                cohort.add_profile(profile)
+                profiles.setdefault(profile.patient_id, []).append(profile)
+                self.inputs_done += 1
+        finally:
+            heartbeat.stop()
+
+        if self._stop_signal is not None:
+            self.queue.release(lease)
+            return False
+        if heartbeat.lost:
+            logger.warning(f"⚠️  Lost the lease on {item['item_id']}; another worker will redo it")
+            return False
+
+        merged = {
+            patient_id: merge_patient_profiles(patient_profiles).dict()
+            for patient_id, patient_profiles in profiles.items()
+        }
+        self.queue.write_results(item["item_id"], merged, cohort.to_dict(), failures, self.owner)
+        if not self.queue.complete(lease):
+            logger.warning(f"⚠️  Lease on {item['item_id']} expired before completion; results kept")
+            return False
+        self.items_done += 1
+        logger.info(f"✅ {self.owner} finished {item['item_id']}: {len(item['inputs'])} inputs, "
+                    f"{len(failures)} failed")
+        return True
+
+    def run(self) -> Dict[str, Any]:
+        """Work until nothing is pending or leased, or until signalled"""
+        previous_handlers = {
+            signum: signal.signal(signum, self._request_stop)
+            for signum in (signal.SIGTERM, signal.SIGINT)
+        }
+        logger.info(f"👷 Worker {self.owner} polling {self.queue.root}")
+        try:
+            while self._stop_signal is None:
+                self.queue.reap(self.owner)
+                claimed = self.queue.claim(self.owner)
+                if claimed is not None:
+                    self.process_item(*claimed)
+                    continue
+                if self.queue.counts()["leased"] == 0:
+                    break
+                # Others still hold leases; wait in case one of them expires
+                time.sleep(self.poll_interval)
+        finally:
+            for signum, handler in previous_handlers.items():
+                signal.signal(signum, handler)
+            self.processor.extractor.pdf_backends.save_stats()
+        return {"owner": self.owner, "items": self.items_done, "inputs": self.inputs_done,
+                "interrupted": self._stop_signal is not None}
+
+
+def spawn_local_workers(queue_dir: str, count: int, poll_interval: float = 2.0,
+                        pdf_stats_path: Optional[str] = None) -> List[subprocess.Popen]:
+    """Start ``count`` workers on this machine, standing in for separate nodes"""
+    main_py = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "main.py")
+    extra = ["--pdf-stats", pdf_stats_path] if pdf_stats_path else []
+    return [
+        subprocess.Popen([
+            sys.executable, main_py, "queue", "work", "--queue-dir", queue_dir,
+            "--owner", f"{socket.gethostname()}-local{index}", "--poll-interval", str(poll_interval),
+            *extra,
+        ])
+        for index in range(count)
+    ]
+
+
+def merge_results(queue_dir: str, output_dir: str, allow_partial: bool = False,
+                  cohort_output: Optional[str] = None) -> Dict[str, Any]:
+    """Merge per-item results into per-patient dashboards and cohort statistics
+
+    The cohort percentile tables are written to ``cohort_output`` when given.
+    """
+    from .cohort_stats import CohortStatistics
+    from .data_processor import BiomarkerDataProcessor
+    from .models import PatientProfile
+
+    queue = WorkQueue(queue_dir)
+    counts = queue.counts()
+    unfinished = counts["pending"] + counts["leased"]
+    if unfinished and not allow_partial:
+        raise RuntimeError(f"{unfinished} work item(s) are still pending or leased in {queue_dir}")
+
+    cohort = CohortStatistics()
+    patient_files: Dict[str, List[Path]] = {}
+    failures: Dict[str, str] = {}
+    for done in sorted(queue._dir("done").glob("*.json")):
+        result_dir = queue.results_dir / done.stem
+        with open(result_dir / "summary.json", 'r', encoding='utf-8') as f:
+            summary = json.load(f)
+        cohort.merge(CohortStatistics.from_dict(summary["cohort"]))
+        failures.update(summary["failures"])
+        for patient_id in summary["patients"]:
+            patient_files.setdefault(patient_id, []).append(result_dir / f"{patient_id}.json")
+
+    def load(path: Path) -> PatientProfile:
+        with open(path, 'r', encoding='utf-8') as f:
+            return PatientProfile.parse_obj(json.load(f))
+
+    processor = BiomarkerDataProcessor()
+    output = Path(output_dir)
+    output.mkdir(parents=True, exist_ok=True)
+    if cohort_output:
+        cohort_stats = processor.export_cohort_stats(cohort, cohort_output)
+    else:
+        cohort_stats = cohort.export()
+    # One patient in memory at a time; a patient split across shards is merged here
+    for patient_id, files in sorted(patient_files.items()):
+        profile = merge_patient_profiles(load(path) for path in files)
+        dashboard_data = processor.build_dashboard_data(profile, cohort_stats)
+        processor.export_to_json(dashboard_data, str(output / f"{patient_id}.json"))
+
+    logger.info(f"✅ Merged {counts['done']} work items into {len(patient_files)} patients in {output_dir}")
+    return {"items": counts["done"], "failed_items": counts["failed"], "unfinished_items": unfinished,
+            "patients": len(patient_files), "failed_inputs": len(failures)}
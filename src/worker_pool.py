@@ -0,0 +1,240 @@
+"""
+Pre-fork Extraction Workers
+===========================
+
+Process pool for PDF/JSON extraction that pays the setup cost once. The
+parent builds a ``BiomarkerExtractor`` (compiled patterns, reference and unit
+tables, PDF backends) and imports the heavy PDF libraries, freezes the
+garbage collector so those objects are never touched again, and then forks
+the workers. Workers inherit the ready extractor copy-on-write, so neither
+worker spin-up nor individual tasks rebuild it.
+
+Workers are recycled after ``max_tasks_per_child`` tasks to bound memory
+growth inside the PDF libraries; replacements are forked from the same
+prepared parent. Every task reports the worker pid, its run time and the
+worker's peak RSS so far, and the pool aggregates per-worker throughput and
+memory (a parent's memory profile does not see work done in the workers).
+At most ``window`` tasks are in flight, so finished profiles waiting for
+the parent stay bounded; callers may lower ``window`` while iterating.
+
+Where ``fork`` is unavailable the pool falls back to the platform default
+start method and builds one extractor per worker in an initializer.
+
+Worker log records go through a ``multiprocessing`` queue that the parent's
+log writer drains (see ``logging_setup``). Workers do not write the PDF
+backend stats file themselves: each task returns its backend timings, which
+the parent merges and saves when the pool closes.
+"""
+
+import gc
+import importlib
+import logging
+import multiprocessing
+import os
+import queue
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .extractor import BiomarkerExtractor
+from .logging_setup import configure_worker_logging, worker_log_queue
+from .memory_profile import peak_rss_mb
+from .models import PatientProfile
+from .pdf_backends import BackendSelector, BackendStats
+
+logger = logging.getLogger(__name__)
+
+# Imported in the parent so forked workers share the loaded modules
+PRELOAD_MODULES = ("fitz", "pdfplumber", "dateutil.parser")
+
+# Set in the parent before forking (or per worker by the initializer)
+_EXTRACTOR: Optional[BiomarkerExtractor] = None
+
+
+@dataclass
+class TaskResult:
+    """Outcome of one extraction task"""
+    path: str
+    pid: int
+    seconds: float
+    profile: Optional[PatientProfile] = None
+    error: Optional[str] = None
+    # PDF backend stats recorded by the task, for the parent to merge
+    pdf_stats: Optional[Dict[str, Dict[str, BackendStats]]] = None
+    # Peak RSS of the worker process after the task
+    rss_peak_mb: float = 0.0
+
+
+@dataclass
+class WorkerStats:
+    """Throughput of one worker process"""
+    pid: int
+    tasks: int = 0
+    busy_seconds: float = 0.0
+    failures: int = 0
+    rss_peak_mb: float = 0.0
+
+    @property
+    def tasks_per_second(self) -> float:
+        return self.tasks / self.busy_seconds if self.busy_seconds else 0.0
+
+
+def _init_worker(log_queue: Any = None, log_level: int = logging.INFO,
+                 pdf_stats_path: Optional[str] = None) -> None:
+    """Route the worker's logging to the parent; build the extractor unless inherited"""
+    global _EXTRACTOR
+    configure_worker_logging(log_queue, level=log_level)
+    if _EXTRACTOR is None:
+        _EXTRACTOR = BiomarkerExtractor(pdf_stats_path=pdf_stats_path)
+    # The parent saves the stats this worker hands back with each task
+    _EXTRACTOR.pdf_backends.autosave = False
+
+
+def _run_task(task: Tuple[str, str, str]) -> TaskResult:
+    path, patient, pdf_mode = task
+    started = time.perf_counter()
+    try:
+        profile = _EXTRACTOR.parse_input_file(path, patient, pdf_mode=pdf_mode)
+        result = TaskResult(path, os.getpid(), time.perf_counter() - started, profile=profile)
+    except Exception as e:
+        result = TaskResult(path, os.getpid(), time.perf_counter() - started, error=str(e))
+    result.pdf_stats = _EXTRACTOR.pdf_backends.drain_updates()
+    result.rss_peak_mb = peak_rss_mb()
+    return result
+
+
+class PreforkExtractorPool:
+    """Pool of extraction workers forked from a prepared parent"""
+
+    def __init__(self, processes: Optional[int] = None,
+                 max_tasks_per_child: Optional[int] = 100,
+                 pdf_mode: str = "auto",
+                 preload: Iterable[str] = PRELOAD_MODULES,
+                 pdf_stats_path: Optional[str] = None):
+        self.processes = processes or os.cpu_count() or 1
+        self.max_tasks_per_child = max_tasks_per_child
+        self.pdf_mode = pdf_mode
+        self.pdf_stats_path = pdf_stats_path
+        # Collects the workers' PDF backend stats in this process
+        self.pdf_backends: Optional[BackendSelector] = None
+        self.preload = tuple(preload)
+        # Tasks queued or running at once; each finished one holds a profile until consumed
+        self.window = self.processes * 2
+        self.workers: Dict[int, WorkerStats] = {}
+        self.startup_seconds = 0.0
+        self._pool = None
+        self._frozen = False
+
+    def start(self) -> None:
+        """Prepare the shared state and fork the workers"""
+        global _EXTRACTOR
+        started = time.perf_counter()
+
+        use_fork = "fork" in multiprocessing.get_all_start_methods()
+        if use_fork:
+            _EXTRACTOR = BiomarkerExtractor(pdf_stats_path=self.pdf_stats_path)
+            _EXTRACTOR.pdf_backends.autosave = False
+            self.pdf_backends = _EXTRACTOR.pdf_backends
+            for module in self.preload:
+                try:
+                    importlib.import_module(module)
+                except ImportError:
+                    logger.debug("Preload module %s is not installed", module)
+            # Move everything allocated so far out of the GC's reach, so
+            # collections in the workers do not write to (and copy) shared pages
+            gc.collect()
+            gc.freeze()
+            self._frozen = True
+            context = multiprocessing.get_context("fork")
+        else:
+            context = multiprocessing.get_context()
+            self.pdf_backends = BackendSelector(stats_path=self.pdf_stats_path, autosave=False)
+        initargs = (worker_log_queue(context), logging.getLogger().level, self.pdf_stats_path)
+        self._pool = context.Pool(self.processes, initializer=_init_worker, initargs=initargs,
+                                  maxtasksperchild=self.max_tasks_per_child)
+
+        self.startup_seconds = time.perf_counter() - started
+        logger.info(f"🏭 Started {self.processes} extraction workers "
+                    f"({'fork' if use_fork else 'spawn'}) in {self.startup_seconds:.2f}s")
+
+    def imap(self, inputs: Iterable[Tuple[str, str]]) -> Iterator[TaskResult]:
+        """Extract (path, patient name) inputs, yielding results as they finish
+
+        Tasks are submitted as earlier ones finish, keeping at most
+        ``window`` in flight; a lowered ``window`` applies to the next
+        submissions.
+        """
+        if self._pool is None:
+            self.start()
+        tasks = ((path, patient, self.pdf_mode) for path, patient in inputs)
+        finished: "queue.Queue[Any]" = queue.Queue()
+        in_flight = 0
+        while True:
+            while in_flight < max(1, self.window):
+                task = next(tasks, None)
+                if task is None:
+                    break
+                self._pool.apply_async(_run_task, (task,), callback=finished.put,
+                                       error_callback=finished.put)
+                in_flight += 1
+            if not in_flight:
+                return
+            result = finished.get()
+            in_flight -= 1
+            if isinstance(result, BaseException):
+                raise result
+            stats = self.workers.setdefault(result.pid, WorkerStats(result.pid))
+            stats.tasks += 1
+            stats.busy_seconds += result.seconds
+            if result.error:
+                stats.failures += 1
+            stats.rss_peak_mb = max(stats.rss_peak_mb, result.rss_peak_mb)
+            if result.pdf_stats:
+                self.pdf_backends.merge_updates(result.pdf_stats)
+            yield result
+
+    def close(self, terminate: bool = False) -> None:
+        """Stop the workers (immediately with ``terminate``)"""
+        if self._pool is not None:
+            if terminate:
+                self._pool.terminate()
+            else:
+                self._pool.close()
+            self._pool.join()
+            self._pool = None
+        if self.pdf_backends is not None:
+            self.pdf_backends.save_stats()
+        if self._frozen:
+            gc.unfreeze()
+            self._frozen = False
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        self.close(terminate=exc_type is not None)
+
+    def throughput_report(self) -> List[Dict[str, Any]]:
+        """Per-worker task counts and throughput, busiest first"""
+        return [
+            {
+                "pid": stats.pid,
+                "tasks": stats.tasks,
+                "failures": stats.failures,
+                "busy_seconds": round(stats.busy_seconds, 3),
+                "tasks_per_second": round(stats.tasks_per_second, 2),
+                "rss_peak_mb": round(stats.rss_peak_mb, 1),
+            }
+            for stats in sorted(self.workers.values(), key=lambda s: s.tasks, reverse=True)
+        ]
+
+    def log_throughput(self) -> None:
+        total = sum(s.tasks for s in self.workers.values())
+        recycled = max(0, len(self.workers) - self.processes)
+        logger.info(f"🏭 {total} tasks on {len(self.workers)} worker processes "
+                    f"({recycled} recycled), startup {self.startup_seconds:.2f}s")
+        for row in self.throughput_report():
+            logger.info(f"   worker {row['pid']}: {row['tasks']} tasks, "
+                        f"{row['tasks_per_second']:.2f}/s busy, {row['failures']} failed, "
+                        f"peak RSS {row['rss_peak_mb']:.1f} MB")